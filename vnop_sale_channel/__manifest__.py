@@ -13,6 +13,7 @@
         'sale_management',
         'sale_pdf_quote_builder',
         'stock',
+        'vnop_sync',
     ],
     'data': [
         'security/ir.model.access.csv',
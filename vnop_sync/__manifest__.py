@@ -1,8 +1,8 @@
 {
     'name': 'Product Sync from Server',
-    'version': '18.0.1.1.0',
+    'version': '18.0.1.2.0',
     'category': 'Inventory',
-    'depends': ['base', 'stock', 'product', 'purchase', 'account', 'base_import', 'l10n_vn', 'queue_job', 'queue_job_cron_jobrunner'],
+    'depends': ['base', 'bus', 'stock', 'product', 'purchase', 'account', 'base_import', 'l10n_vn', 'queue_job', 'queue_job_cron_jobrunner'],
     'data': [
         'security/ir.model.access.csv',
         'data/product_import_export_templates.xml',
@@ -25,7 +25,10 @@
         'data/product_lens_photochromic_data.xml',
         'data/product_classification_data.xml',
         'data/queue_job_cleanup_cron.xml',
+        'data/product_sync_outbox_cron.xml',
         'views/product_sync_views.xml',
+        'views/product_sync_error_views.xml',
+        'views/product_sync_outbox_views.xml',
         'views/product_brand_views.xml',
         'views/product_warranty_views.xml',
         'views/product_template_views.xml',
@@ -50,6 +53,10 @@
             'vnop_sync/static/src/js/preview_long_text.js',
             'vnop_sync/static/src/js/product_kanban_buttons.js',
             'vnop_sync/static/src/xml/product_kanban_buttons.xml',
+            'vnop_sync/static/src/js/sync_progress_widget.js',
+            'vnop_sync/static/src/xml/sync_progress_widget.xml',
+            'vnop_sync/static/src/js/import_preview_rows.js',
+            'vnop_sync/static/src/xml/import_preview_rows.xml',
         ],
     },
     'installable': True,
@@ -0,0 +1,29 @@
+"""Auto-run khi -u vnop_sync lên version 18.0.1.2.0.
+
+Tạo sẵn cột product_template.x_has_image và fill bằng SQL từ ir_attachment,
+để ORM không phải compute (đọc ảnh) cho toàn bộ catalog khi thêm field.
+"""
+
+import logging
+
+from odoo.tools.sql import column_exists, create_column
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    if column_exists(cr, 'product_template', 'x_has_image'):
+        return
+    create_column(cr, 'product_template', 'x_has_image', 'boolean')
+    cr.execute("""
+        UPDATE product_template pt
+           SET x_has_image = EXISTS (
+                SELECT 1 FROM ir_attachment a
+                 WHERE a.res_model = 'product.template'
+                   AND a.res_field = 'image_1920'
+                   AND a.res_id = pt.id
+           )
+    """)
+    _logger.info("vnop_sync migrate 18.0.1.2.0: x_has_image đã fill cho %s product.template", cr.rowcount)
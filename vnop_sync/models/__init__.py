@@ -1,8 +1,14 @@
+from . import rs_client
+from . import rs_token
+from . import rs_mapping
+from . import sync_progress
 from . import product_master_data
 from . import product_lens_config
 from . import product_lens
 from . import product_opt
 from . import product_sync
+from . import product_sync_error
+from . import product_sync_outbox
 from . import product_template_ext
 from . import product_brand
 from . import product_warranty
@@ -12,6 +18,7 @@ from . import product_shape
 from . import product_material
 from . import product_color
 from . import res_partner_supplier
+from . import product_code_index
 from . import res_bank_display_name_patch
 
 from . import product_template_debug_log
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""Engine import staging cho file master lớn (bảng giá tròng hàng trăm nghìn dòng).
+
+Đường ORM (`_create_vn_rows`) đi dòng → vals → `create` từng batch 200: ổn với
+vài trăm dòng, chậm với file lớn (mỗi batch tạo variant, recompute, tracking).
+Engine này:
+
+1. COPY (vals, tên, mã vạch) từng dòng vào bảng UNLOGGED `vnop_import_stage_<wizard>`;
+2. chuẩn hoá khoá + phát hiện trùng trong file / đã có trong DB bằng SQL;
+3. INSERT ... SELECT set-based vào product_template, product_product và bảng
+   quan hệ many2many theo lô `IMPORT_STAGING_BATCH` dòng (1 commit / lô);
+4. recompute field compute-stored cho cả lô 1 lần, lỗi từng dòng ghi lại trên
+   bảng staging. Lô lỗi SQL → tạo lại qua ORM từng dòng để chỉ ra dòng hỏng.
+
+Giá trị từng ô vẫn do `_row_to_vals` (map master data cache trong process) tính,
+nên 2 đường import cho ra cùng 1 sản phẩm. Bảng staging sống qua commit → job
+chạy lại thì tiếp tục các dòng chưa xong.
+
+    IMPORT_STAGING_ENGINE     bật engine, mặc định False
+    IMPORT_STAGING_MIN_ROWS   số dòng tối thiểu để dùng engine, mặc định 5000
+    IMPORT_STAGING_BATCH      số dòng mỗi lô INSERT, mặc định 20000
+"""
+import csv
+import io
+import json
+import logging
+import os
+
+_logger = logging.getLogger(__name__)
+
+TABLE_PREFIX = 'vnop_import_stage_'
+# Số dòng mỗi lệnh COPY (buffer CSV trong bộ nhớ).
+_COPY_CHUNK = 5000
+
+
+def _env_int(name, default, minimum=0):
+    try:
+        return max(minimum, int(os.getenv(name, default)))
+    except (TypeError, ValueError):
+        return int(default)
+
+
+def staging_enabled(row_count):
+    if os.getenv('IMPORT_STAGING_ENGINE', 'False').lower() != 'true':
+        return False
+    return row_count >= _env_int('IMPORT_STAGING_MIN_ROWS', '5000', minimum=1)
+
+
+def gc_staging_tables(cr, live_ids):
+    """Xoá bảng staging của wizard không còn tồn tại (transient đã bị dọn)."""
+    cr.execute(
+        "SELECT tablename FROM pg_tables WHERE schemaname = current_schema() AND tablename LIKE %s",
+        [TABLE_PREFIX.replace('_', r'\_') + '%'],
+    )
+    dropped = 0
+    for (table,) in cr.fetchall():
+        suffix = table[len(TABLE_PREFIX):]
+        if suffix.isdigit() and int(suffix) not in live_ids:
+            cr.execute(f'DROP TABLE IF EXISTS "{table}"')
+            dropped += 1
+    return dropped
+
+
+def _json_default(value):
+    return str(value)
+
+
+class StagingProductImport:
+    """Bảng staging + merge set-based cho 1 lượt import product.template của 1 wizard."""
+
+    # status: new → done | exists_name | dup_name | exists_barcode | dup_barcode | error
+    def __init__(self, env, wizard_id):
+        self.env = env
+        self.cr = env.cr
+        self.table = f'{TABLE_PREFIX}{int(wizard_id)}'
+        self.batch_size = _env_int('IMPORT_STAGING_BATCH', '20000', minimum=1)
+        self.Template = env['product.template'].with_context(
+            tracking_disable=True, mail_create_nolog=True, mail_notrack=True,
+        )
+        self.Variant = env['product.product'].with_context(self.Template.env.context)
+
+    # ── Bảng staging ───────────────────────────────────────────
+
+    def exists(self):
+        self.cr.execute('SELECT to_regclass(%s)', [self.table])
+        return bool(self.cr.fetchone()[0])
+
+    def create_table(self):
+        self.cr.execute(f"""
+            DROP TABLE IF EXISTS {self.table};
+            CREATE UNLOGGED TABLE {self.table} (
+                row_no int4 PRIMARY KEY,
+                name varchar,
+                barcode varchar,
+                vals jsonb NOT NULL,
+                status varchar NOT NULL DEFAULT 'new',
+                error text,
+                tmpl_id int4
+            )
+        """)
+
+    def drop(self):
+        self.cr.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+    def copy_rows(self, items):
+        """COPY `items` = iterable (row_no, vals, error) vào bảng staging.
+
+        `vals` là dict cho product.template.create; `error` khác rỗng → dòng được
+        ghi status 'error', không import."""
+        defaults = self._defaults()
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        pending = 0
+        for row_no, vals, error in items:
+            if error:
+                writer.writerow([row_no, '', '', '{}', 'error', error])
+            else:
+                full = dict(defaults)
+                full.update(vals)
+                full = self._prepare_vals(full)
+                writer.writerow([
+                    row_no, full.get('name') or '', full.get('barcode') or '',
+                    json.dumps(full, ensure_ascii=False, default=_json_default), 'new', '',
+                ])
+            pending += 1
+            if pending >= _COPY_CHUNK:
+                self._copy(buf)
+                buf, pending = io.StringIO(), 0
+                writer = csv.writer(buf)
+        if pending:
+            self._copy(buf)
+
+    def _copy(self, buf):
+        buf.seek(0)
+        self.cr.copy_expert(
+            f'COPY {self.table} (row_no, name, barcode, vals, status, error) FROM STDIN WITH (FORMAT csv)',
+            buf,
+        )
+
+    def _defaults(self):
+        """Default của template + variant tính 1 lần cho cả file (thay cho default_get mỗi dòng)."""
+        tmpl_fields = [n for n, f in self.Template._fields.items() if f.store and not f.automatic]
+        variant_fields = [n for n, f in self.Variant._fields.items()
+                          if f.store and not f.automatic and not f.inherited and n != 'product_tmpl_id']
+        defaults = self.Variant.default_get(variant_fields)
+        defaults.update(self.Template.default_get(tmpl_fields))
+        return defaults
+
+    def _prepare_vals(self, vals):
+        """Vals → dạng ghi được bằng SQL: bỏ False/None (= NULL), m2m → list id."""
+        res = {}
+        for key, value in vals.items():
+            field = self.Template._fields.get(key) or self.Variant._fields.get(key)
+            if field is None or value is None or (value is False and field.type != 'boolean'):
+                continue
+            if field.type == 'many2many' and isinstance(value, (list, tuple)):
+                value = self._m2m_ids(value)
+            res[key] = value
+        return res
+
+    @staticmethod
+    def _m2m_ids(commands):
+        ids = []
+        for cmd in commands:
+            if isinstance(cmd, int):
+                ids.append(cmd)
+            elif isinstance(cmd, (list, tuple)) and cmd and cmd[0] == 6:
+                ids = list(cmd[2])
+            elif isinstance(cmd, (list, tuple)) and cmd and cmd[0] == 4:
+                ids.append(cmd[1])
+        return ids
+
+    # ── Chuẩn hoá + kiểm trùng (SQL) ───────────────────────────
+
+    def mark_duplicates(self):
+        """Đánh dấu dòng không import: trống tên, trùng trong file, đã có trong DB.
+
+        Cùng quy tắc với `_create_vn_rows`: tên so cả bản ghi archived, dòng đầu
+        tiên của 1 tên / mã vạch trong file được giữ. Tên so theo từng key ngôn
+        ngữ ở 1 UPDATE riêng (điều kiện bằng → hash join; OR → nested loop)."""
+        t = self.table
+        lang = self.env.lang or 'en_US'
+        self.env.flush_all()
+        self.cr.execute(f"""
+            UPDATE {t} SET name = NULLIF(btrim(name), ''), barcode = NULLIF(btrim(barcode), '');
+            UPDATE {t} SET status = 'error', error = 'Thiếu tên sản phẩm'
+             WHERE status = 'new' AND name IS NULL;
+            UPDATE {t} s SET status = 'exists_name'
+              FROM product_template p
+             WHERE s.status = 'new' AND p.name->>'en_US' = s.name;
+            UPDATE {t} s SET status = 'exists_name'
+              FROM product_template p
+             WHERE s.status = 'new' AND p.name->>%(lang)s = s.name;
+            UPDATE {t} s SET status = 'dup_name'
+              FROM (SELECT row_no, row_number() OVER (PARTITION BY name ORDER BY row_no) AS rn
+                      FROM {t} WHERE status = 'new') d
+             WHERE d.row_no = s.row_no AND d.rn > 1;
+            UPDATE {t} s SET status = 'exists_barcode'
+              FROM product_product pp
+             WHERE s.status = 'new' AND s.barcode IS NOT NULL AND pp.barcode = s.barcode;
+            UPDATE {t} s SET status = 'dup_barcode'
+              FROM (SELECT row_no, row_number() OVER (PARTITION BY barcode ORDER BY row_no) AS rn
+                      FROM {t} WHERE status = 'new' AND barcode IS NOT NULL) d
+             WHERE d.row_no = s.row_no AND d.rn > 1;
+        """, {'lang': lang})
+
+    # ── Merge set-based ────────────────────────────────────────
+
+    def _staged_keys(self):
+        self.cr.execute(f"SELECT DISTINCT jsonb_object_keys(vals) FROM {self.table} WHERE status = 'new'")
+        return {k for (k,) in self.cr.fetchall()}
+
+    @staticmethod
+    def _is_column(field):
+        """Cột ghi thẳng được: stored, không compute (hoặc compute sửa được như uom_po_id)."""
+        if not (field.store and field.column_type) or field.automatic or field.inherited:
+            return False
+        return not field.compute or (not field.readonly and not field.related)
+
+    def _plan(self, keys):
+        """Chia key của vals: cột template / cột variant / m2m / o2m / ghi lại qua ORM."""
+        tmpl_fields = self.Template._fields
+        variant_fields = self.Variant._fields
+        plan = {'template': [], 'variant': [], 'm2m': [], 'o2m': [], 'orm': []}
+        for key in sorted(keys):
+            field = tmpl_fields.get(key)
+            variant_field = variant_fields.get(key) if key != 'product_tmpl_id' else None
+            # Cùng tên ở cả 2 bảng (active...) → ghi cả 2.
+            to_template = field is not None and self._is_column(field)
+            to_variant = variant_field is not None and self._is_column(variant_field)
+            if to_template:
+                plan['template'].append(field)
+            if to_variant:
+                plan['variant'].append(variant_field)
+            if to_template or to_variant:
+                continue
+            if field is not None and field.type == 'many2many' and field.store and not field.compute:
+                plan['m2m'].append(field)
+            elif field is not None and field.type == 'one2many' and not field.compute:
+                plan['o2m'].append(field)
+            elif field is not None or variant_field is not None:
+                plan['orm'].append(key)
+        return plan
+
+    def _column_expr(self, field):
+        key = field.name
+        if field.company_dependent:
+            return f"CASE WHEN s.vals ? '{key}' THEN jsonb_build_object(%(company)s, s.vals->'{key}') END"
+        if field.translate:
+            return (f"CASE WHEN s.vals ? '{key}' THEN "
+                    f"jsonb_build_object('en_US', s.vals->>'{key}', %(lang)s, s.vals->>'{key}') END")
+        if field.column_type[0] == 'jsonb':
+            return f"s.vals->'{key}'"
+        return f"(s.vals->>'{key}')::{field.column_type[1]}"
+
+    def merge(self, on_batch=None):
+        """Import các dòng 'new' theo lô; `on_batch(done, created)` sau mỗi lô (caller commit)."""
+        keys = self._staged_keys()
+        if not keys:
+            return
+        plan = self._plan(keys)
+        done = 0
+        while True:
+            self.cr.execute(
+                f"SELECT row_no FROM {self.table} WHERE status = 'new' ORDER BY row_no LIMIT %s",
+                [self.batch_size],
+            )
+            row_nos = [r for (r,) in self.cr.fetchall()]
+            if not row_nos:
+                break
+            try:
+                with self.cr.savepoint():
+                    created = self._insert_batch(row_nos, plan)
+            except Exception:
+                _logger.exception('Staging import: lô %s dòng lỗi, tạo lại qua ORM', len(row_nos))
+                self.env.invalidate_all()
+                created = self._create_batch_orm(row_nos)
+            done += len(row_nos)
+            if on_batch:
+                on_batch(done, created)
+
+    def _insert_batch(self, row_nos, plan):
+        t = self.table
+        uid = self.env.uid
+        now = self.cr.now()
+        params = {
+            'rows': row_nos, 'uid': uid, 'now': now,
+            'lang': self.env.lang or 'en_US', 'company': str(self.env.company.id),
+        }
+        self.cr.execute(f"""
+            UPDATE {t} SET tmpl_id = nextval('product_template_id_seq')
+             WHERE row_no = ANY(%(rows)s)
+        """, params)
+
+        def _insert(table, fields, link):
+            columns = ''.join(f', "{f.name}"' for f in fields)
+            exprs = ''.join(f', {self._column_expr(f)}' for f in fields)
+            self.cr.execute(f"""
+                INSERT INTO {table} ({link}, create_uid, create_date, write_uid, write_date{columns})
+                SELECT s.tmpl_id, %(uid)s, %(now)s, %(uid)s, %(now)s{exprs}
+                  FROM {t} s WHERE s.row_no = ANY(%(rows)s) ORDER BY s.row_no
+            """, params)
+
+        _insert('product_template', plan['template'], 'id')
+        # 1 variant / template (file master không có thuộc tính biến thể).
+        _insert('product_product', plan['variant'], 'product_tmpl_id')
+        for field in plan['m2m']:
+            self.cr.execute(f"""
+                INSERT INTO {field.relation} ({field.column1}, {field.column2})
+                SELECT s.tmpl_id, v::int4
+                  FROM {t} s, jsonb_array_elements_text(s.vals->'{field.name}') v
+                 WHERE s.row_no = ANY(%(rows)s) AND jsonb_typeof(s.vals->'{field.name}') = 'array'
+                ON CONFLICT DO NOTHING
+            """, params)
+
+        self.cr.execute(f"""
+            SELECT tmpl_id, vals FROM {t} WHERE row_no = ANY(%(rows)s) ORDER BY row_no
+        """, params)
+        staged = self.cr.fetchall()
+        tmpl_ids = [tmpl_id for tmpl_id, _vals in staged]
+        self.env.invalidate_all()
+
+        for field in plan['o2m']:
+            line_vals = [
+                dict(cmd[2], **{field.inverse_name: tmpl_id})
+                for tmpl_id, vals in staged
+                for cmd in (vals.get(field.name) or [])
+                if isinstance(cmd, list) and len(cmd) == 3 and cmd[0] == 0
+            ]
+            if line_vals:
+                self.env[field.comodel_name].with_context(self.Template.env.context).create(line_vals)
+        if plan['orm']:
+            for tmpl_id, vals in staged:
+                rest = {k: vals[k] for k in plan['orm'] if k in vals}
+                if rest:
+                    self.Template.browse(tmpl_id).write(rest)
+
+        self._recompute(staged, plan)
+        # INSERT SQL không qua @api.constrains → kiểm lại như create(); vi phạm
+        # raise trong savepoint → merge() tạo lại lô qua ORM, báo đúng dòng lỗi.
+        keys = set().union(*(vals for _tmpl_id, vals in staged))
+        variants = self.Variant.with_context(active_test=False).search([('product_tmpl_id', 'in', tmpl_ids)])
+        self.Template.browse(tmpl_ids)._validate_fields(keys)
+        variants._validate_fields(keys | {'product_tmpl_id'})
+        # Variant chèn bằng SQL không qua create() → tự cập nhật chỉ mục mã.
+        self.env['product.code.index'].sudo()._refresh_products(variants.ids)
+        self.cr.execute(f"UPDATE {t} SET status = 'done' WHERE row_no = ANY(%(rows)s)", params)
+        return tmpl_ids
+
+    def _recompute(self, staged, plan):
+        """Field compute-stored của template + variant mới: recompute 1 lần cho cả lô.
+
+        Field compute sửa được mà dòng đã có giá trị (ghi ở INSERT) thì giữ nguyên."""
+        templates = self.Template.browse([tmpl_id for tmpl_id, _vals in staged])
+        variants = self.Variant.search([('product_tmpl_id', 'in', templates.ids)])
+        provided = {f.name for f in plan['template'] + plan['variant'] if f.compute}
+        for records in (templates, variants):
+            for field in records._fields.values():
+                if not (field.store and field.compute):
+                    continue
+                todo = records
+                if field.name in provided:
+                    missing = {tmpl_id for tmpl_id, vals in staged if field.name not in vals}
+                    todo = records.filtered(
+                        lambda r: (r.id if r._name == 'product.template' else r.product_tmpl_id.id) in missing)
+                if todo:
+                    self.env.add_to_compute(field, todo)
+        self.env.flush_all()
+
+    def _create_batch_orm(self, row_nos):
+        """Fallback khi lô SQL lỗi: create qua ORM từng dòng, ghi lỗi vào staging."""
+        t = self.table
+        self.cr.execute(f"""
+            UPDATE {t} SET tmpl_id = NULL WHERE row_no = ANY(%s);
+            SELECT row_no, vals FROM {t} WHERE row_no = ANY(%s) ORDER BY row_no
+        """, [row_nos, row_nos])
+        created = []
+        for row_no, vals in self.cr.fetchall():
+            try:
+                with self.cr.savepoint():
+                    rec = self.Template.create(vals)
+                created.append(rec.id)
+                self.cr.execute(
+                    f"UPDATE {t} SET status = 'done', tmpl_id = %s WHERE row_no = %s", [rec.id, row_no])
+            except Exception as e:
+                self.cr.execute(
+                    f"UPDATE {t} SET status = 'error', error = %s WHERE row_no = %s", [str(e), row_no])
+        return created
+
+    # ── Kết quả ────────────────────────────────────────────────
+
+    def processed_count(self):
+        self.cr.execute(f"SELECT count(*) FROM {self.table} WHERE status <> 'new'")
+        return self.cr.fetchone()[0]
+
+    def result(self):
+        """{created_ids, skipped_existing, skipped_barcode, errors} như `_create_vn_rows`."""
+        res = {'created_ids': [], 'skipped_existing': 0, 'skipped_barcode': 0, 'errors': []}
+        self.cr.execute(f"""
+            SELECT row_no, status, name, barcode, error, tmpl_id
+              FROM {self.table} WHERE status <> 'new' ORDER BY row_no
+        """)
+        for row_no, status, name, barcode, error, tmpl_id in self.cr.fetchall():
+            if status == 'done':
+                res['created_ids'].append(tmpl_id)
+            elif status in ('exists_name', 'dup_name'):
+                res['skipped_existing'] += 1
+            elif status in ('exists_barcode', 'dup_barcode'):
+                res['skipped_barcode'] += 1
+                res['errors'].append('Dòng %s ("%s"): mã vạch "%s" đã tồn tại, bỏ qua.' % (
+                    row_no, name, barcode))
+            elif name:
+                res['errors'].append('Dòng %s ("%s"): %s' % (row_no, name, error))
+            else:
+                res['errors'].append('Dòng %s: %s' % (row_no, error))
+        return res
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Context kiểm tra trùng tên / mã vạch dùng chung cho kiểm thử, xem trước và import.
+
+Trước đây mỗi bước (kiểm thử, `_assert_no_duplicates`, import) tự dựng set và
+tự `search([('name', 'in', <toàn bộ tên>)])` → câu SQL khổng lồ, lặp 3-4 lần
+mỗi lần import. `ImportKeyIndex` duyệt file 1 lần, tính trùng trong file 1 lần
+và tra tồn tại trong DB theo lô `IN_CHUNK` giá trị (search_read chỉ đọc đúng
+cột cần), kết quả được cache để các bước sau dùng lại.
+
+    IMPORT_EXISTS_CHUNK   số giá trị mỗi lần tra DB, mặc định 1000
+"""
+import os
+
+from odoo.tools import split_every
+
+try:
+    IN_CHUNK = max(1, int(os.getenv('IMPORT_EXISTS_CHUNK', '1000')))
+except (TypeError, ValueError):
+    IN_CHUNK = 1000
+
+
+def _cell(row, idx):
+    if idx is None or idx >= len(row):
+        return ''
+    return (row[idx] or '').strip()
+
+
+class ImportKeyIndex:
+    """Tên / mã vạch của 1 file import: vị trí xuất hiện + tồn tại trong DB (lazy, cache)."""
+
+    def __init__(self, env):
+        self.env = env
+        self.names = {}            # name → dòng đầu tiên
+        self.barcodes = {}         # barcode → dòng đầu tiên
+        self.dup_names = {}        # name → [các dòng]
+        self.dup_barcodes = {}     # barcode → [các dòng]
+        self.codes = set()         # barcode + mã phụ (default_code) để tra tồn tại
+        self.row_count = 0         # số dòng đã add (đếm luôn trong lượt stream)
+        self._existing = {}
+
+    @classmethod
+    def from_rows(cls, env, rows, name_idx=None, barcode_idx=None, code_idx=None):
+        index = cls(env)
+        for row_no, row in enumerate(rows, start=1):
+            index.add(row_no, _cell(row, name_idx), _cell(row, barcode_idx), _cell(row, code_idx))
+        return index
+
+    def add(self, row_no, name='', barcode='', code=''):
+        self.row_count += 1
+        if name:
+            if name in self.names:
+                self.dup_names.setdefault(name, [self.names[name]]).append(row_no)
+            else:
+                self.names[name] = row_no
+        if barcode:
+            self.codes.add(barcode)
+            if barcode in self.barcodes:
+                self.dup_barcodes.setdefault(barcode, [self.barcodes[barcode]]).append(row_no)
+            else:
+                self.barcodes[barcode] = row_no
+        if code:
+            self.codes.add(code)
+
+    def _existing_values(self, field_name, values):
+        if field_name not in self._existing:
+            Tmpl = self.env['product.template'].with_context(active_test=False)
+            found = set()
+            for chunk in split_every(IN_CHUNK, sorted(values), list):
+                found.update(
+                    r[field_name] for r in Tmpl.search_read([(field_name, 'in', chunk)], [field_name])
+                    if r[field_name]
+                )
+            self._existing[field_name] = found
+        return self._existing[field_name]
+
+    def existing_names(self):
+        """Tên trong file đã có product.template (kể cả archived)."""
+        return self._existing_values('name', self.names)
+
+    def existing_barcodes(self):
+        """Mã vạch của cột barcode đã tồn tại."""
+        return self._existing_values('barcode', self.codes) & set(self.barcodes)
+
+    def existing_codes(self):
+        """Mọi mã (barcode + default_code → barcode) đã tồn tại."""
+        return self._existing_values('barcode', self.codes)
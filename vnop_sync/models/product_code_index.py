@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Chỉ mục mã sản phẩm đã chuẩn hoá (compact_key) để tra nhanh khi import dòng.
+
+File Excel của NCC / khách ghi mã đủ kiểu: khác hoa thường, có khoảng trắng,
+dấu gạch, hoặc dùng mã vạch / mã NCC (seller_ids.product_code) thay cho mã nội
+bộ. Bảng `product_code_index` giữ (mã chuẩn hoá, variant, nguồn) cho cả 3 loại
+mã, cập nhật tăng dần khi variant / bảng giá NCC đổi; tra cả file là 1 query
+trên cột `code` có index.
+
+Mã khớp đúng nguyên văn 1 mã nội bộ được nhận trước (`AB-12` và `AB12` là 2
+sản phẩm khác nhau); chỉ mã không khớp nguyên văn mới tra qua mã chuẩn hoá.
+Ưu tiên khi 1 mã khớp nhiều nguồn: mã nội bộ > mã vạch > mã NCC. Cùng nguồn mà
+khớp nhiều variant → coi là mơ hồ, caller báo lỗi thay vì đoán.
+"""
+from collections import defaultdict
+
+from odoo import api, fields, models
+from odoo.tools import split_every
+
+from .text_norm import compact_key
+
+_SOURCE_RANK = {'default_code': 0, 'barcode': 1, 'supplier': 2}
+_REFRESH_CHUNK = 1000
+
+
+class ProductCodeIndex(models.Model):
+    _name = 'product.code.index'
+    _description = 'Chỉ mục mã sản phẩm chuẩn hoá'
+    _log_access = False
+
+    code = fields.Char(string='Mã chuẩn hoá', required=True, index=True)
+    product_id = fields.Many2one(
+        'product.product', string='Sản phẩm', required=True, index=True, ondelete='cascade',
+    )
+    source = fields.Selection([
+        ('default_code', 'Mã nội bộ'),
+        ('barcode', 'Mã vạch'),
+        ('supplier', 'Mã NCC'),
+    ], string='Nguồn', required=True)
+
+    _sql_constraints = [
+        ('code_product_source_uniq', 'unique(code, product_id, source)',
+         'Mã đã có trong chỉ mục của sản phẩm này.'),
+    ]
+
+    def init(self):
+        # Cài mới / nâng cấp module trên DB đã có sản phẩm: dựng chỉ mục 1 lần.
+        self.env.cr.execute('SELECT 1 FROM product_code_index LIMIT 1')
+        if not self.env.cr.fetchone():
+            self._rebuild_code_index()
+
+    @api.model
+    def _rebuild_code_index(self):
+        """Dựng lại toàn bộ chỉ mục (kể cả variant archived)."""
+        self.env.cr.execute('SELECT id FROM product_product ORDER BY id')
+        self._refresh_products([pid for (pid,) in self.env.cr.fetchall()])
+
+    @api.model
+    def _refresh_products(self, product_ids):
+        """Xoá + dựng lại dòng chỉ mục của các variant (đọc thẳng DB sau flush)."""
+        product_ids = sorted(set(product_ids))
+        if not product_ids:
+            return
+        cr = self.env.cr
+        self.env['product.product'].flush_model(['default_code', 'barcode'])
+        self.env['product.supplierinfo'].flush_model(['product_code', 'product_id', 'product_tmpl_id'])
+        for chunk in split_every(_REFRESH_CHUNK, product_ids, list):
+            cr.execute('DELETE FROM product_code_index WHERE product_id = ANY(%s)', [chunk])
+            entries = set()
+            cr.execute('SELECT id, default_code, barcode FROM product_product WHERE id = ANY(%s)', [chunk])
+            for pid, default_code, barcode in cr.fetchall():
+                entries.add((compact_key(default_code), pid, 'default_code'))
+                entries.add((compact_key(barcode), pid, 'barcode'))
+            cr.execute("""
+                SELECT pp.id, si.product_code
+                  FROM product_supplierinfo si
+                  JOIN product_product pp
+                    ON pp.id = si.product_id
+                    OR (si.product_id IS NULL AND pp.product_tmpl_id = si.product_tmpl_id)
+                 WHERE pp.id = ANY(%s) AND si.product_code IS NOT NULL
+            """, [chunk])
+            for pid, product_code in cr.fetchall():
+                entries.add((compact_key(product_code), pid, 'supplier'))
+            entries = [e for e in entries if e[0]]
+            if entries:
+                codes, pids, sources = zip(*entries)
+                cr.execute("""
+                    INSERT INTO product_code_index (code, product_id, source)
+                    SELECT * FROM unnest(%s::varchar[], %s::int4[], %s::varchar[])
+                    ON CONFLICT DO NOTHING
+                """, [list(codes), list(pids), list(sources)])
+        self.invalidate_model()
+
+    @api.model
+    def _resolve_codes(self, codes):
+        """Tra 1 lượt các mã như trong file → (found {mã: product}, ambiguous {mã}).
+
+        Khớp nguyên văn default_code trước, còn lại tra theo compact_key(mã).
+        Chỉ trả variant user được xem và đang active."""
+        codes = {c for c in codes if c}
+        found, ambiguous = {}, set()
+        if not codes:
+            return found, ambiguous
+        exact = defaultdict(list)
+        for product in self.env['product.product'].search([('default_code', 'in', sorted(codes))]):
+            exact[product.default_code].append(product)
+        for code, products in exact.items():
+            if len(products) == 1:
+                found[code] = products[0]
+            else:
+                ambiguous.add(code)
+
+        codes_by_key = defaultdict(set)
+        for code in codes - set(found) - ambiguous:
+            key = compact_key(code)
+            if key:
+                codes_by_key[key].add(code)
+        if not codes_by_key:
+            return found, ambiguous
+        self.flush_model()
+        self.env.cr.execute(
+            'SELECT code, product_id, source FROM product_code_index WHERE code = ANY(%s)',
+            [sorted(codes_by_key)],
+        )
+        rows = self.env.cr.fetchall()
+        products = self.env['product.product'].search([('id', 'in', list({pid for _c, pid, _s in rows}))])
+        by_id = {p.id: p for p in products}
+
+        best = {}  # key → (rank, {product_id})
+        for code, pid, source in rows:
+            if pid not in by_id:
+                continue
+            rank = _SOURCE_RANK[source]
+            current = best.get(code)
+            if current is None or rank < current[0]:
+                best[code] = (rank, {pid})
+            elif rank == current[0]:
+                current[1].add(pid)
+
+        for key, (_rank, pids) in best.items():
+            for code in codes_by_key[key]:
+                if len(pids) == 1:
+                    found[code] = by_id[next(iter(pids))]
+                else:
+                    ambiguous.add(code)
+        return found, ambiguous
+
+
+class ProductProduct(models.Model):
+    _inherit = 'product.product'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        products = super().create(vals_list)
+        self.env['product.code.index'].sudo()._refresh_products(products.ids)
+        return products
+
+    def write(self, vals):
+        # Sync RS ghi lại barcode mỗi lần cập nhật → chỉ dựng lại chỉ mục khi mã
+        # chuẩn hoá thực sự đổi.
+        tracked = [name for name in ('default_code', 'barcode') if name in vals]
+        changed = self.filtered(lambda p: any(
+            compact_key(p[name]) != compact_key(vals[name]) for name in tracked
+        )) if tracked else self.browse()
+        res = super().write(vals)
+        if changed:
+            self.env['product.code.index'].sudo()._refresh_products(changed.ids)
+        return res
+
+
+class ProductSupplierinfo(models.Model):
+    _inherit = 'product.supplierinfo'
+
+    def _code_index_product_ids(self):
+        """Variant chịu ảnh hưởng: product_id, hoặc mọi variant của template nếu để trống."""
+        ids = set(self.product_id.ids)
+        templates = self.filtered(lambda s: not s.product_id).product_tmpl_id
+        ids.update(templates.with_context(active_test=False).product_variant_ids.ids)
+        return ids
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._refresh_code_index(set())
+        return records
+
+    def write(self, vals):
+        tracked = {'product_code', 'product_id', 'product_tmpl_id'} & set(vals)
+        before = self._code_index_product_ids() if tracked else set()
+        res = super().write(vals)
+        if tracked:
+            self._refresh_code_index(before)
+        return res
+
+    def unlink(self):
+        product_ids = self._code_index_product_ids()
+        res = super().unlink()
+        self.env['product.code.index'].sudo()._refresh_products(product_ids)
+        return res
+
+    def _refresh_code_index(self, extra_product_ids):
+        self.env['product.code.index'].sudo()._refresh_products(
+            self._code_index_product_ids() | set(extra_product_ids))
@@ -4,6 +4,8 @@ from collections import defaultdict
 from odoo import _, api, models
 from odoo.exceptions import ValidationError
 
+from .import_validation import ImportKeyIndex
+
 
 # ─────────────────────────────────────────────────────────────────────────
 #   IMPORT TEMPLATE CONSTANTS
@@ -326,9 +328,57 @@ class ProductTemplateImportBaseInherit(models.Model):
             return record.name
         return record.display_name
 
+    def _vnop_iter_reference_tokens(self, field_name, raw_value):
+        """Token tra cứu của 1 cell (đã normalize, tách ',' với field nhiều giá trị)."""
+        normalized = self._vnop_normalize_import_value(raw_value)
+        if field_name in self._VNOP_LENS_M2O_FIELDS:
+            normalized = self._vnop_normalize_lens_power_token(normalized)
+        if not normalized:
+            return []
+        if self._VNOP_RELATIONAL_FIELDS[field_name]['multi']:
+            return [x.strip() for x in normalized.split(',') if self._vnop_normalize_import_value(x)]
+        return [normalized]
+
+    def _vnop_bulk_resolve_references(self, fields, rows):
+        """Resolve theo cột: gom token khác nhau theo model, mỗi (model, search key)
+        chỉ 1 search_read → {model_name: {token: record}}.
+
+        Thứ tự key và thứ tự record (`_order`) giống `_find_one` trong
+        `_vnop_resolve_reference` nên kết quả khớp với tra cứu từng cell.
+        """
+        index_by_field = {field_name: index for index, field_name in enumerate(fields)}
+        tokens_by_model = defaultdict(set)
+        for field_name in fields:
+            if field_name not in self._VNOP_RELATIONAL_FIELDS or field_name not in index_by_field:
+                continue
+            idx = index_by_field[field_name]
+            model_name = self._fields[field_name].comodel_name
+            for row in rows:
+                if idx < len(row):
+                    tokens_by_model[model_name].update(self._vnop_iter_reference_tokens(field_name, row[idx]))
+
+        token_map = {}
+        for model_name, tokens in tokens_by_model.items():
+            model = self.env[model_name].sudo()
+            ids_by_token = {}
+            pending = set(tokens)
+            for key in self._vnop_get_search_keys(model_name):
+                if not pending:
+                    break
+                for rec in model.search_read([(key, 'in', list(pending))], [key], order=model._order):
+                    value = rec[key]
+                    if value in pending and value not in ids_by_token:
+                        ids_by_token[value] = rec['id']
+                pending.difference_update(ids_by_token)
+            # 1 recordset chung → label (_vnop_display_import_label) đọc theo lô nhờ prefetch.
+            records = {rec.id: rec for rec in model.browse(set(ids_by_token.values()))}
+            token_map[model_name] = {token: records[rec_id] for token, rec_id in ids_by_token.items()}
+        return token_map
+
     def _vnop_pre_resolve_relational_cells(self, fields, rows):
         """Resolve relational tokens (code/cid/name) before delegating to Odoo import."""
         index_by_field = {field_name: index for index, field_name in enumerate(fields)}
+        token_map = self._vnop_bulk_resolve_references(fields, rows)
         for row_no, row in enumerate(rows, start=1):
             for field_name in fields:
                 if field_name not in self._VNOP_RELATIONAL_FIELDS or field_name not in index_by_field:
@@ -336,20 +386,23 @@ class ProductTemplateImportBaseInherit(models.Model):
                 cell_value = row[index_by_field[field_name]]
                 if not self._vnop_normalize_import_value(cell_value):
                     continue
-                recs, normalized = self._vnop_resolve_reference(field_name, cell_value, row_no)
+                recs, normalized = self._vnop_resolve_reference(field_name, cell_value, row_no, token_map)
                 if field_name in self._VNOP_LENS_M2O_FIELDS and recs:
                     row[index_by_field[field_name]] = str(recs.id)
                 else:
                     row[index_by_field[field_name]] = normalized
 
-    def _vnop_resolve_reference(self, field_name, raw_value, row_no):
-
+    def _vnop_resolve_reference(self, field_name, raw_value, row_no, token_map=None):
+        """(records, label) của 1 cell; `token_map` (`_vnop_bulk_resolve_references`)
+        thay cho search từng token."""
         field = self._fields[field_name]
         model_name = field.comodel_name
         model = self.env[model_name].sudo()
         search_keys = self._vnop_get_search_keys(model_name)
 
         def _find_one(token):
+            if token_map is not None:
+                return token_map.get(model_name, {}).get(token) or model.browse()
             extra_domain = []
             for key in search_keys:
                 domain = [(key, '=', token)] + extra_domain
@@ -486,6 +539,7 @@ class ProductTemplateImportBaseInherit(models.Model):
         file_codes = set()
         existing_by_code = {}
         locked_relational_values = defaultdict(dict)
+        token_map = self._vnop_bulk_resolve_references(fields, rows)
 
         for row_no, row in enumerate(rows, start=1):
             code = self._vnop_normalize_import_value(row[code_index] if code_index < len(row) else '')
@@ -509,7 +563,7 @@ class ProductTemplateImportBaseInherit(models.Model):
                 cell_value = row[index_by_field[field_name]]
                 if not self._vnop_normalize_import_value(cell_value):
                     continue
-                recs, normalized = self._vnop_resolve_reference(field_name, cell_value, row_no)
+                recs, normalized = self._vnop_resolve_reference(field_name, cell_value, row_no, token_map)
                 if field_name in self._VNOP_LENS_M2O_FIELDS and recs:
                     row[index_by_field[field_name]] = str(recs.id)
                 else:
@@ -598,39 +652,28 @@ class ProductTemplateImportBaseInherit(models.Model):
         return result
 
     def _vnop_validate_unique_names(self, fields, rows):
-        """Kiểm tra trùng tên sản phẩm trong file và trong DB."""
+        """Kiểm tra trùng tên sản phẩm trong file và trong DB (tra DB theo lô)."""
         if 'name' not in fields:
             return
         name_idx = list(fields).index('name')
-
-        # Check trùng name trong file
-        seen = {}
+        key_index = ImportKeyIndex(self.env)
         for row_no, row in enumerate(rows, start=1):
-            name = self._vnop_normalize_import_value(
-                row[name_idx] if name_idx < len(row) else '')
-            if not name:
-                continue
-            if name in seen:
-                raise ValidationError(_(
-                    'Dòng %(row)s: Trùng tên sản phẩm "%(name)s" với dòng %(first)s trong cùng file.',
-                    row=row_no, name=name, first=seen[name],
-                ))
-            seen[name] = row_no
+            key_index.add(row_no, self._vnop_normalize_import_value(
+                row[name_idx] if name_idx < len(row) else ''))
+
+        # Check trùng name trong file — báo dòng trùng xuất hiện sớm nhất
+        if key_index.dup_names:
+            name, row_nos = min(key_index.dup_names.items(), key=lambda kv: kv[1][1])
+            raise ValidationError(_(
+                'Dòng %(row)s: Trùng tên sản phẩm "%(name)s" với dòng %(first)s trong cùng file.',
+                row=row_nos[1], name=name, first=row_nos[0],
+            ))
 
         # Check name đã tồn tại trong DB
-        unique_names = list(seen.keys())
-        if not unique_names:
-            return
-        existing = self.with_context(active_test=False).search_read(
-            [('name', 'in', unique_names)],
-            ['name'],
-        )
-        existing_map = {r['name']: r['name'] for r in existing if r['name']}
-        for row_no, row in enumerate(rows, start=1):
-            name = self._vnop_normalize_import_value(
-                row[name_idx] if name_idx < len(row) else '')
-            if name and name in existing_map:
-                raise ValidationError(_(
-                    'Dòng %(row)s: Tên sản phẩm "%(name)s" đã tồn tại trong hệ thống.',
-                    row=row_no, name=name,
-                ))
+        existing = key_index.existing_names()
+        if existing:
+            name = min(existing, key=key_index.names.get)
+            raise ValidationError(_(
+                'Dòng %(row)s: Tên sản phẩm "%(name)s" đã tồn tại trong hệ thống.',
+                row=key_index.names[name], name=name,
+            ))
@@ -2,21 +2,38 @@
 import logging
 import json
 from psycopg2 import errors
-import time
 import os
-import random
 import re
-import unicodedata
 import base64
+import gzip
+import hashlib
+import tempfile
+import threading
+import traceback
 from io import BytesIO
 import requests
 import urllib3
-from urllib.parse import urljoin
-from collections import defaultdict
+from urllib.parse import urlencode, urljoin
+from collections import OrderedDict, defaultdict
+from datetime import timedelta
 from odoo import models, fields, api, _
 from odoo.modules.registry import Registry
 from odoo.exceptions import UserError
 
+from .rs_client import get_rs_client
+from .rs_mapping import (
+    BASE_SPEC, LENS_SPEC, OPT_SPEC, RS_GENDER_MAP,
+    apply_spec, as_selection, classification_code, compile_spec, dto_name, first_non_empty, parse_float,
+    pick_code,
+)
+from .rs_spool import ImageSpool, PageSpool, gc_spool, spool_enabled
+from .rs_token import get_token_manager
+from .text_norm import cache_stats as text_norm_cache_stats, compact_key, is_placeholder, spaced_key
+from .sync_progress import (
+    CANCEL_CHANNEL, PROGRESS_NOTIFICATION, SyncProgress,
+    acquire_cancel_listener, get_cancel_listener, progress_channel, release_cancel_listener,
+)
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 _logger = logging.getLogger(__name__)
 
@@ -28,6 +45,37 @@ class _TokenExpiredError(Exception):
     pass
 
 
+class _AccessoryStepError(Exception):
+    """Bọc lỗi khi map 1 accessory, kèm `step` để thống kê err_by_step."""
+
+    def __init__(self, step, original):
+        super().__init__(str(original))
+        self.step = step
+        self.original = original
+
+
+class _LruCache:
+    """Dict LRU giới hạn `maxsize` phần tử (0 → không giữ gì); caller tự khoá khi dùng chung thread."""
+
+    def __init__(self, maxsize):
+        self.maxsize = max(0, int(maxsize))
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value):
+        if not self.maxsize:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
 class _SyncCancelledError(Exception):
     """Raised khi user yêu cầu dừng sync (cancel_requested=True).
     Worker bắt và set sync_status='cancelled' thay vì 'error'."""
@@ -50,6 +98,15 @@ class ProductSync(models.Model):
         ('success', 'Thành công'),
         ('error', 'Lỗi')])
     sync_log = fields.Text('Nhật ký', readonly=True)
+    # Mỗi company có 1 cấu hình riêng; job chạy with_company → seller/thuế theo company này.
+    # Page + ảnh RS dùng chung qua spool (rs_spool) nên các company không tải lại catalog.
+    company_id = fields.Many2one(
+        'res.company', string='Công ty', required=True, default=lambda self: self.env.company,
+    )
+
+    _sql_constraints = [
+        ('company_uniq', 'unique(company_id)', 'Mỗi công ty chỉ có 1 cấu hình đồng bộ.'),
+    ]
     # Cooperative cancel flag: worker check sau mỗi batch — nếu True thì break.
     cancel_requested = fields.Boolean(
         'Yêu cầu dừng', default=False, readonly=True, copy=False,
@@ -63,7 +120,8 @@ class ProductSync(models.Model):
     opts_count = fields.Integer('Sản phẩm Gọng', readonly=True)
     other_count = fields.Integer('Sản phẩm khác', readonly=True)
 
-    # Progress tracking — worker cập nhật + commit theo batch để form hiện %.
+    # Progress tracking — realtime qua bus (widget vnop_sync_progress); worker chỉ
+    # ghi các field này ở checkpoint (SYNC_PROGRESS_CHECKPOINT_SEC) và khi kết thúc.
     progress_total = fields.Integer('Tổng dòng cần xử lý', readonly=True)
     progress_done = fields.Integer('Đã xử lý', readonly=True)
     progress_percent = fields.Float(
@@ -72,11 +130,52 @@ class ProductSync(models.Model):
     )
     progress_message = fields.Char('Tiến độ chi tiết', readonly=True)
 
+    # Lỗi chi tiết từng item nằm ở product.sync.error (theo lần chạy `last_run_id`).
+    last_run_id = fields.Char('Lần chạy cuối', readonly=True, copy=False)
+    error_ids = fields.One2many('product.sync.error', 'sync_id', string='Lỗi đồng bộ', readonly=True)
+    last_run_error_count = fields.Integer('Lỗi lần chạy cuối', compute='_compute_last_run_error_count')
+
+    # Gauge hàng đợi đẩy tồn kho / giá Odoo → RS (product.sync.outbox).
+    outbox_pending_count = fields.Integer('Chờ đẩy về RS', compute='_compute_outbox_backlog')
+    outbox_failed_count = fields.Integer('Đẩy về RS lỗi', compute='_compute_outbox_backlog')
+    outbox_lag_minutes = fields.Integer('Độ trễ đẩy về RS (phút)', compute='_compute_outbox_backlog')
+
     @api.depends('progress_total', 'progress_done')
     def _compute_progress_percent(self):
         for r in self:
             r.progress_percent = (r.progress_done / r.progress_total * 100.0) if r.progress_total else 0.0
 
+    @api.depends('last_run_id')
+    def _compute_last_run_error_count(self):
+        counts = {}
+        run_ids = [r.last_run_id for r in self if r.last_run_id]
+        if run_ids:
+            for sync, run_id, count in self.env['product.sync.error']._read_group(
+                [('sync_id', 'in', self.ids), ('run_id', 'in', run_ids)],
+                ['sync_id', 'run_id'], ['__count'],
+            ):
+                counts[(sync.id, run_id)] = count
+        for r in self:
+            r.last_run_error_count = counts.get((r.id, r.last_run_id), 0)
+
+    def _compute_outbox_backlog(self):
+        backlog = self.env['product.sync.outbox']._backlog()
+        for r in self:
+            r.outbox_pending_count = backlog['pending']
+            r.outbox_failed_count = backlog['failed']
+            r.outbox_lag_minutes = backlog['lag_minutes']
+
+    def action_view_outbox(self):
+        return self.env['ir.actions.act_window']._for_xml_id('vnop_sync.action_product_sync_outbox')
+
+    def action_view_last_run_errors(self):
+        """Danh sách lỗi của lần chạy cuối, group theo loại sản phẩm / bước."""
+        self.ensure_one()
+        action = self.env['ir.actions.act_window']._for_xml_id('vnop_sync.action_product_sync_error')
+        action['domain'] = [('sync_id', '=', self.id), ('run_id', '=', self.last_run_id)]
+        action['context'] = {'group_by': ['product_type', 'stage']}
+        return action
+
     def action_refresh_progress(self):
         """Reload form (dùng cho nút Cập nhật trên view khi state='in_progress')."""
         self.ensure_one()
@@ -92,8 +191,9 @@ class ProductSync(models.Model):
         """Yêu cầu dừng job sync đang chạy.
 
         Cách hoạt động:
-        1. Set `cancel_requested=True` + commit ngay → worker đọc flag qua
-           cursor batch riêng và sẽ thoát ở vòng lặp tiếp theo (cooperative).
+        1. Set `cancel_requested=True` + NOTIFY `vnop_sync_cancel` + commit ngay
+           → worker nhận cờ qua LISTEN (trong bộ nhớ) và thoát ở vòng lặp tiếp
+           theo (cooperative).
         2. Cancel ngay queue.job đang `pending`/`enqueued` của record này
            (chưa start → cancel an toàn ở DB level).
         3. Job đang `started`: KHÔNG kill worker thô bạo. Đặt state=`cancelling`
@@ -111,6 +211,8 @@ class ProductSync(models.Model):
             'sync_status': 'cancelling',
             'progress_message': _('Đang yêu cầu dừng — đợi worker thoát sạch...'),
         })
+        # NOTIFY chỉ được gửi khi commit → cùng lúc với cờ trên DB.
+        self.env.cr.execute("SELECT pg_notify(%s, %s)", (CANCEL_CHANNEL, str(self.id)))
         self.env.cr.commit()
         # 2) Cancel ngay các queue.job pending của record này (theo description prefix).
         QueueJob = self.env['queue.job']
@@ -134,9 +236,81 @@ class ProductSync(models.Model):
             },
         }
 
+    def _get_image_dedup_report(self):
+        """Thống kê ảnh sản phẩm trong filestore: dung lượng logic vs thực tế.
+
+        Filestore lưu attachment theo checksum sha1 → các SKU cùng nội dung ảnh
+        (kể cả các bản resize) dùng chung 1 file; phần chênh lệch là dung lượng tiết kiệm.
+        """
+        self.env.cr.execute("""
+            WITH imgs AS (
+                SELECT checksum, file_size
+                  FROM ir_attachment
+                 WHERE res_model IN ('product.template', 'product.product')
+                   AND res_field LIKE %s
+                   AND checksum IS NOT NULL
+            )
+            SELECT count(*),
+                   coalesce(sum(file_size), 0),
+                   count(DISTINCT checksum),
+                   (SELECT coalesce(sum(fs), 0)
+                      FROM (SELECT max(file_size) AS fs FROM imgs GROUP BY checksum) d)
+              FROM imgs
+        """, ['image\\_%'])
+        attachments, logical_size, blobs, stored_size = self.env.cr.fetchone()
+        return {
+            'attachments': attachments,
+            'blobs': blobs,
+            'logical_size': logical_size,
+            'stored_size': stored_size,
+            'saved_size': logical_size - stored_size,
+        }
+
+    def action_image_dedup_report(self):
+        """Hiện báo cáo dung lượng ảnh tiết kiệm nhờ dedup theo nội dung."""
+        report = self._get_image_dedup_report()
+
+        def _mb(size):
+            return '%.1f MB' % (size / (1024.0 * 1024.0))
+
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Ảnh sản phẩm trùng nội dung'),
+                'message': _(
+                    '%(attachments)s ảnh (kể cả bản resize) dùng chung %(blobs)s file. '
+                    'Dung lượng logic %(logical)s, lưu thực tế %(stored)s, tiết kiệm %(saved)s.'
+                ) % {
+                    'attachments': report['attachments'],
+                    'blobs': report['blobs'],
+                    'logical': _mb(report['logical_size']),
+                    'stored': _mb(report['stored_size']),
+                    'saved': _mb(report['saved_size']),
+                },
+                'type': 'info',
+                'sticky': True,
+            },
+        }
+
+    def _send_progress(self, payload):
+        """Đẩy tiến độ lên bus (gửi khi transaction hiện tại commit)."""
+        self.ensure_one()
+        self.env['bus.bus']._sendone(progress_channel(self.id), PROGRESS_NOTIFICATION, payload)
+
     def _is_cancel_requested(self):
-        """Đọc lại cờ cancel_requested từ DB (qua cursor mới) — dùng trong worker."""
+        """Cờ dừng trong bộ nhớ (LISTEN/NOTIFY) — dùng trong worker.
+
+        Chỉ đọc lại `cancel_requested` từ DB (qua cursor mới) khi listener
+        không chạy (chưa kết nối xong / mất kết nối).
+        """
         self.ensure_one()
+        listener = get_cancel_listener(self.env.cr.dbname)
+        if listener is not None:
+            if listener.is_cancelled(self.id):
+                return True
+            if listener.alive:
+                return False
         try:
             with Registry(self.env.cr.dbname).cursor() as cr:
                 cr.execute(
@@ -195,12 +369,22 @@ class ProductSync(models.Model):
             'api_timeout': int(os.getenv('API_TIMEOUT', '9999')),
         }
 
-    def _init_sync_error_ctx(self):
-        """Context thu thập lỗi để hiển thị trong UI (sync_log), tránh phải đọc server log."""
+    def _init_sync_error_ctx(self, run_id=None, full_detail=False):
+        """Context thu thập lỗi của 1 lần chạy.
+
+        Mỗi lỗi thành 1 dòng product.sync.error (gom trong `pending`, ghi cùng
+        commit của batch). sync_log chỉ giữ tóm tắt theo loại + vài mẫu để xem nhanh;
+        `full_detail` (retry vài mã lỗi) → sync_log ghi mọi lỗi kèm traceback.
+        """
+        try:
+            sample_limit = int(os.getenv('SYNC_ERROR_SAMPLE_LIMIT', '20'))
+        except (TypeError, ValueError):
+            sample_limit = 20
+
         try:
-            sample_limit = int(os.getenv('SYNC_ERROR_SAMPLE_LIMIT', '500'))
+            store_limit = int(os.getenv('SYNC_ERROR_STORE_LIMIT', '50000'))
         except (TypeError, ValueError):
-            sample_limit = 500
+            store_limit = 50000
 
         try:
             max_chars = int(os.getenv('SYNC_ERROR_LOG_MAX_CHARS', '200000'))
@@ -212,10 +396,16 @@ class ProductSync(models.Model):
             'max_chars': max(2000, max_chars),
             'samples': [],
             'counts': defaultdict(int),
+            'sync_id': self.id,
+            'run_id': run_id,
+            'full_detail': bool(full_detail),
+            'store_limit': max(0, store_limit),
+            'stored': 0,
+            'pending': [],
         }
 
-    def _record_sync_error(self, error_ctx, product_type, stage, ref, exc):
-        """Ghi nhận lỗi dạng tóm tắt + sample (không làm phình DB/log quá mức)."""
+    def _record_sync_error(self, error_ctx, product_type, stage, ref, exc, product_tmpl_id=None):
+        """Ghi nhận lỗi: đếm theo loại, thêm 1 dòng chờ ghi product.sync.error, giữ vài sample."""
         if not error_ctx:
             _logger.warning("Sync error [%s:%s] ref=%s: %s", product_type, stage, ref, exc)
             return
@@ -223,7 +413,8 @@ class ProductSync(models.Model):
         key = f"{(product_type or 'unknown').upper()}:{stage}"
         error_ctx['counts'][key] += 1
 
-        if len(error_ctx['samples']) >= error_ctx['sample_limit']:
+        store = bool(error_ctx.get('run_id')) and error_ctx['stored'] < error_ctx['store_limit']
+        if not (store or error_ctx.get('full_detail')) and len(error_ctx['samples']) >= error_ctx['sample_limit']:
             return
 
         try:
@@ -232,49 +423,33 @@ class ProductSync(models.Model):
             msg = repr(exc)
         msg = (msg or 'Unknown error')[:1000]
         ref_str = (str(ref) if ref is not None else 'N/A')
-        error_ctx['samples'].append(f"[{key}] ref={ref_str}\n  {msg}")
+        if store:
+            error_ctx['stored'] += 1
+            error_ctx['pending'].append(self.env['product.sync.error']._prepare_row(
+                error_ctx['sync_id'], error_ctx['run_id'], product_type, stage, ref_str, msg,
+                product_tmpl_id=product_tmpl_id,
+            ))
+        if error_ctx.get('full_detail'):
+            tb = ''.join(traceback.format_exception(type(exc), exc, exc.__traceback__)).strip()
+            error_ctx['samples'].append(f"[{key}] ref={ref_str}\n  {msg}\n{tb[-4000:]}")
+        elif len(error_ctx['samples']) < error_ctx['sample_limit']:
+            error_ctx['samples'].append(f"[{key}] ref={ref_str}\n  {msg}")
+
+    def _flush_sync_errors(self, error_ctx):
+        """Ghi các lỗi đang chờ vào product.sync.error trên cursor hiện tại (commit cùng batch)."""
+        try:
+            with self.env.cr.savepoint():
+                self.env['product.sync.error']._flush_pending(error_ctx)
+        except Exception as e:
+            _logger.warning("vnop_sync: không ghi được product.sync.error: %s", e)
 
     def _to_float(self, val, default=0.0):
         """Float an toàn cho payload API (hay trả string 'none'/'null')."""
-        if val is None:
-            return default
-        if isinstance(val, (int, float)):
-            return float(val)
-        if isinstance(val, str):
-            s = val.strip()
-            if not s:
-                return default
-            if s.lower() in ('none', 'null', 'nan', 'n/a', 'na'):
-                return default
-            s = s.replace(',', '')
-            try:
-                return float(s)
-            except (TypeError, ValueError):
-                return default
-        try:
-            return float(val)
-        except (TypeError, ValueError):
-            return default
+        return parse_float(val, default)
 
     def _is_placeholder_value(self, value):
         """Return True when value is empty/demo placeholder like 'khong', 'none', 'n/a'."""
-        if value in (None, False):
-            return True
-
-        raw = str(value).strip()
-        if not raw:
-            return True
-
-        normalized = unicodedata.normalize('NFKD', raw.lower())
-        normalized = ''.join(ch for ch in normalized if not unicodedata.combining(ch))
-        normalized = re.sub(r"[^a-z0-9]+", "", normalized)
-        if not normalized:
-            return True
-        return normalized in {
-            'khong', 'none', 'null', 'nil', 'na', 'nill', 'undefined', 'empty',
-            'khongco', 'khongapdung', 'khongxacdinh', 'khongcos', 'noco',
-            'khongbiet', 'khongro', '""', "''",
-        }
+        return is_placeholder(value)
 
     def _clean_placeholder_text(self, value):
         """Normalize to stripped text and drop placeholders as False."""
@@ -328,15 +503,7 @@ class ProductSync(models.Model):
         return False
 
     def _normalize_country_lookup_text(self, value):
-        if value in (None, False):
-            return ''
-        text = str(value).strip().lower()
-        if not text:
-            return ''
-        normalized = unicodedata.normalize('NFKD', text)
-        normalized = ''.join(ch for ch in normalized if not unicodedata.combining(ch))
-        normalized = re.sub(r'[^a-z0-9]+', ' ', normalized).strip()
-        return re.sub(r'\s+', ' ', normalized)
+        return spaced_key(value)
 
     def _resolve_country_from_text(self, country_text):
         cleaned_country = self._clean_placeholder_text(country_text)
@@ -423,12 +590,7 @@ class ProductSync(models.Model):
     def _is_invalid_bank_token(self, value):
         if value in (None, False):
             return True
-        raw = str(value).strip()
-        if not raw:
-            return True
-        normalized = unicodedata.normalize('NFKD', raw.lower())
-        normalized = ''.join(ch for ch in normalized if not unicodedata.combining(ch))
-        normalized = re.sub(r"[^a-z0-9]+", "", normalized)
+        normalized = compact_key(value)
         if not normalized:
             return True
         invalid_tokens = {'khong', 'none', 'null', 'na'}
@@ -503,6 +665,10 @@ class ProductSync(models.Model):
         if not fax and supplier_root:
             fax = self._get_first_valid_value(supplier_root, fax_aliases)
 
+        if self.env.context.get('vnop_sync_dry_run'):
+            # Chạy thử: chỉ tra NCC đã có, không tạo/ghi partner (không giữ lock dòng).
+            return partner or False
+
         if not partner:
             create_vals = {
                 'name': supplier_name,
@@ -876,6 +1042,57 @@ class ProductSync(models.Model):
 
         return content
 
+    def _get_image_cache_limit(self):
+        """Số phần tử tối đa của các cache ảnh trong 1 lần sync (URL, nội dung, checksum)."""
+        try:
+            return max(0, int(os.getenv('PRODUCT_IMAGE_URL_CACHE_LIMIT', '10000')))
+        except (TypeError, ValueError):
+            return 10000
+
+    def _image_ctx_lock(self, ctx):
+        """Lock của image_sync_ctx: cache + stats được cập nhật từ thread prefetch."""
+        return ctx.setdefault('_lock', threading.Lock())
+
+    def _bump_image_stat(self, ctx, key, count=1):
+        with self._image_ctx_lock(ctx):
+            ctx.setdefault('stats', defaultdict(int))[key] += count
+
+    def _image_lru(self, ctx, name):
+        cache = ctx.get(name)
+        if cache is None:
+            cache = ctx.setdefault(name, _LruCache(self._get_image_cache_limit()))
+        return cache
+
+    def _encode_rs_image(self, content, content_type='', image_sync_ctx=None, product_ref='', url=None):
+        """Optimize + base64 ảnh tải về, dedup theo nội dung trong lần sync.
+
+        Nhiều SKU (màu gọng, default.png...) trỏ tới cùng 1 ảnh: chỉ optimize/encode
+        1 lần. Cache nội dung (sha1 bytes gốc → base64, checksum) là LRU giới hạn
+        theo PRODUCT_IMAGE_URL_CACHE_LIMIT. Checksum sha1 của bytes sẽ ghi (trùng
+        checksum filestore của ir.attachment) được giữ theo `url` để
+        `_apply_product_image_to_vals` bỏ qua ghi lại ảnh không đổi nội dung.
+        """
+        ctx = image_sync_ctx if image_sync_ctx is not None else {}
+        raw_key = hashlib.sha1(content).hexdigest()
+        lock = self._image_ctx_lock(ctx)
+        content_cache = self._image_lru(ctx, '_content_cache')
+        checksum_by_url = self._image_lru(ctx, '_checksum_by_url')
+        with lock:
+            cached = content_cache.get(raw_key)
+            if cached:
+                ctx.setdefault('stats', defaultdict(int))['content_dedup_hits'] += 1
+                if url:
+                    checksum_by_url.put(url, cached[1])
+                return cached[0]
+        optimized = self._optimize_image_bytes(content, content_type=content_type, product_ref=product_ref)
+        image_b64 = base64.b64encode(optimized).decode('ascii')
+        checksum = hashlib.sha1(optimized).hexdigest()
+        with lock:
+            content_cache.put(raw_key, (image_b64, checksum))
+            if url:
+                checksum_by_url.put(url, checksum)
+        return image_b64
+
     def _fetch_rs_image_base64(self, image_url, image_sync_ctx=None, product_ref='', allow_default_fallback=True):
         """Download RS image and return base64 string; return False on recoverable failure."""
         if not image_url:
@@ -883,13 +1100,14 @@ class ProductSync(models.Model):
 
         ctx = image_sync_ctx or {}
         cfg = ctx.get('cfg') or self._get_api_config()
-        token = ctx.get('token')
-        session = ctx.get('session') or self._make_session()
+        token_manager = ctx.get('token_manager')
+        client = self._get_rs_client(cfg)
 
         try:
             timeout = int(os.getenv('PRODUCT_IMAGE_TIMEOUT', '20'))
         except (TypeError, ValueError):
             timeout = 20
+        max_retries = self._get_image_max_retries()
 
         image_full_url = self._build_rs_image_full_url(image_url, cfg)
         if not image_full_url:
@@ -900,25 +1118,16 @@ class ProductSync(models.Model):
             )
             return False
 
-        headers = {'Accept': 'image/*,*/*'}
-        if token:
-            headers['Authorization'] = f'Bearer {token}'
-
         def _download_image_as_b64(target_url):
-            resp = session.get(
-                target_url,
-                headers=headers,
-                verify=cfg.get('ssl_verify', False),
-                timeout=timeout,
+            content, content_type, from_spool = self._get_rs_image_content(
+                client, target_url, token_manager, timeout, max_retries, spool=ctx.get('spool'),
             )
-            resp.raise_for_status()
-
-            content = resp.content or b''
+            if from_spool:
+                self._bump_image_stat(ctx, 'spool_hits')
             if not content:
                 _logger.warning("⚠️ Skip sync image: empty content product=%s url=%s", product_ref or 'N/A', target_url)
                 return False
 
-            content_type = (resp.headers.get('Content-Type') or '').lower()
             if content_type and not content_type.startswith('image/'):
                 _logger.warning(
                     "⚠️ Skip sync image: invalid content-type product=%s url=%s content_type=%s",
@@ -928,24 +1137,18 @@ class ProductSync(models.Model):
                 )
                 return False
 
-            content = self._optimize_image_bytes(content, content_type=content_type, product_ref=product_ref)
             try:
-                return base64.b64encode(content).decode('ascii')
+                return self._encode_rs_image(content, content_type, ctx, product_ref=product_ref, url=target_url)
             except Exception as e:
                 _logger.warning("⚠️ Skip sync image encode error: product=%s url=%s error=%s", product_ref or 'N/A', target_url, e)
                 return False
 
         url_cache = ctx.setdefault('_url_cache', {})
-        image_stats = ctx.setdefault('stats', defaultdict(int))
-        image_stats['fetch_attempts'] += 1
-        try:
-            url_cache_limit = int(os.getenv('PRODUCT_IMAGE_URL_CACHE_LIMIT', '10000'))
-        except (TypeError, ValueError):
-            url_cache_limit = 10000
-        url_cache_limit = max(0, url_cache_limit)
+        self._bump_image_stat(ctx, 'fetch_attempts')
+        url_cache_limit = self._get_image_cache_limit()
 
         if image_full_url in url_cache:
-            image_stats['cache_hits'] += 1
+            self._bump_image_stat(ctx, 'cache_hits')
             return url_cache[image_full_url]
 
         result = False
@@ -957,7 +1160,7 @@ class ProductSync(models.Model):
             _logger.warning("⚠️ Skip sync image download error: product=%s url=%s error=%s", product_ref or 'N/A', image_full_url, e)
 
         if result:
-            image_stats['downloaded'] += 1
+            self._bump_image_stat(ctx, 'downloaded')
             if url_cache_limit and len(url_cache) < url_cache_limit:
                 url_cache[image_full_url] = result
             return result
@@ -971,7 +1174,7 @@ class ProductSync(models.Model):
                 try:
                     fallback_b64 = _download_image_as_b64(default_url)
                     if fallback_b64:
-                        image_stats['fallback_downloaded'] += 1
+                        self._bump_image_stat(ctx, 'fallback_downloaded')
                         if url_cache_limit and len(url_cache) < url_cache_limit:
                             url_cache[default_url] = fallback_b64
                         _logger.info(
@@ -1019,7 +1222,7 @@ class ProductSync(models.Model):
                 existing_has_image = existing_product_id in has_image_set
             else:
                 existing_tmpl = self.env['product.template'].browse(existing_product_id).exists()
-                existing_has_image = bool(existing_tmpl and existing_tmpl.image_1920)
+                existing_has_image = bool(existing_tmpl and existing_tmpl.x_has_image)
             existing_image_url = (ctx.get('_existing_image_url_map') or {}).get(existing_product_id)
 
         is_default_image = self._is_rs_default_image_url(image_url)
@@ -1050,10 +1253,24 @@ class ProductSync(models.Model):
             allow_default_fallback=not existing_has_image,
         )
         if image_b64:
+            checksum_by_url = ctx.get('_checksum_by_url')
+            with self._image_ctx_lock(ctx):
+                checksum = (checksum_by_url.get(image_full_url) if checksum_by_url else None) or False
+            checksum_map = ctx.get('_existing_image_checksum_map')
+            if (existing_has_image and checksum and checksum_map is not None
+                    and checksum_map.get(existing_product_id) == checksum):
+                # Cùng nội dung ảnh đang lưu (URL đổi / force) → không ghi lại image_1920 + các bản resize.
+                image_stats['content_unchanged_skipped'] += 1
+                if ctx.get('track_source_url') and existing_image_url != image_full_url:
+                    vals['x_rs_image_url'] = image_full_url
+                    if ctx.get('_existing_image_url_map') is not None:
+                        ctx['_existing_image_url_map'][existing_product_id] = image_full_url
+                return
             vals['image_1920'] = image_b64
             if ctx.get('track_source_url'):
                 vals['x_rs_image_url'] = image_full_url
                 vals['x_rs_image_synced_at'] = fields.Datetime.now()
+                vals['x_rs_image_checksum'] = checksum
             image_stats['written'] += 1
             if existing_product_id:
                 has_image_set = ctx.get('_has_image_set')
@@ -1061,44 +1278,80 @@ class ProductSync(models.Model):
                     has_image_set.add(existing_product_id)
                 if ctx.get('_existing_image_url_map') is not None:
                     ctx['_existing_image_url_map'][existing_product_id] = image_full_url
+                if checksum_map is not None:
+                    checksum_map[existing_product_id] = checksum
 
-    def _get_access_token(self):
-        config = self._get_api_config()
-        login_url = f"{config['base_url']}{config['login_endpoint']}"
+    @api.model
+    def _get_token_manager(self, config=None):
+        """Token manager dùng chung của process cho credential RS trong .env."""
+        config = config or self._get_api_config()
+        return get_token_manager(
+            f"{config['base_url']}{config['login_endpoint']}",
+            config['service_username'],
+            config['service_password'],
+            ssl_verify=config['ssl_verify'],
+            timeout=config['login_timeout'],
+        )
+
+    def _get_access_token(self, stale_token=None):
+        """Token RS còn hạn từ cache in-memory (không login lại mỗi lần sync).
+
+        stale_token: token vừa bị RS trả 401/403 → bỏ khỏi cache rồi lấy token mới.
+        """
+        token_manager = self._get_token_manager()
+        if stale_token:
+            token_manager.invalidate(stale_token)
         try:
-            response = requests.post(
-                login_url,
-                json={'username': config['service_username'], 'password': config['service_password']},
-                verify=config['ssl_verify'], timeout=config['login_timeout']
-            )
-            response.raise_for_status()
-            token = response.json().get('token')
-            if not token: raise UserError(_('Login failed: No token received'))
-            return token
+            return token_manager.get_token()
         except Exception as e:
             raise UserError(_(f"Authentication failed: {str(e)}"))
 
-    def _make_session(self, pool_size=None):
-        """Tạo mới requests.Session (không cache trên self vì Odoo ORM không cho phép).
+    def _get_rs_image(self, client, target_url, token_manager=None, timeout=20, max_retries=1):
+        """GET ảnh RS kèm token hiện hành; 401/403 → refresh token và thử lại 1 lần.
+
+        Chạy được trong thread tải ảnh (không chạm ORM)."""
+        headers = {'Accept': 'image/*,*/*'}
+        token = token_manager.get_token() if token_manager else None
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        resp = client.get(target_url, headers=headers, timeout=timeout, max_retries=max_retries)
+        if token and resp.status_code in (401, 403):
+            resp.close()
+            token_manager.invalidate(token)
+            headers['Authorization'] = f'Bearer {token_manager.get_token()}'
+            resp = client.get(target_url, headers=headers, timeout=timeout, max_retries=max_retries)
+        return resp
+
+    def _get_rs_image_content(self, client, target_url, token_manager=None, timeout=20, max_retries=1, spool=None):
+        """(content, content_type, from_spool) của 1 ảnh RS; đọc spool dùng chung nếu bật.
+
+        Chạy được trong thread tải ảnh (không chạm ORM)."""
+        def _load():
+            resp = self._get_rs_image(client, target_url, token_manager, timeout, max_retries)
+            resp.raise_for_status()
+            return resp.content or b'', (resp.headers.get('Content-Type') or '').lower()
+
+        if spool is None:
+            content, content_type = _load()
+            return content, content_type, False
+        return spool.fetch(target_url, _load)
+
+    @api.model
+    def _get_rs_client(self, cfg=None):
+        """RS client dùng chung của worker process (pool keep-alive + rate limit + retry).
 
-        pool_size: kích thước HTTP connection pool. Mặc định 10 (urllib3) — quá nhỏ
-        khi nhiều thread share session sẽ phát warning 'Connection pool is full'.
+        Không cache trên self vì Odoo ORM không cho phép; client sống ở mức module
+        (xem `rs_client.get_rs_client`) nên mọi call site dùng chung 1 pool.
         """
-        from requests.adapters import HTTPAdapter
-        session = requests.Session()
-        if pool_size:
-            https_adapter = HTTPAdapter(
-                pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0,
-            )
-            http_adapter = HTTPAdapter(
-                pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0,
-            )
-        else:
-            https_adapter = HTTPAdapter(max_retries=0)
-            http_adapter = HTTPAdapter(max_retries=0)
-        session.mount('https://', https_adapter)
-        session.mount('http://', http_adapter)
-        return session
+        cfg = cfg or self._get_api_config()
+        return get_rs_client(ssl_verify=cfg.get('ssl_verify', False))
+
+    def _get_image_max_retries(self):
+        """Số lần retry khi tải ảnh (ít hơn API data vì ảnh lỗi có fallback default)."""
+        try:
+            return max(0, int(os.getenv('PRODUCT_IMAGE_MAX_RETRIES', '1')))
+        except (TypeError, ValueError):
+            return 1
 
     def _get_sync_batch_size(self, image_active=False):
         """Đọc kích thước batch.
@@ -1118,101 +1371,103 @@ class ProductSync(models.Model):
             size = int(default)
         return max(1, size)
 
-    def _fetch_paged_api(self, endpoint, token, page=0, size=100, max_retries=5, session=None, config=None):
+    def _fetch_paged_api(self, endpoint, token, page=0, size=100, max_retries=5, config=None, params=None):
         if config is None:
             config = self._get_api_config()
         url = f"{config['base_url']}{endpoint}?page={page}&size={size}"
+        if params:
+            url = f"{url}&{urlencode(params)}"
         headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
 
-        for attempt in range(1, max_retries + 1):
-            # Tạo session mới nếu chưa có hoặc sau khi retry
-            _session = session if (session and attempt == 1) else self._make_session()
-            try:
-                response = _session.get(
-                    url, headers=headers,
-                    verify=config['ssl_verify'],
-                    timeout=config['api_timeout']
+        # Retry/backoff (timeout, connection error, 429/5xx) nằm trong RS client.
+        try:
+            response = self._get_rs_client(config).get(
+                url, headers=headers,
+                timeout=config['api_timeout'],
+                max_retries=max_retries,
+            )
+            # Phát hiện token hết hạn / bị revoke giữa chừng:
+            # raise exception riêng để caller (_iter_batches) biết và refresh token.
+            if response.status_code in (401, 403):
+                raise _TokenExpiredError(
+                    f"HTTP {response.status_code} at page={page} url={url}"
                 )
-                # Phát hiện token hết hạn / bị revoke giữa chừng:
-                # raise exception riêng để caller (_iter_batches) biết và refresh token.
-                if response.status_code in (401, 403):
-                    raise _TokenExpiredError(
-                        f"HTTP {response.status_code} at page={page} url={url}"
-                    )
-                response.raise_for_status()
-                data = response.json()
-                return data
-            except _TokenExpiredError:
-                # Không retry tại tầng này — caller chịu trách nhiệm refresh token.
-                raise
-            except (requests.exceptions.ConnectTimeout,
-                    requests.exceptions.ReadTimeout,
-                    requests.exceptions.ConnectionError) as e:
-                if attempt == max_retries:
-                    raise UserError(_(f"API request failed after {max_retries} retries: {str(e)}"))
-                wait = min(2 ** attempt + random.uniform(0, 2), 60)  # cap 60s
-                # _logger.warning(
-                # f"⚠️ Timeout/Connection error trang {page} (lần {attempt}/{max_retries}). "
-                # f"Thử lại sau {wait:.1f}s... Lỗi: {e}"
-                # )
-                time.sleep(wait)
-            except Exception as e:
-                raise UserError(_(f"API request failed: {str(e)}"))
+            response.raise_for_status()
+            return response.json()
+        except _TokenExpiredError:
+            # Không retry tại tầng này — caller chịu trách nhiệm refresh token.
+            raise
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            raise UserError(_(f"API request failed after {max_retries} retries: {str(e)}"))
+        except Exception as e:
+            raise UserError(_(f"API request failed: {str(e)}"))
 
-    def _iter_batches(self, endpoint, token, batch_size=1000, limit=None):
+    def _iter_batches(self, endpoint, token, batch_size=1000, limit=None, params=None):
         """Generator: yield từng batch items, không giữ toàn bộ data trong memory.
 
-        Tự động refresh token khi API trả 401/403 (token hết hạn giữa chừng
-        trong quá trình paging dài). Retry tối đa `MAX_AUTH_REFRESH` lần để
-        tránh loop vô hạn nếu credential thực sự sai.
+        Token lấy từ token manager trước mỗi page (đã được refresh nền trước
+        khi hết hạn). Nếu API vẫn trả 401/403 (token bị revoke) thì invalidate
+        và login lại. Retry tối đa `MAX_AUTH_REFRESH` lần để tránh loop vô hạn
+        nếu credential thực sự sai.
         """
         MAX_AUTH_REFRESH = 3
         config = self._get_api_config()
-        session = self._make_session()
         page = 0
         fetched = 0
-        current_token = token
         auth_refresh_count = 0
+        # Spool dùng chung: page đã có (company / DB khác vừa tải) thì đọc file local.
+        spool = PageSpool(config['base_url'], endpoint, batch_size, params) if spool_enabled() else None
+        if spool and spool.reused:
+            _logger.info("[vnop_sync] %s: đọc page từ spool dùng chung %s", endpoint, spool.generation_dir)
 
-        while True:
-            try:
-                res = self._fetch_paged_api(
-                    endpoint, current_token, page, batch_size,
-                    session=session, config=config,
-                )
-            except _TokenExpiredError as e:
-                if auth_refresh_count >= MAX_AUTH_REFRESH:
-                    raise UserError(_(
-                        f"API auth vẫn thất bại sau {MAX_AUTH_REFRESH} lần refresh token: {e}"
-                    ))
-                auth_refresh_count += 1
-                _logger.warning(
-                    "🔑 Token Spring Boot hết hạn tại page=%s, refresh lần %s/%s...",
-                    page, auth_refresh_count, MAX_AUTH_REFRESH,
-                )
+        try:
+            while True:
                 current_token = self._get_access_token()
-                session = self._make_session()
-                # Retry lại đúng page hiện tại với token mới
-                continue
+                try:
+                    if spool:
+                        res, _from_spool = spool.fetch(page, lambda: self._fetch_paged_api(
+                            endpoint, current_token, page, batch_size, config=config, params=params,
+                        ))
+                    else:
+                        res = self._fetch_paged_api(
+                            endpoint, current_token, page, batch_size, config=config, params=params,
+                        )
+                except _TokenExpiredError as e:
+                    if auth_refresh_count >= MAX_AUTH_REFRESH:
+                        raise UserError(_(
+                            f"API auth vẫn thất bại sau {MAX_AUTH_REFRESH} lần refresh token: {e}"
+                        ))
+                    auth_refresh_count += 1
+                    _logger.warning(
+                        "🔑 Token Spring Boot hết hạn tại page=%s, refresh lần %s/%s...",
+                        page, auth_refresh_count, MAX_AUTH_REFRESH,
+                    )
+                    current_token = self._get_access_token(stale_token=current_token)
+                    # Retry lại đúng page hiện tại với token mới
+                    continue
 
-            content = res.get('content', [])
-            if not content:
-                break
+                content = res.get('content', [])
+                if not content:
+                    break
 
-            if limit:
-                remaining = limit - fetched
-                content = content[:remaining]
+                if limit:
+                    remaining = limit - fetched
+                    content = content[:remaining]
 
-            yield content
-            fetched += len(content)
+                yield content
+                fetched += len(content)
 
-            if limit and fetched >= limit:
-                break
+                if limit and fetched >= limit:
+                    break
 
-            total_pages = res.get('totalPages', 1)
-            page += 1
-            if page >= total_pages:
-                break
+                total_pages = res.get('totalPages', 1)
+                page += 1
+                if page >= total_pages:
+                    break
+        finally:
+            # Producer xong (hoặc bị ngắt): lượt sync sau sẽ tải generation mới.
+            if spool:
+                spool.close()
 
     def _prefetch_images_parallel(self, items, image_sync_ctx):
         """Download ảnh song song cho cả batch trước khi xử lý, lưu vào url_cache."""
@@ -1223,7 +1478,7 @@ class ProductSync(models.Model):
             return
 
         cfg = image_sync_ctx.get('cfg') or self._get_api_config()
-        token = image_sync_ctx.get('token')
+        token_manager = image_sync_ctx.get('token_manager')
         url_cache = image_sync_ctx.setdefault('_url_cache', {})
         # Negative cache: URL đã fail trong session hiện tại — bỏ qua để né retry
         failed_urls = image_sync_ctx.setdefault('_failed_urls', set())
@@ -1258,50 +1513,47 @@ class ProductSync(models.Model):
         except (TypeError, ValueError):
             timeout = 20
 
-        headers = {'Accept': 'image/*,*/*'}
-        if token:
-            headers['Authorization'] = f'Bearer {token}'
-        ssl_verify = cfg.get('ssl_verify', False)
+        # Client dùng chung: mỗi thread có Session riêng nhưng chung connection
+        # pool + rate limit theo host (xem rs_client.RsClient).
+        client = self._get_rs_client(cfg)
+        max_retries = self._get_image_max_retries()
 
-        import threading
-        _thread_local = threading.local()
+        spool = image_sync_ctx.get('spool')
 
         def _download_one(target_url):
-            """Download 1 ảnh, trả về (url, base64_string) hoặc (url, False)."""
+            """Download 1 ảnh, trả về (url, base64_string, from_spool) hoặc (url, False, False)."""
             try:
-                # Mỗi thread dùng session riêng (requests.Session không thread-safe)
-                # pool_size = max_workers để tránh "Connection pool is full"
-                if not hasattr(_thread_local, 'session'):
-                    _thread_local.session = self._make_session(pool_size=max_workers)
-                resp = _thread_local.session.get(target_url, headers=headers, verify=ssl_verify, timeout=timeout)
-                resp.raise_for_status()
-                content = resp.content or b''
+                content, content_type, from_spool = self._get_rs_image_content(
+                    client, target_url, token_manager, timeout, max_retries, spool=spool,
+                )
                 if not content:
-                    return (target_url, False)
-                content_type = (resp.headers.get('Content-Type') or '').lower()
+                    return (target_url, False, False)
                 if content_type and not content_type.startswith('image/'):
-                    return (target_url, False)
-                content = self._optimize_image_bytes(content, content_type=content_type)
-                return (target_url, base64.b64encode(content).decode('ascii'))
+                    return (target_url, False, False)
+                return (target_url, self._encode_rs_image(
+                    content, content_type, image_sync_ctx, url=target_url), from_spool)
             except Exception:
-                return (target_url, False)
+                return (target_url, False, False)
 
         from concurrent.futures import ThreadPoolExecutor, as_completed
-        image_stats = image_sync_ctx.setdefault('stats', defaultdict(int))
-        image_stats['fetch_attempts'] += len(unique_urls)
+        self._bump_image_stat(image_sync_ctx, 'fetch_attempts', len(unique_urls))
+        url_cache_limit = self._get_image_cache_limit()
 
         _logger.info("Prefetch %d ảnh song song (workers=%d)...", len(unique_urls), max_workers)
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             futures = {executor.submit(_download_one, url): url for url in unique_urls}
             for future in as_completed(futures):
-                url, result = future.result()
+                url, result, from_spool = future.result()
                 if result:
-                    url_cache[url] = result
-                    image_stats['downloaded'] += 1
+                    if url_cache_limit and len(url_cache) < url_cache_limit:
+                        url_cache[url] = result
+                    self._bump_image_stat(image_sync_ctx, 'downloaded')
+                    if from_spool:
+                        self._bump_image_stat(image_sync_ctx, 'spool_hits')
                 else:
                     # Negative cache: tránh retry URL đã fail ở batch sau
                     failed_urls.add(url)
-                    image_stats['fetch_failed'] += 1
+                    self._bump_image_stat(image_sync_ctx, 'fetch_failed')
 
     def _filter_items_for_image_resume(self, items, cache, image_sync_ctx):
         """Bỏ qua items mà target product đã có ảnh — dùng cho mode='missing'.
@@ -1337,6 +1589,83 @@ class ProductSync(models.Model):
             kept.append(item)
         return kept
 
+    def _get_priority_settings(self):
+        """Cấu hình sync ưu tiên (.env).
+
+        SYNC_PRIORITY_ORDER: bật/tắt (mặc định True).
+        SYNC_PRIORITY_DAYS: cửa sổ tính tốc độ bán (mặc định 30 ngày).
+        SYNC_PRIORITY_TOP: số sản phẩm ưu tiên tối đa (mặc định 5000).
+        """
+        def _int(name, default):
+            try:
+                return max(0, int(os.getenv(name, default)))
+            except (TypeError, ValueError):
+                return int(default)
+        return {
+            'enabled': os.getenv('SYNC_PRIORITY_ORDER', 'True').lower() == 'true',
+            'days': _int('SYNC_PRIORITY_DAYS', '30'),
+            'top': _int('SYNC_PRIORITY_TOP', '5000'),
+        }
+
+    def _compute_sync_priority(self, cache):
+        """Điểm ưu tiên theo barcode: lượng bán (move done ra khách trong N ngày, quy về UoM sản phẩm,
+        gồm cả POS) + 1 điểm nếu còn tồn kho nội bộ. Trả {'refs': set barcode top-N,
+        'hot': 0, 'cold': 0} hoặc None nếu tắt / chưa có dữ liệu."""
+        settings = self._get_priority_settings()
+        if not settings['enabled'] or not settings['top'] or not cache.get('products'):
+            return None
+        score = defaultdict(float)
+        since = fields.Datetime.now() - timedelta(days=settings['days'])
+        for product, qty in self.env['stock.move']._read_group(
+            [('state', '=', 'done'), ('date', '>=', since), ('location_dest_id.usage', '=', 'customer')],
+            ['product_id'], ['product_qty:sum'],
+        ):
+            score[product.product_tmpl_id.id] += qty or 0.0
+        for product, qty in self.env['stock.quant']._read_group(
+            [('location_id.usage', '=', 'internal'), ('quantity', '>', 0)],
+            ['product_id'], ['quantity:sum'],
+        ):
+            if qty and qty > 0:
+                score[product.product_tmpl_id.id] += 1.0
+        if not score:
+            return None
+        barcode_by_id = {pid: barcode for barcode, pid in cache['products'].items()}
+        ranked = sorted(
+            (tmpl_id for tmpl_id in score if tmpl_id in barcode_by_id),
+            key=lambda tmpl_id: -score[tmpl_id],
+        )[:settings['top']]
+        return {'refs': {barcode_by_id[tmpl_id] for tmpl_id in ranked}, 'hot': 0, 'cold': 0}
+
+    def _iter_priority_batches(self, endpoint, token, priority, batch_size, limit=None):
+        """Ordering stage: lượt 1 duyệt page, xử lý ngay item ưu tiên (bán chạy / còn
+        tồn), item còn lại ghi ra spool gzip tạm; lượt 2 đọc spool xử lý phần còn lại.
+        Mỗi page chỉ fetch 1 lần; sync bị dừng giữa chừng vẫn đã làm mới hàng quan trọng."""
+        refs = priority['refs']
+        with tempfile.TemporaryFile() as raw_spool:
+            spool = gzip.GzipFile(fileobj=raw_spool, mode='wb')
+            for items in self._iter_batches(endpoint, token, batch_size, limit):
+                hot = []
+                for idx, item in enumerate(items):
+                    if self._acc_item_sku(item, idx) in refs:
+                        hot.append(item)
+                    else:
+                        spool.write(json.dumps(item, ensure_ascii=False).encode('utf-8') + b'\n')
+                        priority['cold'] += 1
+                if hot:
+                    priority['hot'] += len(hot)
+                    yield hot
+            spool.close()
+            raw_spool.seek(0)
+            with gzip.GzipFile(fileobj=raw_spool, mode='rb') as reader:
+                batch = []
+                for line in reader:
+                    batch.append(json.loads(line))
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+                if batch:
+                    yield batch
+
     def _count_endpoint_total(self, endpoint, token):
         """Lấy `totalElements` của endpoint Spring Boot bằng cách query 1 page size=1."""
         try:
@@ -1345,11 +1674,17 @@ class ProductSync(models.Model):
         except Exception:
             return 0
 
-    def _sync_streaming(self, endpoint, token, product_type, child_model=None, cache=None, error_ctx=None, limit=None, image_sync_ctx=None):
+    def _sync_streaming(self, endpoint, token, product_type, child_model=None, cache=None, error_ctx=None, limit=None,
+                        image_sync_ctx=None, progress=None, batches=None, priority=None, handled_refs=None):
         """Fetch → (prefetch image batch N+1 song song với process batch N) → commit.
 
         Pipeline: image download của batch kế tiếp chạy nền trên ThreadPool riêng,
         overlap với DB write của batch hiện tại để rút gọn tổng thời gian sync.
+        Có `progress` (SyncProgress): tiến độ đi qua bus cùng commit của batch,
+        chỉ ghi progress_done/progress_message xuống DB ở checkpoint.
+        `batches`: iterable các list item thay cho paging toàn endpoint (retry lỗi).
+        `priority` (_compute_sync_priority): xử lý item bán chạy / còn tồn trước.
+        `handled_refs` (set, tuỳ chọn): ghi lại mã của mọi item đã đưa vào _process_batch.
         """
         from concurrent.futures import ThreadPoolExecutor
         db = self.env.cr.dbname
@@ -1362,6 +1697,8 @@ class ProductSync(models.Model):
 
         def _run_batch(batch_idx, items):
             nonlocal total_success, total_failed
+            if handled_refs is not None:
+                handled_refs.update(self._acc_item_sku(item, idx) for idx, item in enumerate(items))
             try:
                 with Registry(db).cursor() as cr:
                     env = self.env(cr=cr)
@@ -1371,19 +1708,39 @@ class ProductSync(models.Model):
                             items, cache, product_type, child_model, error_ctx=error_ctx, image_sync_ctx=image_sync_ctx
                         )
                     processed = (success or 0) + (failed or 0)
-                    new_done = (self_batch.progress_done or 0) + processed
-                    self_batch.write({
-                        'progress_done': new_done,
-                        'progress_message': '%s: batch %s (+%s sản phẩm)' % (
-                            type_label, batch_idx, processed,
-                        ),
-                    })
+                    message = '%s: batch %s (+%s sản phẩm)' % (type_label, batch_idx, processed)
+                    if progress is None:
+                        self_batch.write({
+                            'progress_done': (self_batch.progress_done or 0) + processed,
+                            'progress_message': message,
+                        })
+                    else:
+                        progress.add(product_type, type_label, success, failed, message)
+                        self_batch._send_progress(progress.payload())
+                        if progress.checkpoint_due():
+                            self_batch.write({'progress_done': progress.done, 'progress_message': message})
+                            # Checkpoint đọc lại cờ dừng trên cursor batch (phòng NOTIFY bị lỡ).
+                            listener = get_cancel_listener(db)
+                            if listener is not None and self_batch.cancel_requested:
+                                listener.mark(rec_id)
+                    # Lỗi từng item của batch ghi 1 lần, cùng commit của batch.
+                    self_batch._flush_sync_errors(error_ctx)
                     cr.commit()
                 total_success += success
                 total_failed += failed
             except Exception as exc:
                 total_failed += len(items)
-                self._record_sync_error(error_ctx, product_type, 'CHUNK_ERR', ref=f"chunk={batch_idx}", exc=exc)
+                if progress is not None:
+                    progress.add(product_type, type_label, 0, len(items))
+                # Ghi theo mã từng item (không phải "chunk=N") để "Thử lại lỗi" map lại được CID.
+                for idx, item in enumerate(items):
+                    self._record_sync_error(error_ctx, product_type, 'CHUNK_ERR',
+                                            ref=self._acc_item_sku(item, idx), exc=exc)
+                try:
+                    with Registry(db).cursor() as cr:
+                        self.env(cr=cr)[self._name].browse(rec_id)._flush_sync_errors(error_ctx)
+                except Exception:
+                    pass
 
         # Prefetch executor: 1 worker là đủ vì _prefetch_images_parallel đã tự
         # tạo ThreadPool nội bộ. Worker này chỉ là "background driver".
@@ -1391,10 +1748,17 @@ class ProductSync(models.Model):
         prefetch_skipped = (not image_sync_ctx) or image_mode_norm == 'off'
         prefetch_exec = None if prefetch_skipped else ThreadPoolExecutor(max_workers=1)
         # Resume mode: pre-skip cả batch nếu mode='missing' và mọi item đã có ảnh.
-        resume_mode = image_active and image_mode_norm == 'missing'
+        # Không áp dụng khi caller truyền `batches` (retry lỗi): mã lỗi phải chạy
+        # lại qua _process_batch kể cả khi template đã có ảnh, nếu không sẽ biến
+        # mất khỏi danh sách lỗi mà không được xử lý.
+        resume_mode = image_active and image_mode_norm == 'missing' and batches is None
         try:
             pending = None  # (batch_idx, items, future_or_none)
-            for batch_idx, items in enumerate(self._iter_batches(endpoint, token, batch_size, limit), start=1):
+            if batches is None and priority:
+                batches = self._iter_priority_batches(endpoint, token, priority, batch_size, limit)
+            elif batches is None:
+                batches = self._iter_batches(endpoint, token, batch_size, limit)
+            for batch_idx, items in enumerate(batches, start=1):
                 # Cooperative cancel: kiểm tra cờ trước khi xử lý batch tiếp theo.
                 if self._is_cancel_requested():
                     _logger.warning(
@@ -1608,6 +1972,16 @@ class ProductSync(models.Model):
     def _get_id(self, cache, key, val):
         return cache.get(key, {}).get(val.upper(), False) if val else False
 
+    def _dry_run_skip_create(self, cache, model_name, name):
+        """Chạy thử: không tạo master data còn thiếu, chỉ ghi lại để báo cáo.
+
+        True → caller trả False (placeholder) thay vì create, giống NCC ở
+        `_upsert_supplier_partner`."""
+        if not self.env.context.get('vnop_sync_dry_run'):
+            return False
+        cache.setdefault('_dry_run_new_masters', set()).add((model_name, str(name)))
+        return True
+
     def _get_id_with_fallback(self, cache, key, dto):
         """Lookup id by cid first, then name as fallback.
         If not found and DTO has name, auto-create a product.cl record."""
@@ -1624,6 +1998,8 @@ class ProductSync(models.Model):
 
         # Auto-create product.cl record if we have at least a name
         if name and key == 'colors':
+            if self._dry_run_skip_create(cache, 'product.cl', name):
+                return False
             try:
                 vals = {'name': name}
                 if cid:
@@ -1650,13 +2026,7 @@ class ProductSync(models.Model):
 
     def _extract_dto_name(self, dto):
         """Lấy plain text từ DTO (ưu tiên name, fallback cid). Dùng cho field Char."""
-        if not dto:
-            return False
-        if isinstance(dto, str):
-            return dto.strip() or False
-        if not isinstance(dto, dict):
-            return False
-        return (dto.get('name') or dto.get('cid') or '').strip() or False
+        return dto_name(dto)
 
     def _get_or_create_master(self, cache, cache_key, dto):
         """Tra cứu id master data từ cache theo cid, sau đó fallback sang name.
@@ -1681,6 +2051,8 @@ class ProductSync(models.Model):
         if not model_name or not (name or cid):
             return False
 
+        if self._dry_run_skip_create(cache, model_name, name or cid):
+            return False
         try:
             vals = {'name': name or cid}
             if cid:
@@ -1717,6 +2089,8 @@ class ProductSync(models.Model):
         rid = cache.get('colors', {}).get(name_upper)
         if rid:
             return rid
+        if self._dry_run_skip_create(cache, 'product.cl', name):
+            return False
         try:
             with self.env.cr.savepoint():
                 rec = self.env['product.cl'].create({'name': name})
@@ -1763,6 +2137,8 @@ class ProductSync(models.Model):
             return False
 
         # Create
+        if self._dry_run_skip_create(cache, model_name, name or cid):
+            return False
         try:
             raw_name = name or cid
             # Viết hoa chữ cái đầu mỗi từ cho tên bảo hành
@@ -1867,9 +2243,11 @@ class ProductSync(models.Model):
                         [(name_field, '=', name)], limit=1
                     )
                 # Nếu currency đang inactive → kích hoạt để dùng được
-                if rec and model_name == 'res.currency' and not rec.active:
+                if rec and model_name == 'res.currency' and not rec.active \
+                        and not self.env.context.get('vnop_sync_dry_run'):
                     try:
-                        rec.with_context(tracking_disable=True).write({'active': True})
+                        with self.env.cr.savepoint():
+                            rec.with_context(tracking_disable=True).write({'active': True})
                         # _logger.info(
                         # '[ACC_SYNC][REF] field=%s input=%s action=activate_currency '
                         # 'result=%s sku=%s', field, input_repr, rec.id, sku
@@ -1905,6 +2283,8 @@ class ProductSync(models.Model):
             # Nếu tạo currency thì luôn truyền symbol (required not-null)
             if model_name == 'res.currency':
                 create_vals['symbol'] = cid or name or 'VND'
+            if self._dry_run_skip_create(cache, model_name, name or cid):
+                return False, None
 
             try:
                 with self.env.cr.savepoint():
@@ -2009,7 +2389,7 @@ class ProductSync(models.Model):
             return rec.id
 
         # Auto-create nếu có name
-        if not name:
+        if not name or self._dry_run_skip_create(cache, 'product.uv', name):
             return False
         try:
             create_vals = {'name': name}
@@ -2109,7 +2489,7 @@ class ProductSync(models.Model):
                     if c_name:
                         cache.setdefault('coatings', {})[c_name.upper()] = coating_id
 
-            if not coating_id and c_name:
+            if not coating_id and c_name and not self._dry_run_skip_create(cache, 'product.coating', c_name):
                 # Tạo mới coating nếu RS chỉ trả name (đưa vào lens_coating_ids)
                 try:
                     create_vals = {'name': c_name}
@@ -2252,14 +2632,12 @@ class ProductSync(models.Model):
 
     def _fetch_lens_stock(self, token, cfg):
         # Fetch stock snapshot from RS; no processing here
-        session = self._make_session()
         url = f"{cfg['base_url']}{cfg['lens_stock_endpoint']}"
         headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
 
         try:
-            response = session.get(
+            response = self._get_rs_client(cfg).get(
                 url, headers=headers,
-                verify=cfg['ssl_verify'],
                 timeout=cfg['api_timeout']
             )
             response.raise_for_status()
@@ -2431,95 +2809,177 @@ class ProductSync(models.Model):
           theo keyword (vì không có SPH/CYL hoặc không cần).
         - FRAME / ACCESSORY: theo keyword.
         - Không khớp → '00' (Chưa phân nhóm).
+
+        Quy tắc nằm ở bảng tra `rs_mapping.CLASSIFICATION_TABLE`; text đã memo (text_norm).
         """
-        import unicodedata
-
-        def _norm(s):
-            if not s:
-                return ''
-            s = unicodedata.normalize('NFD', str(s))
-            s = ''.join(ch for ch in s if unicodedata.category(ch) != 'Mn')
-            s = s.replace('đ', 'd').replace('Đ', 'D')
-            return s.lower().strip()
-
-        haystacks = [_norm(grp_type_name), _norm(product_name)]
-        text = ' '.join(h for h in haystacks if h)
-        dc2 = (default_code or '')[:2]
-        code = None
-
-        def _to_float(raw):
-            if isinstance(raw, dict):
-                raw = raw.get('value') or raw.get('val') or raw.get('name') or raw.get('cid')
-            if raw in (None, '', False):
-                return None
-            try:
-                return float(raw)
-            except (TypeError, ValueError):
-                return None
+        code = classification_code(product_type, default_code, grp_type_name, product_name, item)
+        classif_id = self._get_classification_id_by_code(cache, code) if code else False
+        if not classif_id:
+            classif_id = self._get_classification_id_by_code(cache, '00')
+        return classif_id
 
-        def _pick(src, keys):
-            if not isinstance(src, dict):
-                return None
-            for k in keys:
-                if k in src:
-                    v = src.get(k)
-                    if v is not None and v != '':
-                        return v
-            return None
+    # Lookup master data dùng trong spec rs_mapping: fn(rec, cache, value).
+    # Không bind `self` lúc compile vì mỗi batch chạy trên cursor/env riêng.
+    _RS_MAPPING_LOOKUPS = {
+        'country': lambda rec, cache, dto: rec._get_or_create(cache, 'countries', 'res.country', dto),
+        'warranty': lambda rec, cache, dto: rec._get_or_create(cache, 'warranties', 'product.warranty', dto),
+        'color': lambda rec, cache, dto: rec._get_id_with_fallback(cache, 'colors', dto),
+        'uv': lambda rec, cache, dto: rec._resolve_uv_id(dto, cache),
+        'frame_type': lambda rec, cache, dto: rec._get_or_create_master(cache, 'frame_types', dto),
+        'shape': lambda rec, cache, dto: rec._get_or_create_master(cache, 'shapes', dto),
+        've': lambda rec, cache, dto: rec._get_or_create_master(cache, 'ves', dto),
+        'material': lambda rec, cache, dto: rec._get_or_create_master(cache, 'materials', dto),
+    }
 
-        # ── LENS ───────────────────────────────────────────────────────────
-        if product_type == 'lens' or dc2 in ('01', '15'):
-            # Hai tròng / Đa tròng: dùng keyword.
-            if 'hai trong' in text or 'bifocal' in text or 'flap top' in text:
-                code = '020204'
-            elif 'da trong' in text:
-                # Đa tròng: phân biệt cận/viễn theo keyword (nếu có), default cận.
-                code = '20302' if 'vien' in text else '20301'
-            else:
-                # Đơn tròng: phân nhóm theo SPH/CYL.
-                src = item if isinstance(item, dict) else {}
-                sph = _to_float(_pick(src, ['sph', 'SPH', 'sphValue', 'sphVal', 'sphDTO', 'sphDto', 'sphdto']))
-                cyl = _to_float(_pick(src, ['cyl', 'CYL', 'cylValue', 'cylVal', 'cylDTO', 'cylDto', 'cyldto']))
-                # "Đổi màu" (ĐM) → dải mã 0201xx (06–10), thường → 0201xx (01–05).
-                is_dm = 'doi mau' in text or ' dm ' in f' {text} '
-                if sph is None:
-                    code = None
-                elif sph == 0:
-                    code = '020106' if is_dm else '020101'
-                elif sph < 0:
-                    if cyl is not None and cyl != 0:
-                        code = '020108' if is_dm else '020103'
-                    else:
-                        code = '020107' if is_dm else '020102'
-                else:  # sph > 0
-                    if cyl is not None and cyl != 0:
-                        code = '020110' if is_dm else '020105'
-                    else:
-                        code = '020109' if is_dm else '020104'
+    def _get_rs_field_mapping(self, cache):
+        """Mapping RS → vals đã compile, tạo 1 lần mỗi lần sync (lưu trong cache)."""
+        mapping = cache.get('_rs_mapping')
+        if mapping is None:
+            tmpl = self.env['product.template']
+            converters = {
+                'sph': as_selection(tmpl._SPH_VALUES),
+                'cyl': as_selection(tmpl._CYL_VALUES),
+            }
+            lookups = self._RS_MAPPING_LOOKUPS
+            uom = self.env.ref('vnop_sync.uom_chiec', raise_if_not_found=False) \
+                or self.env.ref('uom.product_uom_unit')
+            mapping = cache['_rs_mapping'] = {
+                'base': compile_spec(BASE_SPEC, lookups, converters),
+                'lens': compile_spec(LENS_SPEC, lookups, converters),
+                'opt': compile_spec(OPT_SPEC, lookups, converters),
+                'uom_id': uom.id,
+                'company_id': self._get_template_company_id() if 'company_id' in tmpl._fields else None,
+                'categ_all_id': self.env.ref('product.product_category_all').id,
+            }
+        return mapping
 
-        # ── FRAME (Gọng kính / Kính râm) ───────────────────────────────────
-        # Trong sync, gọng kính dùng product_type='opt' (không phải 'frame').
-        elif product_type in ('frame', 'opt') or dc2 == '04':
-            if 'kinh ram' in text or 'sunglass' in text or 'sun glass' in text:
-                code = '0301'
-            else:
-                code = '010101'
+    def _get_template_company_id(self):
+        """Company ghi lên product.template khi sync.
 
-        # ── ACCESSORY ──────────────────────────────────────────────────────
-        elif product_type == 'accessory':
-            if 'bao kinh' in text:
-                code = '050101'
-            elif 'khan lau' in text:
-                code = '050201'
-            elif 'phu kien' in text:
-                code = '050301'
-            else:
-                code = '050301'
+        Nhiều cấu hình (mỗi company 1) cùng sync 1 catalog theo barcode → template
+        dùng chung (company trống), chỉ seller / thuế theo company đang chạy. Chỉ
+        có 1 cấu hình thì giữ như cũ: gán company của cấu hình."""
+        if self.sudo().search_count([]) > 1:
+            return False
+        return self.env.company.id
+
+    def _get_category_id_by_code(self, cache, code):
+        """product.category theo `code` (TK/GK...), cache theo lần sync."""
+        misc = cache.setdefault('misc', {})
+        key = f'_categ_code_{code}'
+        if key not in misc:
+            categ = self.env['product.category'].search([('code', '=', code)], limit=1) \
+                if 'code' in self.env['product.category']._fields else False
+            misc[key] = categ.id if categ else False
+        return misc[key]
+
+    def _goc_lens_design(self, cache, name_raw):
+        """Get or create product.design by name."""
+        nm = str(name_raw or '').strip()
+        if not nm:
+            return False
+        key = nm.upper()
+        cid = cache.get('designs', {}).get(key)
+        if cid:
+            return cid
+        found = self.env['product.design'].search([('name', '=', nm)], limit=1)
+        if found:
+            cache.setdefault('designs', {})[key] = found.id
+            return found.id
+        if self._dry_run_skip_create(cache, 'product.design', nm):
+            return False
+        try:
+            with self.env.cr.savepoint():
+                rec = self.env['product.design'].create({'name': nm})
+            cache.setdefault('designs', {})[key] = rec.id
+            return rec.id
+        except Exception:
+            return False
 
-        classif_id = self._get_classification_id_by_code(cache, code) if code else False
-        if not classif_id:
-            classif_id = self._get_classification_id_by_code(cache, '00')
-        return classif_id
+    def _goc_lens_material(self, cache, name_raw):
+        """Get or create product.lens.material by name."""
+        nm = str(name_raw or '').strip()
+        if not nm:
+            return False
+        key_lower = nm.lower()
+        cid = cache.get('lens_materials', {}).get(key_lower)
+        if cid:
+            return cid
+        found = self.env['product.lens.material'].search([('name', '=', nm)], limit=1)
+        if found:
+            cache.setdefault('lens_materials', {})[key_lower] = found.id
+            return found.id
+        if self._dry_run_skip_create(cache, 'product.lens.material', nm):
+            return False
+        try:
+            with self.env.cr.savepoint():
+                rec = self.env['product.lens.material'].create({'name': nm})
+            cache.setdefault('lens_materials', {})[key_lower] = rec.id
+            return rec.id
+        except Exception:
+            return False
+
+    def _goc_lens_index(self, cache, dto):
+        """Get or create product.lens.index theo name (đã bỏ field cid)."""
+        if not dto:
+            return False
+        name = (dto.get('name') or dto.get('value') or dto.get('cid') or '').strip()
+        if not name:
+            return False
+        cached = cache.get('lens_indexes', {}).get(name.upper())
+        if cached:
+            return cached
+        found = self.env['product.lens.index'].search([('name', '=', name)], limit=1)
+        if found:
+            cache.setdefault('lens_indexes', {})[name.upper()] = found.id
+            return found.id
+        if self._dry_run_skip_create(cache, 'product.lens.index', name):
+            return False
+        try:
+            with self.env.cr.savepoint():
+                rec = self.env['product.lens.index'].create({'name': name})
+            cache.setdefault('lens_indexes', {})[name.upper()] = rec.id
+            return rec.id
+        except Exception:
+            return False
+
+    def _extract_lens_index_dto(self, item):
+        raw_index = (
+                item.get('indexdto')
+                or item.get('indexDto')
+                or item.get('indexDTO')
+                or item.get('lensIndexdto')
+                or item.get('lensIndexDto')
+                or item.get('refractiveIndexDto')
+                or (item.get('productdto') or {}).get('indexdto')
+                or (item.get('productdto') or {}).get('indexDto')
+                or (item.get('productdto') or {}).get('refractiveIndexDto')
+                or {}
+        )
+        if isinstance(raw_index, dict):
+            index_dto = raw_index
+        else:
+            index_dto = {'name': str(raw_index).strip()} if raw_index not in (None, '', False) else {}
+
+        if not index_dto:
+            index_name = first_non_empty(
+                item.get('index'),
+                item.get('refractiveIndex'),
+                item.get('chietSuat'),
+                (item.get('productdto') or {}).get('index'),
+                (item.get('productdto') or {}).get('refractiveIndex')
+            )
+
+            # Fallback cuối: parse từ fullname (vd: "... 1.67 ...")
+            if not index_name:
+                fullname = (item.get('productdto') or {}).get('fullname') or ''
+                match = re.search(r'\b1\.\d{2}\b', fullname)
+                if match:
+                    index_name = match.group(0)
+
+            if index_name:
+                index_dto = {'name': index_name}
+        return index_dto
 
     def _prepare_base_vals(self, item, cache, product_type, coating_ids=None, lens_template_key=None, image_sync_ctx=None):
         # Một số endpoint có thể trả key khác nhau (productdto/productDto/...) hoặc flatten trực tiếp.
@@ -2529,40 +2989,13 @@ class ProductSync(models.Model):
             or item.get('productDTO')
             or {}
         )
-
-        def _pick_str(src, keys):
-            if not isinstance(src, dict):
-                return ''
-            for k in keys:
-                v = src.get(k)
-                if v in (None, False):
-                    continue
-                s = str(v).strip()
-                if s:
-                    return s
-            return ''
-
-        def _looks_like_code(s):
-            # Avoid treating English name (contains spaces) as a code/default_code.
-            return bool(s) and not any(ch.isspace() for ch in str(s))
-
-        def _pick_code(src, keys):
-            if not isinstance(src, dict):
-                return ''
-            for k in keys:
-                v = src.get(k)
-                if v in (None, False):
-                    continue
-                s = str(v).strip()
-                if s and _looks_like_code(s):
-                    return s
-            return ''
+        mapping = self._get_rs_field_mapping(cache)
 
         # CID là khoá chính trong hệ thống RS.
         # Đồng nhất cho mọi loại sản phẩm: chỉ lấy các trường dạng "code" (không có khoảng trắng).
         cid = (
-            _pick_code(dto, ['cid', 'default_code', 'defaultCode', 'code', 'sku'])
-            or _pick_code(item, ['cid', 'default_code', 'defaultCode', 'code', 'sku'])
+            pick_code(dto, ['cid', 'default_code', 'defaultCode', 'code', 'sku'])
+            or pick_code(item, ['cid', 'default_code', 'defaultCode', 'code', 'sku'])
         )
         if not cid:
             raise ValueError("Missing CID")
@@ -2570,32 +3003,24 @@ class ProductSync(models.Model):
         # default_code là "Mã viết tắt" trên Odoo: sync thống nhất cho mọi loại sản phẩm.
         default_code = cid
 
-
         product_name = dto.get('fullname') or 'Unknown'
         forced_len_type = False
         grp_type_name = ((dto.get('groupdto') or {}).get('groupTypedto') or {}).get('name', 'Khác')
 
         # ── Resolve categ từ default_code prefix ──
         categ_id = False
-        _parsed_brand_id = False
 
         if default_code and len(default_code) >= 2:
             # Rule: mã bắt đầu bằng "01" → danh mục TK, len_type=DT
             if default_code[:2] == '01':
-                _tk_cat = self.env['product.category'].search([('code', '=', 'TK')], limit=1) if 'code' in self.env['product.category']._fields else False
-                if _tk_cat:
-                    categ_id = _tk_cat.id
+                categ_id = self._get_category_id_by_code(cache, 'TK')
                 forced_len_type = 'DT'
             # Rule: mã bắt đầu bằng "04" → danh mục GK
             elif default_code[:2] == '04':
-                _gk_cat = self.env['product.category'].search([('code', '=', 'GK')], limit=1) if 'code' in self.env['product.category']._fields else False
-                if _gk_cat:
-                    categ_id = _gk_cat.id
+                categ_id = self._get_category_id_by_code(cache, 'GK')
             # Rule: mã bắt đầu bằng "15" → danh mục TK, Bifocal → HT
             elif default_code[:2] == '15':
-                _tk_cat = self.env['product.category'].search([('code', '=', 'TK')], limit=1) if 'code' in self.env['product.category']._fields else False
-                if _tk_cat:
-                    categ_id = _tk_cat.id
+                categ_id = self._get_category_id_by_code(cache, 'TK')
                 if 'bifocal' in (product_name or '').lower():
                     forced_len_type = 'HT'
 
@@ -2605,7 +3030,7 @@ class ProductSync(models.Model):
                 categ_id = accessory_categ_id
 
         if not categ_id:
-            categ_id = self.env.ref('product.product_category_all').id
+            categ_id = mapping['categ_all_id']
 
         # Currency lookup (cần trước seller_ids để truyền currency_id đúng)
         currency_zone_cid = (dto.get('currencyZoneDTO') or {}).get('cid', '')
@@ -2630,14 +3055,15 @@ class ProductSync(models.Model):
                     if _cur:
                         currency_id = _cur.id
                         # Nếu currency đang inactive, kích hoạt để dùng được
-                        if not _cur.active:
+                        if not _cur.active and not self.env.context.get('vnop_sync_dry_run'):
                             try:
-                                _cur.write({'active': True})
+                                with self.env.cr.savepoint():
+                                    _cur.write({'active': True})
                                 # _logger.info(f"✅ Activated inactive currency: {currency_zone_cid.upper()} (id={currency_id})")
                             except Exception as e:
                                 # _logger.warning(f"⚠️ Không kích hoạt được currency {currency_zone_cid!r}: {e}")
                                 pass
-                    else:
+                    elif not self._dry_run_skip_create(cache, 'res.currency', currency_zone_cid.upper()):
                         try:
                             with self.env.cr.savepoint():
                                 _cur = self.env['res.currency'].create({
@@ -2690,6 +3116,8 @@ class ProductSync(models.Model):
                 continue
 
             supplier_partner = partner_candidate
+            if self.env.context.get('vnop_sync_dry_run'):
+                continue
             self._upsert_supplier_bank_account(
                 supplier_partner,
                 s_det,
@@ -2737,45 +3165,25 @@ class ProductSync(models.Model):
         product_kind = 'consu'
         is_storable = True
 
-        # Basic Vals
+        # Basic Vals — field đơn giản map theo spec (rs_mapping.BASE_SPEC)
         vals = {
             'name': product_name,
             'barcode': default_code,
             'type': product_kind,
             'is_storable': is_storable,
             'categ_id': categ_id,
-            'uom_id': cache.setdefault('_uom_unit_id', self.env.ref('vnop_sync.uom_chiec', raise_if_not_found=False) and self.env.ref('vnop_sync.uom_chiec').id or self.env.ref('uom.product_uom_unit').id),
-            'uom_po_id': cache['_uom_unit_id'],
-            'list_price': self._to_float(dto.get('rtPrice'), default=0.0),
+            'uom_id': mapping['uom_id'],
+            'uom_po_id': mapping['uom_id'],
             'standard_price': self._to_float(dto.get('orPrice'), default=0.0) * self._to_float(
                 (dto.get('currencyZoneDTO') or {}).get('value'),
                 default=1.0
             ),
             'supplier_taxes_id': [(6, 0, [tax_id])] if tax_id else [(5,)],
-            'brand_id': _parsed_brand_id or False,
-            'country_id': self._get_or_create(cache, 'countries', 'res.country', dto.get('codto')),
-            'warranty_id': self._get_or_create(cache, 'warranties', 'product.warranty', dto.get('warrantydto')),
-            'warranty_supplier_id': self._get_or_create(cache, 'warranties', 'product.warranty', dto.get('warrantySupplierdto')),
-            'warranty_retail_id': self._get_or_create(cache, 'warranties', 'product.warranty', dto.get('warrantyRetailDTO')),
-            # Custom Fields (prefixed with x_)
-            'x_eng_name': dto.get('engName', ''),
-            'description': dto.get('note', ''),
-            'x_uses': dto.get('uses', ''),
-            'x_guide': dto.get('guide', ''),
-            'x_warning': dto.get('warning', ''),
-            'x_preserve': dto.get('preserve', ''),
-            'x_accessory_total': int(dto.get('accessoryTotal') or 0),
+            'brand_id': False,
             'product_status': product_status,
-            'x_currency_zone_code': (dto.get('currencyZoneDTO') or {}).get('cid', ''),
-            'x_currency_zone_value': self._to_float((dto.get('currencyZoneDTO') or {}).get('value'), default=0.0),
-            'x_ws_price': self._to_float(dto.get('wsPrice') or dto.get('wsPriceMax'), default=0.0),
-            'x_ws_price_min': self._to_float(dto.get('wsPriceMin'), default=0.0),
-            'x_ws_price_max': self._to_float(dto.get('wsPriceMax'), default=0.0),
-            'manufacturer_months': int((dto.get('warrantydto') or {}).get('value') or 0),
-            'company_months': int((dto.get('warrantySupplierdto') or {}).get('value') or 0),
-            'bao_hanh_ban_le': int((dto.get('warrantyRetailDTO') or {}).get('value') or 0),
             'x_group_type_name': grp_type_name,
         }
+        apply_spec(mapping['base'], item, dto, self, cache, vals)
 
         # Map nhóm sản phẩm cũ → classification_id mới.
         # Lens: SPH/CYL từ item → 0201xx; Hai/Đa tròng theo keyword. Frame/Accessory theo keyword.
@@ -2795,63 +3203,11 @@ class ProductSync(models.Model):
             vals['len_type'] = forced_len_type
 
         # Set company cho toàn bộ sản phẩm sync (nếu product.template có field company_id)
-        if 'company_id' in self.env['product.template']._fields:
-            vals['company_id'] = self.env.company.id
+        if mapping['company_id'] is not None:
+            vals['company_id'] = mapping['company_id']
 
         # ─── Lens specs (template-level only; no variants) ────────────────
         if product_type == 'lens':
-            def safe_float(val):
-                if val is None or val == '':
-                    return None
-                try:
-                    return float(val)
-                except (TypeError, ValueError):
-                    return None
-
-            def safe_int(val):
-                if val is None or val == '':
-                    return None
-                try:
-                    return int(str(val).replace('mm', '').replace('MM', '').strip())
-                except (TypeError, ValueError):
-                    return None
-
-            def pick_value(source, keys):
-                for key in keys:
-                    if key in source:
-                        val = source.get(key)
-                        # Dùng `is not None` thay vì `not in (None, '', False)`
-                        # vì 0 == False trong Python → 0.00 (ADD hợp lệ) bị bỏ qua sai
-                        if val is not None and val != '':
-                            return val
-                return None
-
-            def extract_number(raw):
-                if isinstance(raw, dict):
-                    raw = raw.get('value') or raw.get('val') or raw.get('name') or raw.get('cid')
-                return raw
-
-            def extract_label(value):
-                if isinstance(value, dict):
-                    return (value.get('name') or value.get('cid') or '').strip()
-                if isinstance(value, (list, tuple)):
-                    labels = [extract_label(v) for v in value]
-                    labels = [l for l in labels if l]
-                    return ', '.join(labels)
-                if value in (None, '', False):
-                    return ''
-                return str(value).strip()
-
-            def first_non_empty(*values):
-                for val in values:
-                    if isinstance(val, dict):
-                        text = extract_label(val)
-                    else:
-                        text = str(val).strip() if val not in (None, '', False) else ''
-                    if text:
-                        return text
-                return ''
-
             if coating_ids is None:
                 coating_ids, coating_codes = self._resolve_lens_coatings(item, cache)
             # coating_codes chỉ cần cho lens_template_key, đã được tính trước khi gọi hàm này
@@ -2871,214 +3227,26 @@ class ProductSync(models.Model):
                 item.get('design_2'),
                 item.get('design2dto')
             )
-            raw_index = (
-                    item.get('indexdto')
-                    or item.get('indexDto')
-                    or item.get('indexDTO')
-                    or item.get('lensIndexdto')
-                    or item.get('lensIndexDto')
-                    or item.get('refractiveIndexDto')
-                    or (item.get('productdto') or {}).get('indexdto')
-                    or (item.get('productdto') or {}).get('indexDto')
-                    or (item.get('productdto') or {}).get('refractiveIndexDto')
-                    or {}
-            )
-            if isinstance(raw_index, dict):
-                index_dto = raw_index
-            else:
-                index_dto = {'name': str(raw_index).strip()} if raw_index not in (None, '', False) else {}
-
-            if not index_dto:
-                index_name = first_non_empty(
-                    item.get('index'),
-                    item.get('refractiveIndex'),
-                    item.get('chietSuat'),
-                    (item.get('productdto') or {}).get('index'),
-                    (item.get('productdto') or {}).get('refractiveIndex')
-                )
-
-                # Fallback cuối: parse từ fullname (vd: "... 1.67 ...")
-                if not index_name:
-                    fullname = (item.get('productdto') or {}).get('fullname') or ''
-                    match = re.search(r'\b1\.\d{2}\b', fullname)
-                    if match:
-                        index_name = match.group(0)
-
-                if index_name:
-                    index_dto = {'name': index_name}
-
-            uv_dto = item.get('uvdto') or item.get('uvDto') or item.get('uvDTO') or {}
-            hmc_val = (
-                    item.get('hmcDto') or item.get('hmcdto') or item.get('hmcDTO')
-                    or item.get('hmc') or item.get('HMC')
-                    or item.get('isHmc') or item.get('isHMC')
-                    or item.get('hmcCode') or item.get('hmccode')
-                    or item.get('hmcValue') or item.get('hmcName')
-            )
-            pho_val = (
-                    item.get('phoDto') or item.get('phodto') or item.get('phoDTO')
-                    or item.get('photochromicDto') or item.get('photochromic') or item.get('PHO')
-                    or item.get('isPhotochromic') or item.get('photochromicCode')
-                    or item.get('photochromicValue') or item.get('photochromicName')
-            )
-            tint_val = (
-                    item.get('tintDto') or item.get('tintdto') or item.get('tintDTO')
-                    or item.get('tint') or item.get('TINT') or item.get('tinted')
-                    or item.get('isTinted') or item.get('tintCode')
-                    or item.get('tintValue') or item.get('tintName')
-                    or item.get('tintLevel')
-                # NOTE: colorInt KHÔNG đưa vào đây — nó đã map vào lens_color_int riêng
-            )
-            sph_raw = pick_value(item, ['sph', 'SPH', 'sphValue', 'sphVal', 'sphDTO', 'sphDto', 'sphdto'])
-            cyl_raw = pick_value(item, ['cyl', 'CYL', 'cylValue', 'cylVal', 'cylDTO', 'cylDto', 'cyldto'])
-            add_raw = pick_value(item, ['lensAdd', 'add', 'ADD', 'addValue', 'addVal', 'addDTO', 'addDto', 'adddto'])
-            axis_raw = pick_value(item, ['axis', 'Axis', 'AXIS'])
-
-            # ── Helper: get-or-create Many2one master data for lens ────────────────────
-            def _goc_design(name_raw):
-                """Get or create product.design by name."""
-                nm = str(name_raw or '').strip()
-                # _logger.debug("🔎 _goc_design called with=%s", nm or None)
-                if not nm:
-                    return False
-                key = nm.upper()
-                cid = cache.get('designs', {}).get(key)
-                if cid:
-                    # _logger.debug("✅ _goc_design cache hit name=%s id=%s", nm, cid)
-                    return cid
-                found = self.env['product.design'].search([('name', '=', nm)], limit=1)
-                if found:
-                    cache.setdefault('designs', {})[key] = found.id
-                    # _logger.debug("✅ _goc_design search hit name=%s id=%s", nm, found.id)
-                    return found.id
-                try:
-                    with self.env.cr.savepoint():
-                        rec = self.env['product.design'].create({'name': nm})
-                    cache.setdefault('designs', {})[key] = rec.id
-                    # _logger.debug("✅ _goc_design created name=%s id=%s", nm, rec.id)
-                    return rec.id
-                except Exception as e:
-                    # _logger.warning(f"⚠️ Không tạo được product.design name={nm!r}: {e}")
-                    return False
-
-            def _goc_material(name_raw):
-                """Get or create product.lens.material by name."""
-                nm = str(name_raw or '').strip()
-                # _logger.debug("🔎 _goc_material called with=%s", nm or None)
-                if not nm:
-                    return False
-                key_lower = nm.lower()
-                cid = cache.get('lens_materials', {}).get(key_lower)
-                if cid:
-                    # _logger.debug("✅ _goc_material cache hit name=%s id=%s", nm, cid)
-                    return cid
-                found = self.env['product.lens.material'].search([('name', '=', nm)], limit=1)
-                if found:
-                    cache.setdefault('lens_materials', {})[key_lower] = found.id
-                    # _logger.debug("✅ _goc_material search hit name=%s id=%s", nm, found.id)
-                    return found.id
-                try:
-                    with self.env.cr.savepoint():
-                        rec = self.env['product.lens.material'].create({'name': nm})
-                    cache.setdefault('lens_materials', {})[key_lower] = rec.id
-                    # _logger.debug("✅ _goc_material created name=%s id=%s", nm, rec.id)
-                    return rec.id
-                except Exception as e:
-                    # _logger.warning(f"⚠️ Không tạo được product.lens.material name={nm!r}: {e}")
-                    return False
-
-            def _goc_index(dto):
-                """Get or create product.lens.index theo name (đã bỏ field cid)."""
-                if not dto:
-                    return False
-                name = (dto.get('name') or dto.get('value') or dto.get('cid') or '').strip()
-                if not name:
-                    return False
-                cached = cache.get('lens_indexes', {}).get(name.upper())
-                if cached:
-                    return cached
-                found = self.env['product.lens.index'].search([('name', '=', name)], limit=1)
-                if found:
-                    cache.setdefault('lens_indexes', {})[name.upper()] = found.id
-                    return found.id
-                try:
-                    with self.env.cr.savepoint():
-                        rec = self.env['product.lens.index'].create({'name': name})
-                    cache.setdefault('lens_indexes', {})[name.upper()] = rec.id
-                    return rec.id
-                except Exception:
-                    return False
-
-            def _to_selection(raw_val, allowed_keys):
-                """Convert numeric SPH/CYL value to selection key string '-X.XX'.
-                Trả về False nếu giá trị không nằm trong allowed_keys."""
-                if raw_val is None or raw_val == '':
-                    return False
-                try:
-                    fval = float(raw_val)
-                except (TypeError, ValueError):
-                    return False
-                key = f"-{abs(fval):.2f}" if fval < 0 else f"{fval:.2f}"
-                return key if key in allowed_keys else False
-
-            sph_keys = set(self.env['product.template']._SPH_VALUES)
-            cyl_keys = set(self.env['product.template']._CYL_VALUES)
 
             # Resolve Many2one IDs (get-or-create)
-            d1_id = _goc_design(design_1)
-            d2_id = _goc_design(design_2)
+            d1_id = self._goc_lens_design(cache, design_1)
+            d2_id = self._goc_lens_design(cache, design_2)
             material_raw = first_non_empty(item.get('material'), item.get('materialdto'))
-            mat_id = _goc_material(material_raw)
-            idx_id = _goc_index(index_dto)
-
-            # _logger.info(
-            # "🔍 Lens mapping candidates | design1=%s | design2=%s | material=%s | index_cid=%s | index_name=%s | coating_ids=%s",
-            # design_1 or None,
-            # design_2 or None,
-            # material_raw or None,
-            # (index_dto.get('cid') or None),
-            # (index_dto.get('name') or index_dto.get('value') or None),
-            # coating_ids,
-            # )
+            mat_id = self._goc_lens_material(cache, material_raw)
+            idx_id = self._goc_lens_index(cache, self._extract_lens_index_dto(item))
 
             design_ids = [d for d in (d1_id, d2_id) if d]
             material_ids = [mat_id] if mat_id else []
             lens_display_vals = {
-                'lens_base_curve': safe_float(item.get('base')),
                 # Many2many: design / material (set toàn bộ — replace existing)
                 'lens_design_ids': [(6, 0, design_ids)] if design_ids else None,
                 'lens_material_ids': [(6, 0, material_ids)] if material_ids else None,
                 'lens_index_id': idx_id,
-                'lens_uv_id': self._resolve_uv_id(uv_dto, cache) or None,
-                'lens_color_int': (item.get('colorInt') or '') or None,
-                # Màu sắc HMC / Photochromic / Tinted (get-or-create product.cl)
-                'lens_cl_hmc_id': self._get_id_with_fallback(
-                    cache, 'colors',
-                    item.get('clhmcdto') or item.get('clHmcdto') or item.get('clHMCdto') or item.get('clHmcDto')
-                ) or None,
-                'lens_cl_pho_id': self._get_id_with_fallback(
-                    cache, 'colors',
-                    item.get('clphodto') or item.get('clPhodto') or item.get('clPHOdto') or item.get('clPhoDto')
-                ) or None,
-                'lens_cl_tint_id': self._get_id_with_fallback(
-                    cache, 'colors',
-                    item.get('clTintdto') or item.get('cltintdto') or item.get('clTINTdto') or item.get('clTintDto')
-                ) or None,
                 # Many2many coating:
                 #   coating_ids có phần tử  → [(6, 0, [id,...])] ghi vào DB
                 #   coating_ids rỗng        → None → cleanup loop loại bỏ → giữ dữ liệu cũ
                 'lens_coating_ids': [(6, 0, coating_ids)] if coating_ids else None,
                 'lens_template_key': lens_template_key,
-                # SPH / CYL Selection: chỉ ghi nếu khớp với danh mục cho phép
-                'x_sph': _to_selection(extract_number(sph_raw), sph_keys),
-                'x_cyl': _to_selection(extract_number(cyl_raw), cyl_keys),
-                'x_add': safe_float(extract_number(add_raw)),
-                'x_axis': safe_int(axis_raw),
-                # x_prism là Float — phải qua safe_float để né placeholder string ("none","null")
-                'x_prism': safe_float(extract_number(item.get('prism'))),
-                'x_prism_base': extract_label(item.get('prismBase') or item.get('prism_base')) or False,
-                'x_mir_coating': extract_label(item.get('mirCoating')) or None,
-                'x_diameter': safe_int(item.get('diameter')),
             }
 
             # ── Cleanup: CHỈ loại bỏ None ──────────────────────────────────────────────
@@ -3090,15 +3258,8 @@ class ProductSync(models.Model):
             for _k, _v in list(lens_display_vals.items()):
                 if _v is None:
                     lens_display_vals.pop(_k)
-
-            # _logger.info(
-            # "📝 [LENS VALS] uv=%s | coating=%s | cl_hmc=%s | cl_pho=%s | cl_tint=%s",
-            # lens_display_vals.get('lens_uv_id', 'SKIPPED'),
-            # lens_display_vals.get('lens_coating_ids', 'SKIPPED'),
-            # lens_display_vals.get('lens_cl_hmc_id', 'SKIPPED'),
-            # lens_display_vals.get('lens_cl_pho_id', 'SKIPPED'),
-            # lens_display_vals.get('lens_cl_tint_id', 'SKIPPED'),
-            # )
+            # Field còn lại map theo spec (rs_mapping.LENS_SPEC), cũng bỏ None.
+            apply_spec(mapping['lens'], item, dto, self, cache, lens_display_vals, drop_none=True)
 
             vals.update(lens_display_vals)
 
@@ -3168,7 +3329,7 @@ class ProductSync(models.Model):
                 rid = cache.get(cache_key, {}).get(name.upper())
 
             # Tự động create nếu có model_name và chưa tìm thấy
-            if not rid and model_name:
+            if not rid and model_name and not self._dry_run_skip_create(cache, model_name, name or cid):
                 try:
                     model_fields = self.env[model_name]._fields
                     vals_create = {'name': name or cid}
@@ -3195,40 +3356,17 @@ class ProductSync(models.Model):
 
         return [(6, 0, ids)] if ids else [(5, 0, 0)]
 
-    _RS_GENDER_MAP = {'0': 'M', '1': 'F', '2': 'U'}
+    _RS_GENDER_MAP = RS_GENDER_MAP
 
     def _prepare_opt_vals(self, item, cache):
         """Map opt specs từ API trực tiếp vào opt_* fields trên product.template."""
-        # RS gender: 0=Nam, 1=Nữ, 2=Unisex → map sang giá trị Selection M/F/U
-        gender_raw = item.get('gender')
-        gender_key = str(gender_raw) if gender_raw is not None else ''
-        opt_gender = self._RS_GENDER_MAP.get(gender_key, False)
-        vals = {
-            'opt_season': item.get('season', ''),
-            'opt_model': item.get('model', ''),
-            'opt_serial': item.get('serial', ''),
-            'opt_sku': item.get('sku', ''),
-            'opt_color': item.get('color', ''),
-            'opt_gender': opt_gender,
-            'opt_temple_width': int(item.get('templeWidth') or 0),
-            'opt_lens_width': int(item.get('lensWidth') or 0),
-            'opt_lens_span': int(item.get('lensSpan') or 0),
-            'opt_lens_height': int(item.get('lensHeight') or 0),
-            'opt_bridge_width': int(item.get('bridgeWidth') or 0),
-            # ─── Màu mắt kính: API trả tên màu plain text → Char ─────────────────────
-            'opt_color_lens': self._extract_dto_name(item.get('colorLensdto')),
-            # ─── Thiết kế gọng – auto-create nếu chưa có bản ghi master ──────────────
-            'opt_frame_style': self._extract_dto_name(item.get('framedto')),
-            'opt_frame_type_id': self._get_or_create_master(cache, 'frame_types', item.get('frameTypedto')),
-            'opt_shape_id': self._get_or_create_master(cache, 'shapes', item.get('shapedto')),
-            'opt_ve_id': self._get_or_create_master(cache, 'ves', item.get('vedto')),
-            'opt_temple_style': self._extract_dto_name(item.get('templedto')),
-            # ─── Chất liệu gọng – auto-create nếu chưa có bản ghi master ─────────────
-            'opt_material_ve_id': self._get_or_create_master(cache, 'materials', item.get('materialVedto')),
+        dto = item.get('productdto') or {}
+        # Field scalar / master Many2one map theo spec (rs_mapping.OPT_SPEC)
+        vals = apply_spec(self._get_rs_field_mapping(cache)['opt'], item, dto, self, cache, {})
+        vals.update({
             'opt_material_temple_tip_ids': [(6, 0, [_id])] if (
                 _id := self._get_or_create_master(cache, 'materials', item.get('materialTempleTipdto'))
             ) else [(5, 0, 0)],
-            'opt_material_lens_id': self._get_or_create_master(cache, 'materials', item.get('materialLensdto')),
             # ─── Chất liệu Many2many – key thực tế từ API: materialsFrontdto / materialsTempledto
             'opt_materials_front_ids': self._resolve_opt_material_dtos(
                 item,
@@ -3251,10 +3389,7 @@ class ProductSync(models.Model):
                 'coatings', cache,
                 model_name=None, log_label='coatingsdto'
             ),
-            # ─── Màu sắc: API trả plain string, lưu vào Char ───────────────────────────
-            'opt_color_front': (item.get('colorFront') or '').strip() or False,
-            'opt_color_temple': (item.get('colorTemple') or '').strip() or False,
-        }
+        })
 
         # ─── RS adapter: chỉ set khi payload có key tương ứng (tránh override về 0) ───
         if 'lensLength' in item or 'daiMat' in item:
@@ -3265,7 +3400,6 @@ class ProductSync(models.Model):
 
         # bao_hanh_ban_le đã map chuẩn ở _prepare_base_vals từ productdto.warrantyRetailDTO.value
         # Chỉ override nếu endpoint opt trả months trực tiếp.
-        dto = item.get('productdto') or {}
         if 'retailWarrantyMonths' in dto or 'baoHanhBanLe' in item:
             vals['bao_hanh_ban_le'] = int(dto.get('retailWarrantyMonths') or item.get('baoHanhBanLe') or 0)
 
@@ -3428,313 +3562,307 @@ class ProductSync(models.Model):
                 success += 1
             except Exception as e:
                 failed += 1
-                self._record_sync_error(error_ctx, 'lens', 'UPDATE', ref=f"tmpl_id={tmpl_id}", exc=e)
+                self._record_sync_error(
+                    error_ctx, 'lens', 'UPDATE', ref=vals.get('barcode') or f"tmpl_id={tmpl_id}", exc=e,
+                    product_tmpl_id=tmpl_id,
+                )
                 # _logger.error(f"Lens update error tmpl_id={tmpl_id}: {e}")
 
         return success, failed
 
-    def _process_accessory_batch(self, items, cache, error_ctx=None, image_sync_ctx=None):
-        """Xử lý accessories: mỗi record một savepoint độc lập + logging đầy đủ.
-        HOÀN TOÀN TÁCH BIỆT khỏi lens/opt. Không sửa bất kỳ helper nào lens/opt dùng.
-        """
-        import json as _json_acc
-        import traceback as _tb_acc
-
-        self._load_env()
-        log_raw = os.getenv('LOG_ACCESSORY_RAW_STRUCTURE', 'False').lower() == 'true'
-        log_debug = os.getenv('LOG_ACCESSORY_DEBUG', 'False').lower() == 'true'
-        raw_limit = int(os.getenv('LOG_RAW_SAMPLE_LIMIT', '3'))
-
-        total = len(items)
-        success = 0
-        skipped = 0
-        errors = 0
-        raw_logged = 0
-        err_by_step = {'currency': 0, 'map': 0, 'create': 0, 'write': 0, 'other': 0}
-
-        # _logger.info(
-        # "[ACC_SYNC] Starting batch: total=%d "
-        # "log_raw=%s log_debug=%s raw_limit=%d",
-        # total, log_raw, log_debug, raw_limit
-        # )
-        # [ACC_SYNC][FETCH] — dữ liệu đã được fetch trước, log tổng ở đây
-        # _logger.info(
-        # "[ACC_SYNC][FETCH] status=pre-fetched duration_ms=N/A items=%d", total
-        # )
-
-        for idx, item in enumerate(items):
-            dto = item.get('productdto') or {}
-            cid = (dto.get('cid') or '').strip()
-            sku = cid or f'idx_{idx}'
-            ext_id = (dto.get('id') or dto.get('externalId') or cid or f'idx_{idx}')
-            name = dto.get('fullname') or dto.get('name') or 'Unknown'
-
-            # _logger.info(
-            # "[ACC_SYNC][START] idx=%d ext_id=%s sku=%s name=%s",
-            # idx, ext_id, sku, name
-            # )
-
-            step = 'init'
+    def _get_accessory_sync_settings(self, cache):
+        """Cờ env cho accessory sync — đọc 1 lần mỗi lần sync (.env đã load ở _get_api_config)."""
+        misc = cache.setdefault('misc', {})
+        settings = misc.get('_acc_settings')
+        if settings is None:
             try:
-                with self.env.cr.savepoint():
+                chunk = max(1, int(os.getenv('ACCESSORY_BULK_CHUNK', '100')))
+            except (TypeError, ValueError):
+                chunk = 100
+            settings = misc['_acc_settings'] = {
+                'bulk': os.getenv('ACCESSORY_BULK_MODE', 'True').lower() == 'true',
+                'chunk': chunk,
+                'log_debug': os.getenv('LOG_ACCESSORY_DEBUG', 'False').lower() == 'true',
+            }
+        return settings
 
-                    # ── RAW_KEYS ────────────────────────────────────────────────
-                    if log_debug:
-                        # _logger.info(
-                        # "[ACC_SYNC][RAW_KEYS] idx=%d keys=%s",
-                        # idx, list(item.keys())
-                        # )
-                        pass
+    @staticmethod
+    def _acc_item_sku(item, idx):
+        dto = item.get('productdto') or {}
+        return (dto.get('cid') or '').strip() or f'idx_{idx}'
 
-                    # ── RAW_JSON sample (giới hạn raw_limit record + truncate 2KB) ──
-                    if log_raw and raw_logged < raw_limit:
-                        try:
-                            raw_str = _json_acc.dumps(
-                                item, ensure_ascii=False, default=str
-                            )
-                            if len(raw_str) > 2048:
-                                raw_str = raw_str[:2048] + '...(truncated)'
-                            # _logger.info(
-                            # "[ACC_SYNC][RAW_JSON] idx=%d:\n%s", idx, raw_str
-                            # )
-                            raw_logged += 1
-                        except Exception as _je:
-                            # _logger.warning(
-                            # "[ACC_SYNC] json dump error idx=%d: %s", idx, _je
-                            # )
-                            pass
+    @staticmethod
+    def _acc_err_step_key(step):
+        """Step lỗi → key thống kê err_by_step ('ref_currency' → 'currency', còn lại 'other')."""
+        step_key = step.replace('ref_', '')
+        return step_key if step_key in ('currency', 'map', 'create', 'write') else 'other'
 
-                    # ── MAP_IN ──────────────────────────────────────────────────
-                    cz_dto = dto.get('currencyZoneDTO') or {}
-                    # _logger.info(
-                    # "[ACC_SYNC][MAP_IN] sku=%s important_fields={"
-                    # "currency=%s, brand=%s, country=%s, warranty=%s, "
-                    # "uom=unit, category=%s, price=%s, cost=%s, barcode=%s}",
-                    # sku,
-                    # cz_dto.get('cid') or 'N/A',
-                    # (dto.get('tmdto')      or {}).get('cid') or 'N/A',
-                    # (dto.get('codto')      or {}).get('cid') or 'N/A',
-                    # (dto.get('warrantydto') or {}).get('cid') or 'N/A',
-                    # (dto.get('groupdto')   or {}).get('name') or 'N/A',
-                    # dto.get('rtPrice', 0),
-                    # dto.get('orPrice', 0),
-                    # dto.get('barcode') or 'N/A',
-                    # )
+    def _prepare_accessory_vals(self, item, cache, sku, image_sync_ctx=None):
+        """Map 1 accessory → (vals, pid). Lỗi được bọc trong _AccessoryStepError(step)."""
+        dto = item.get('productdto') or {}
+        step = 'init'
+        try:
+            # ── currency: optional (fallback về company currency) ───────
+            step = 'ref_currency'
+            cz_dto = dto.get('currencyZoneDTO') or {}
+            cur_code = (cz_dto.get('cid') or '').strip()
+            self._acc_get_or_create_ref(
+                'currency',
+                cur_code or (cz_dto if cz_dto else None),
+                cache, 'acc_currency', 'res.currency',
+                name_field='name', code_field='name',
+                required=False, sku=sku
+            )
 
-                    # ── currency: optional (fallback về company currency) ───────
-                    step = 'ref_currency'
-                    cur_code = (cz_dto.get('cid') or '').strip()
-                    _cur_id, _cur_err = self._acc_get_or_create_ref(
-                        'currency',
-                        cur_code or (cz_dto if cz_dto else None),
-                        cache, 'acc_currency', 'res.currency',
-                        name_field='name', code_field='name',
-                        required=False, sku=sku
-                    )
+            # ── brand: optional ─────────────────────────────────────────
+            step = 'ref_brand'
+            self._acc_get_or_create_ref(
+                'brand', dto.get('tmdto'), cache, 'brands', 'product.brand',
+                name_field='name', code_field='cid',
+                required=False, sku=sku
+            )
 
-                    # ── brand: optional ─────────────────────────────────────────
-                    step = 'ref_brand'
-                    self._acc_get_or_create_ref(
-                        'brand', dto.get('tmdto'), cache, 'brands', 'product.brand',
-                        name_field='name', code_field='cid',
-                        required=False, sku=sku
-                    )
+            # ── country: optional ───────────────────────────────────────
+            step = 'ref_country'
+            self._acc_get_or_create_ref(
+                'country', dto.get('codto'), cache, 'countries',
+                'res.country',
+                name_field='name', code_field='code',
+                required=False, sku=sku
+            )
 
-                    # ── country: optional ───────────────────────────────────────
-                    step = 'ref_country'
-                    self._acc_get_or_create_ref(
-                        'country', dto.get('codto'), cache, 'countries',
-                        'res.country',
-                        name_field='name', code_field='code',
-                        required=False, sku=sku
-                    )
+            # ── warranty: optional ──────────────────────────────────────
+            step = 'ref_warranty'
+            self._acc_get_or_create_ref(
+                'warranty', dto.get('warrantydto'), cache, 'warranties',
+                'product.warranty',
+                name_field='name', code_field='cid',
+                required=False, sku=sku
+            )
 
-                    # ── warranty: optional ──────────────────────────────────────
-                    step = 'ref_warranty'
-                    self._acc_get_or_create_ref(
-                        'warranty', dto.get('warrantydto'), cache, 'warranties',
-                        'product.warranty',
-                        name_field='name', code_field='cid',
-                        required=False, sku=sku
-                    )
+            # ── map vals (dùng hàm chung) ───────────────────────────────
+            step = 'map'
+            vals, pid = self._prepare_base_vals(item, cache, 'accessory', image_sync_ctx=image_sync_ctx)
 
-                    # ── map vals (dùng hàm chung — không sửa) ──────────────────
-                    step = 'map'
-                    vals, pid = self._prepare_base_vals(item, cache, 'accessory', image_sync_ctx=image_sync_ctx)
+            # ── Accessory-specific field mapping (chỉ cho accessory) ────
+            step = 'acc_fields'
 
-                    # ── Accessory-specific field mapping (chỉ cho accessory) ──────────
-                    step = 'acc_fields'
-                    _fdbg = os.getenv('LOG_ACCESSORY_FIELD_DEBUG', 'False').lower() == 'true'
+            def _sf(v):
+                try:
+                    return float(v) if v not in (None, '', False) else 0.0
+                except (TypeError, ValueError):
+                    return 0.0
 
-                    # Helper: an toàn safe_float
-                    def _sf(v):
-                        try:
-                            return float(v) if v not in (None, '', False) else 0.0
-                        except (TypeError, ValueError):
-                            return 0.0
-
-                    # Helper: thử nhiều key từ item/dto
-                    def _pick(*keys):
-                        for k in keys:
-                            v = item.get(k)
-                            if v is not None:
-                                return v
-                            v = dto.get(k)
-                            if v is not None:
-                                return v
-                        return None
-
-                    # ── Đọc raw values từ RS ─────────────────────────────────────
-                    raw_design = _pick('designdto', 'designDto', 'design')
-                    raw_shape = _pick('shapedto', 'shapeDto', 'shape')
-                    raw_material = _pick('materialdto', 'materialDto', 'material')
-                    raw_color = _pick('colordto', 'colorDto', 'color',
-                                      'acc_color', 'accColor')
-                    raw_width = _pick('width', 'accWidth', 'acc_width', 'chieu_rong')
-                    raw_length = _pick('length', 'accLength', 'acc_length', 'chieu_dai')
-                    raw_height = _pick('height', 'accHeight', 'acc_height', 'chieu_cao')
-                    raw_head = _pick('head', 'accHead', 'acc_head', 'dau')
-                    raw_body = _pick('body', 'accBody', 'acc_body', 'than')
-
-                    if _fdbg:
-                        # _logger.info(
-                        # "[ACC_FIELD][RAW] sku=%s design=%r shape=%r "
-                        # "material=%r color=%r "
-                        # "width=%r length=%r height=%r head=%r body=%r",
-                        # sku,
-                        # raw_design, raw_shape, raw_material, raw_color,
-                        # raw_width, raw_length, raw_height, raw_head, raw_body,
-                        # )
-                        pass
+            # Thử nhiều key từ item/dto
+            def _pick(*keys):
+                for k in keys:
+                    v = item.get(k)
+                    if v is not None:
+                        return v
+                    v = dto.get(k)
+                    if v is not None:
+                        return v
+                return None
 
-                    # ── Resolve Many2one IDs (accessory-specific) ────────────────
-                    acc_design_id, _ = self._acc_get_or_create_ref(
-                        'design_id', raw_design, cache, 'designs',
-                        'product.design',
-                        name_field='name', code_field='cid',
-                        required=False, sku=sku
-                    )
-                    acc_shape_id, _ = self._acc_get_or_create_ref(
-                        'shape_id', raw_shape, cache, 'shapes',
-                        'product.shape',
-                        name_field='name', code_field='cid',
-                        required=False, sku=sku
-                    )
-                    acc_material_id, _ = self._acc_get_or_create_ref(
-                        'material_id', raw_material, cache, 'materials',
-                        'product.material',
-                        name_field='name', code_field='cid',
-                        required=False, sku=sku
-                    )
-                    # color_id → product.color (KHÁC product.cl của lens)
-                    acc_color_id, _ = self._acc_get_or_create_ref(
-                        'color_id', raw_color, cache, 'acc_colors',
-                        'product.color',
-                        name_field='name', code_field='cid',
-                        required=False, sku=sku
-                    )
+            acc_design_id, _ = self._acc_get_or_create_ref(
+                'design_id', _pick('designdto', 'designDto', 'design'), cache, 'designs',
+                'product.design',
+                name_field='name', code_field='cid',
+                required=False, sku=sku
+            )
+            acc_shape_id, _ = self._acc_get_or_create_ref(
+                'shape_id', _pick('shapedto', 'shapeDto', 'shape'), cache, 'shapes',
+                'product.shape',
+                name_field='name', code_field='cid',
+                required=False, sku=sku
+            )
+            acc_material_id, _ = self._acc_get_or_create_ref(
+                'material_id', _pick('materialdto', 'materialDto', 'material'), cache, 'materials',
+                'product.material',
+                name_field='name', code_field='cid',
+                required=False, sku=sku
+            )
+            # color_id → product.color (KHÁC product.cl của lens)
+            acc_color_id, _ = self._acc_get_or_create_ref(
+                'color_id', _pick('colordto', 'colorDto', 'color', 'acc_color', 'accColor'), cache, 'acc_colors',
+                'product.color',
+                name_field='name', code_field='cid',
+                required=False, sku=sku
+            )
+            vals.update({
+                'design_id': acc_design_id or False,
+                'shape_id': acc_shape_id or False,
+                'material_id': acc_material_id or False,
+                'color_id': acc_color_id or False,
+                'acc_width': _sf(_pick('width', 'accWidth', 'acc_width', 'chieu_rong')),
+                'acc_length': _sf(_pick('length', 'accLength', 'acc_length', 'chieu_dai')),
+                'acc_height': _sf(_pick('height', 'accHeight', 'acc_height', 'chieu_cao')),
+                'acc_head': _sf(_pick('head', 'accHead', 'acc_head', 'dau')),
+                'acc_body': _sf(_pick('body', 'accBody', 'acc_body', 'than')),
+            })
 
-                    # ── Cập nhật vals với các field phụ kiện ───────────────────────
-                    acc_field_vals = {
-                        'design_id': acc_design_id or False,
-                        'shape_id': acc_shape_id or False,
-                        'material_id': acc_material_id or False,
-                        'color_id': acc_color_id or False,
-                        'acc_width': _sf(raw_width),
-                        'acc_length': _sf(raw_length),
-                        'acc_height': _sf(raw_height),
-                        'acc_head': _sf(raw_head),
-                        'acc_body': _sf(raw_body),
-                    }
-                    vals.update(acc_field_vals)
-
-                    if _fdbg:
-                        # _logger.info(
-                        # "[ACC_FIELD][MAPPED] sku=%s "
-                        # "design_id=%s shape_id=%s material_id=%s color_id=%s "
-                        # "acc_width=%s acc_length=%s acc_height=%s "
-                        # "acc_head=%s acc_body=%s",
-                        # sku,
-                        # acc_design_id, acc_shape_id, acc_material_id, acc_color_id,
-                        # _sf(raw_width), _sf(raw_length), _sf(raw_height),
-                        # _sf(raw_head), _sf(raw_body),
-                        # )
-                        pass
+            categ_id = vals.get('categ_id')
+            if categ_id and not self.env['product.category'].browse(categ_id).exists():
+                fallback_id = self._get_accessory_category_id(cache)
+                vals['categ_id'] = fallback_id or self.env.ref('product.product_category_all').id
+        except Exception as exc:
+            raise _AccessoryStepError(step, exc) from exc
+        return vals, pid
 
-                    categ_id = vals.get('categ_id')
-                    if categ_id:
-                        categ = self.env['product.category'].browse(categ_id)
-                        if not categ.exists():
-                            fallback_id = self._get_accessory_category_id(cache)
-                            fallback = self.env['product.category'].browse(fallback_id) if fallback_id else self.env.ref('product.product_category_all')
-                            # _logger.warning(
-                            # "[ACC_SYNC][WARN] sku=%s categ_id=%s không tồn tại → dùng fallback %s",
-                            # sku, categ_id, fallback.id
-                            # )
-                            vals['categ_id'] = fallback.id
+    def _process_accessory_batch(self, items, cache, error_ctx=None, image_sync_ctx=None):
+        """Xử lý accessories. Mặc định bulk (ACCESSORY_BULK_MODE=True) — xem
+        `_process_accessory_batch_bulk`; tắt thì mỗi record một savepoint độc lập.
+        HOÀN TOÀN TÁCH BIỆT khỏi lens/opt. Không sửa bất kỳ helper nào lens/opt dùng.
+        """
+        settings = self._get_accessory_sync_settings(cache)
+        err_by_step = {'currency': 0, 'map': 0, 'create': 0, 'write': 0, 'other': 0}
+        if settings['bulk']:
+            success, errors = self._process_accessory_batch_bulk(
+                items, cache, err_by_step, error_ctx=error_ctx, image_sync_ctx=image_sync_ctx,
+            )
+        else:
+            success, errors = self._process_accessory_batch_single(
+                items, cache, err_by_step, error_ctx=error_ctx, image_sync_ctx=image_sync_ctx,
+            )
+        if errors and settings['log_debug']:
+            _logger.info("[ACC_SYNC] batch total=%d success=%d errors=%d by_step=%s",
+                         len(items), success, errors, err_by_step)
+        return success, errors
 
-                    # ── create / write ──────────────────────────────────────────
+    def _process_accessory_batch_single(self, items, cache, err_by_step, error_ctx=None, image_sync_ctx=None):
+        """Mỗi record: savepoint → prepare → create/write."""
+        success = errors = 0
+        Template = self.env['product.template'].with_context(tracking_disable=True)
+        for idx, item in enumerate(items):
+            sku = self._acc_item_sku(item, idx)
+            step = 'init'
+            try:
+                with self.env.cr.savepoint():
+                    try:
+                        vals, pid = self._prepare_accessory_vals(item, cache, sku, image_sync_ctx=image_sync_ctx)
+                    except _AccessoryStepError as step_exc:
+                        step = step_exc.step
+                        raise step_exc.original
                     if pid:
                         step = 'write'
-                        saved_rec = self.env['product.template'].browse(pid).with_context(
-                            tracking_disable=True
-                        )
-                        saved_rec.write(vals)
-                        if log_debug:
-                            # _logger.info(
-                            # "[ACC_SYNC][WRITE_OK] sku=%s tmpl_id=%s", sku, pid
-                            # )
-                            pass
+                        Template.browse(pid).write(vals)
                     else:
                         step = 'create'
-                        saved_rec = self.env['product.template'].with_context(
-                            tracking_disable=True
-                        ).create(vals)
+                        saved_rec = Template.create(vals)
                         cache['products'][saved_rec.barcode] = saved_rec.id
-                        if log_debug:
-                            # _logger.info(
-                            # "[ACC_SYNC][CREATE_OK] sku=%s new_tmpl_id=%s",
-                            # sku, saved_rec.id
-                            # )
-                            pass
-
-                    # ── Readback log (chỉ khi LOG_ACCESSORY_FIELD_DEBUG=True) ──
-                    if _fdbg:
-                        try:
-                            rb = saved_rec
-                        except Exception as _rb_err:
-                            # _logger.warning("[ACC_FIELD][READBACK_ERR] sku=%s err=%s", sku, _rb_err)
-                            pass
-
-                    success += 1
-
+                success += 1
             except Exception as exc:
                 errors += 1
-                skipped += 1
+                err_by_step[self._acc_err_step_key(step)] += 1
                 self._record_sync_error(error_ctx, 'accessory', 'ITEM_ERR', ref=sku, exc=exc)
+        return success, errors
 
-                # Phân loại step để thống kê
-                step_key = step.replace('ref_', '')
-                if step_key in err_by_step:
-                    err_by_step[step_key] += 1
-                else:
-                    err_by_step['other'] += 1
+    def _bisect_savepoint(self, entries, apply_fn, on_error):
+        """Chạy `apply_fn(entries)` trong 1 savepoint; lỗi → chia đôi tới khi cô lập
+        được bản ghi hỏng (O(log n) savepoint cho mỗi bản ghi lỗi thay vì n).
+        `apply_fn` phải flush bên trong để lỗi constraint nổ trước khi cập nhật cache.
+        Trả về (success, failed)."""
+        if not entries:
+            return 0, 0
+        try:
+            with self.env.cr.savepoint():
+                apply_fn(entries)
+            return len(entries), 0
+        except Exception as exc:
+            if len(entries) == 1:
+                on_error(entries[0], exc)
+                return 0, 1
+            mid = len(entries) // 2
+            s1, f1 = self._bisect_savepoint(entries[:mid], apply_fn, on_error)
+            s2, f2 = self._bisect_savepoint(entries[mid:], apply_fn, on_error)
+            return s1 + s2, f1 + f2
+
+    def _process_accessory_batch_bulk(self, items, cache, err_by_step, error_ctx=None, image_sync_ctx=None):
+        """Pipeline bulk giống lens/opt: prepare cả page → create theo lô → write theo lô.
+
+        - Create/write mỗi lô trong 1 savepoint; lô lỗi được chia đôi (`_bisect_savepoint`)
+          để chỉ bỏ đúng bản ghi hỏng.
+        - Barcode trùng trong cùng page: bản ghi sau được ghi (write) vào product vừa
+          tạo, đúng như khi xử lý tuần tự.
+        - err_by_step: lỗi prepare theo step, lỗi create/write theo lô đã cô lập.
+        """
+        chunk = self._get_accessory_sync_settings(cache)['chunk']
+        Template = self.env['product.template'].with_context(tracking_disable=True)
+        success = errors = 0
+        to_create, to_update, deferred = [], [], []
+        pending_barcodes = set()
+
+        def _fail(step, sku, exc):
+            nonlocal errors
+            errors += 1
+            err_by_step[self._acc_err_step_key(step)] += 1
+            self._record_sync_error(error_ctx, 'accessory', 'ITEM_ERR', ref=sku, exc=exc)
+
+        # ─── Bước 1: Chuẩn bị dữ liệu cả page ─────────────────────────────
+        # Không savepoint từng item (như lens): helper get-or-create tự bọc lệnh ghi.
+        for idx, item in enumerate(items):
+            sku = self._acc_item_sku(item, idx)
+            try:
+                vals, pid = self._prepare_accessory_vals(item, cache, sku, image_sync_ctx=image_sync_ctx)
+            except _AccessoryStepError as step_exc:
+                _fail(step_exc.step, sku, step_exc.original)
+                continue
+            except Exception as exc:
+                _fail('other', sku, exc)
+                continue
+            barcode = vals.get('barcode')
+            if pid:
+                to_update.append((sku, pid, vals))
+            elif barcode and barcode in pending_barcodes:
+                deferred.append((sku, vals))
+            else:
+                if barcode:
+                    pending_barcodes.add(barcode)
+                to_create.append((sku, vals))
+
+        # ─── Bước 2: Batch Create (bisect khi lỗi) ────────────────────────
+        def _create(entries):
+            recs = Template.create([vals for _, vals in entries])
+            self.env.flush_all()
+            for rec in recs:
+                if rec.barcode:
+                    cache['products'][rec.barcode] = rec.id
+
+        for i in range(0, len(to_create), chunk):
+            s, _f = self._bisect_savepoint(
+                to_create[i:i + chunk], _create,
+                lambda entry, exc: _fail('create', entry[0], exc),
+            )
+            success += s
 
-                # Log raw JSON của record lỗi (lần đầu)
-                if log_raw and raw_logged < raw_limit:
-                    try:
-                        raw_str = _json_acc.dumps(
-                            item, ensure_ascii=False, default=str
-                        )
-                        if len(raw_str) > 2048:
-                            raw_str = raw_str[:2048] + '...(truncated)'
-                        # _logger.info(
-                        # "[ACC_SYNC][RAW_JSON] ERROR_SAMPLE idx=%d:\n%s",
-                        # idx, raw_str
-                        # )
-                        raw_logged += 1
-                    except Exception:
-                        pass
+        # Barcode trùng trong page → ghi vào product vừa tạo (hoặc tạo nếu bản đầu lỗi).
+        for sku, vals in deferred:
+            pid = cache['products'].get(vals.get('barcode'))
+            if pid:
+                to_update.append((sku, pid, vals))
+            else:
+                s, _f = self._bisect_savepoint(
+                    [(sku, vals)], _create, lambda entry, exc: _fail('create', entry[0], exc),
+                )
+                success += s
+
+        # ─── Bước 3: Batch Update (1 savepoint mỗi lô, bisect khi lỗi) ────
+        def _write(entries):
+            # Các bản ghi cùng vals (giá, nhóm, NCC... giống nhau) → 1 lệnh write.
+            groups = {}
+            for _sku, pid, vals in entries:
+                key = json.dumps(vals, sort_keys=True, default=str)
+                groups.setdefault(key, (vals, []))[1].append(pid)
+            for vals, pids in groups.values():
+                Template.browse(pids).write(vals)
+            self.env.flush_all()
+
+        for i in range(0, len(to_update), chunk):
+            s, _f = self._bisect_savepoint(
+                to_update[i:i + chunk], _write,
+                lambda entry, exc: _fail('write', entry[0], exc),
+            )
+            success += s
 
         return success, errors
 
@@ -3868,7 +3996,10 @@ class ProductSync(models.Model):
                             with self.env.cr.savepoint():
                                 self.env[child_model].create(cv)
                         except Exception as e:
-                            self._record_sync_error(error_ctx, product_type, 'CHILD_CREATE', ref=rec.id, exc=e)
+                            self._record_sync_error(
+                                error_ctx, product_type, 'CHILD_CREATE', ref=rec.barcode or rec.id, exc=e,
+                                product_tmpl_id=rec.id,
+                            )
                             # _logger.error(f"Child Create Error product {rec.id}: {e}")
 
         # ─── Bước 3: Batch Update ─────────────────────────────────────────
@@ -3898,7 +4029,10 @@ class ProductSync(models.Model):
                         success += 1
                 except Exception as e:
                     failed += 1
-                    self._record_sync_error(error_ctx, product_type, 'UPDATE', ref=f"tmpl_id={pid}", exc=e)
+                    self._record_sync_error(
+                        error_ctx, product_type, 'UPDATE', ref=vals.get('barcode') or f"tmpl_id={pid}", exc=e,
+                        product_tmpl_id=pid,
+                    )
                     # _logger.error(f"Update Error [{product_type}] tmpl_id={pid}: {e}")
 
         return success, failed
@@ -3914,9 +4048,20 @@ class ProductSync(models.Model):
         'images': 'vnop_sync: Đồng bộ ảnh sản phẩm (chỉ tải ảnh thiếu — resume)',
         'images_force': 'vnop_sync: Đồng bộ lại TẤT CẢ ảnh sản phẩm (force)',
         'limited': 'vnop_sync: Đồng bộ giới hạn',
+        'retry': 'vnop_sync: Thử lại các sản phẩm bị lỗi',
+        'dry_run': 'vnop_sync: Chạy thử (báo cáo thay đổi, không ghi)',
     }
 
-    def _enqueue_sync_job(self, job, limit=0):
+    @api.autovacuum
+    def _gc_rs_spool(self):
+        """Dọn spool RS dùng chung (generation page + ảnh quá hạn)."""
+        if not spool_enabled():
+            return
+        removed = gc_spool()
+        if removed:
+            _logger.info("vnop_sync: autovacuum xoá %s mục spool RS quá hạn.", removed)
+
+    def _enqueue_sync_job(self, job, limit=0, refs=None):
         """Đẩy 1 `queue.job` để xử lý bất đồng bộ."""
         self.ensure_one()
         if self.sync_status in ('queued', 'in_progress'):
@@ -3932,13 +4077,15 @@ class ProductSync(models.Model):
         description = self._SYNC_JOB_DESCRIPTIONS.get(job, 'vnop_sync: Đồng bộ sản phẩm')
         if job == 'limited' and limit:
             description = f'{description} ({int(limit)} bản ghi)'
+        elif job == 'retry' and refs:
+            description = f'{description} ({sum(len(v) for v in refs.values())} mã)'
         self.write({
             'sync_status': 'queued',
             'sync_log': f'Đã enqueue: {description}. Queue Job worker sẽ xử lý.',
             'last_sync_date': fields.Datetime.now(),
             'cancel_requested': False,  # reset cờ cancel khi enqueue mới
         })
-        self.with_delay(description=description)._run_sync_job(job, int(limit or 0))
+        self.with_delay(description=description)._run_sync_job(job, int(limit or 0), refs=refs)
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
@@ -3949,7 +4096,7 @@ class ProductSync(models.Model):
             },
         }
 
-    def _run_sync_job(self, job, limit=0):
+    def _run_sync_job(self, job, limit=0, refs=None):
         """Được queue_job gọi bất đồng bộ để thực thi 1 job sync.
 
         Chạy trong cron worker (nhờ `queue_job_cron_jobrunner`) hoặc trong
@@ -3957,6 +4104,17 @@ class ProductSync(models.Model):
         của HTTP worker. Chỉ cần đảm bảo `limit_time_real_cron` đủ lớn.
         """
         self.ensure_one()
+        # LISTEN vnop_sync_cancel trong suốt job → _is_cancel_requested đọc cờ trong bộ nhớ.
+        dbname = self.env.cr.dbname
+        acquire_cancel_listener(dbname, self.id)
+        try:
+            # vnop_sync_inbound: ghi từ RS vào Odoo không bị đẩy ngược qua outbox.
+            sync = self.with_company(self.company_id) if self.company_id else self
+            return sync.with_context(vnop_sync_inbound=True)._execute_sync_job(job, limit, refs=refs)
+        finally:
+            release_cancel_listener(dbname, self.id)
+
+    def _execute_sync_job(self, job, limit=0, refs=None):
         image_mode = None
         job_limit = int(limit) or None
         if job == 'data':
@@ -3984,7 +4142,12 @@ class ProductSync(models.Model):
         self.env.cr.commit()
 
         try:
-            msg, full_log, stats = self._do_sync(limit=job_limit, image_mode=image_mode)
+            if job == 'retry':
+                msg, full_log, stats = self._do_retry_sync(refs or {})
+            elif job == 'dry_run':
+                msg, full_log, stats = self._do_sync_dry_run(limit=job_limit)
+            else:
+                msg, full_log, stats = self._do_sync(limit=job_limit, image_mode=image_mode)
         except _SyncCancelledError as e:
             _logger.warning("[vnop_sync] queue_job %s bị user dừng: %s", job, e)
             try:
@@ -3997,6 +4160,7 @@ class ProductSync(models.Model):
                         'progress_message': 'Đã dừng theo yêu cầu.',
                         'last_sync_date': fields.Datetime.now(),
                     })
+                    new_env[self._name].browse(self.id)._send_progress({'sync_id': self.id, 'state': 'cancelled'})
             except Exception:
                 pass
             return 'cancelled'
@@ -4013,24 +4177,31 @@ class ProductSync(models.Model):
                         'sync_log': f'Lỗi khi chạy job {job}: {str(e)[:2000]}',
                         'last_sync_date': fields.Datetime.now(),
                     })
+                    new_env[self._name].browse(self.id)._send_progress({'sync_id': self.id, 'state': 'error'})
             except Exception:
                 pass
             raise
 
         total_processed = stats['lens'] + stats['opt'] + stats['acc'] + stats['failed']
-        self.write({
+        vals = {
             'sync_status': 'success',
             'sync_log': full_log,
-            'total_synced': stats['lens'] + stats['opt'] + stats['acc'],
-            'total_failed': stats['failed'],
-            'lens_count': stats['lens'],
-            'opts_count': stats['opt'],
-            'other_count': stats['acc'],
             'last_sync_date': fields.Datetime.now(),
             'progress_done': total_processed,
             'progress_total': max(total_processed, self.progress_total or 0),
             'progress_message': 'Hoàn tất.',
-        })
+        }
+        if job not in ('retry', 'dry_run'):
+            # Retry / chạy thử không phải sync đầy đủ → giữ thống kê của lần sync gần nhất.
+            vals.update({
+                'total_synced': stats['lens'] + stats['opt'] + stats['acc'],
+                'total_failed': stats['failed'],
+                'lens_count': stats['lens'],
+                'opts_count': stats['opt'],
+                'other_count': stats['acc'],
+            })
+        self.write(vals)
+        self._send_progress({'sync_id': self.id, 'state': 'done'})
         _logger.info("[vnop_sync] queue_job %s hoàn tất: %s", job, msg)
         return msg
 
@@ -4059,6 +4230,21 @@ class ProductSync(models.Model):
         """
         return self._enqueue_sync_job('images')
 
+    def sync_retry_failed(self):
+        """Chỉ chạy lại các mã (CID/barcode) bị lỗi ở lần chạy cuối."""
+        self.ensure_one()
+        errors = self.env['product.sync.error'].search([
+            ('sync_id', '=', self.id), ('run_id', '=', self.last_run_id),
+        ]) if self.last_run_id else self.env['product.sync.error']
+        refs_by_type = errors._retry_refs_by_type()
+        if not refs_by_type:
+            raise UserError(_('Lần chạy cuối không có lỗi nào thử lại được theo mã sản phẩm.'))
+        return self._enqueue_sync_job('retry', refs=refs_by_type)
+
+    def sync_dry_run(self):
+        """Chạy thử: báo cáo sync sẽ tạo/sửa gì (theo field, kèm mẫu) mà không ghi gì."""
+        return self._enqueue_sync_job('dry_run')
+
     def sync_images_force(self):
         """Tải LẠI ảnh cho TẤT CẢ sản phẩm (kể cả product đã có ảnh).
 
@@ -4067,13 +4253,103 @@ class ProductSync(models.Model):
         """
         return self._enqueue_sync_job('images_force')
 
+    def _start_sync_run(self):
+        """Sinh run id cho lần chạy (gắn vào product.sync.error) và commit ngay —
+        batch ghi tiến độ trên cursor riêng, không được chờ lock của cursor job."""
+        run_id = '%s-%s' % (self.id, fields.Datetime.now().strftime('%Y%m%d%H%M%S'))
+        self.write({'last_run_id': run_id})
+        self.env.cr.commit()
+        return run_id
+
+    def _build_sync_log(self, msg, image_mode, image_sync_ctx, error_ctx, norm_stats_start=None):
+        """sync_log: tóm tắt + thống kê ảnh + đếm lỗi theo loại + vài mẫu.
+        Chi tiết đầy đủ từng item nằm ở product.sync.error (theo run id)."""
+        lines = [msg]
+        if norm_stats_start is not None:
+            hits, misses = text_norm_cache_stats()
+            hits -= norm_stats_start[0]
+            misses -= norm_stats_start[1]
+            if hits or misses:
+                lines.append(
+                    f"  Chuẩn hoá text: cache_hit={hits} | normalize={misses} "
+                    f"({hits * 100.0 / (hits + misses):.1f}% dùng lại)"
+                )
+        image_stats = image_sync_ctx.get('stats') or {}
+        if image_stats:
+            lines.append(
+                "\n── Ảnh sản phẩm ──\n"
+                f"  mode={image_mode} | downloaded={image_stats.get('downloaded', 0)} | "
+                f"fallback={image_stats.get('fallback_downloaded', 0)} | write={image_stats.get('written', 0)} | "
+                f"cache_hit={image_stats.get('cache_hits', 0)} | spool_hit={image_stats.get('spool_hits', 0)} | "
+                f"unchanged_skip={image_stats.get('unchanged_skipped', 0)} | "
+                f"existing_skip={image_stats.get('existing_kept', 0)} | no_url_skip={image_stats.get('no_url_skipped', 0)} | "
+                f"content_dedup={image_stats.get('content_dedup_hits', 0)} | "
+                f"same_content_skip={image_stats.get('content_unchanged_skipped', 0)}"
+            )
+        if error_ctx.get('counts'):
+            counts_sorted = sorted(error_ctx['counts'].items(), key=lambda kv: (-kv[1], kv[0]))
+            lines.append("\n── Tóm tắt lỗi theo loại ──")
+            for k, v in counts_sorted:
+                lines.append(f"  {k}: {v} lỗi")
+            if error_ctx.get('stored'):
+                lines.append(
+                    f"  → {error_ctx['stored']} lỗi chi tiết lưu tại 'Lỗi đồng bộ' (lần chạy {error_ctx.get('run_id')})"
+                )
+        if error_ctx.get('samples'):
+            lines.append(f"\n── Chi tiết lỗi ({len(error_ctx['samples'])} mẫu) ──")
+            lines.extend(error_ctx['samples'])
+
+        full_log = "\n".join(lines)
+        max_chars = error_ctx.get('max_chars', 200000)
+        if len(full_log) > max_chars:
+            full_log = full_log[:max_chars] + "\n...(truncated)"
+        return full_log
+
+    def _build_image_sync_ctx(self, cfg, cache, image_mode):
+        """Context ảnh dùng chung cho các batch của 1 lần chạy."""
+        product_tmpl = self.env['product.template']
+        track_source_url = 'x_rs_image_url' in product_tmpl._fields
+        # 1 index scan trên x_has_image (không join ir_attachment, không truyền
+        # list toàn bộ id). Sync chỉ data (mode='off') không cần đọc.
+        has_image_set = set()
+        existing_image_url_map = {}
+        existing_image_checksum_map = {}
+        if image_mode != 'off' and cache.get('products'):
+            try:
+                for row in product_tmpl.search_read(
+                    [('x_has_image', '=', True)], ['x_rs_image_url', 'x_rs_image_checksum'],
+                ):
+                    has_image_set.add(row['id'])
+                    if row.get('x_rs_image_url'):
+                        existing_image_url_map[row['id']] = row['x_rs_image_url'].strip()
+                    if row.get('x_rs_image_checksum'):
+                        existing_image_checksum_map[row['id']] = row['x_rs_image_checksum']
+            except Exception:
+                has_image_set = set()
+                existing_image_url_map = {}
+                existing_image_checksum_map = {}
+        image_sync_ctx = {
+            'token_manager': self._get_token_manager(cfg),
+            'cfg': cfg,
+            'mode': image_mode,
+            'track_source_url': track_source_url,
+            '_has_image_set': has_image_set,
+            '_existing_image_url_map': existing_image_url_map,
+            '_existing_image_checksum_map': existing_image_checksum_map,
+            'spool': ImageSpool() if spool_enabled() else None,
+        }
+        return image_sync_ctx
+
     def _do_sync(self, limit=None, image_mode=None):
         """Logic sync thực sự — chạy trên cursor riêng được truyền vào qua self.env."""
         token = self._get_access_token()
         cache = self._preload_all_data()
         cfg = self._get_api_config()
+        run_id = self._start_sync_run()
+        norm_stats_start = text_norm_cache_stats()
 
         # Pre-count tổng để UI tính %. Mỗi endpoint trả `totalElements` trên page meta.
+        progress = SyncProgress(self.id)
         try:
             t_lens = self._count_endpoint_total(cfg['lens_endpoint'], token)
             t_opt = self._count_endpoint_total(cfg['opts_endpoint'], token)
@@ -4081,6 +4357,10 @@ class ProductSync(models.Model):
             est_total = t_lens + t_opt + t_acc
             if limit and est_total > limit:
                 est_total = limit
+            progress.total = est_total
+            progress.set_endpoint_total('lens', 'Mắt', min(t_lens, limit) if limit else t_lens)
+            progress.set_endpoint_total('opt', 'Gọng', min(t_opt, limit) if limit else t_opt)
+            progress.set_endpoint_total('accessory', 'Phụ kiện', min(t_acc, limit) if limit else t_acc)
             if est_total > 0:
                 self.write({
                     'progress_total': est_total,
@@ -4088,62 +4368,39 @@ class ProductSync(models.Model):
                         est_total, t_lens, t_opt, t_acc,
                     ),
                 })
+                self._send_progress(progress.payload())
                 self.env.cr.commit()
         except Exception:
             pass
 
-        product_tmpl = self.env['product.template']
-        existing_ids = list(cache.get('products', {}).values())
         if image_mode is None:
             image_mode = self._get_image_sync_mode(limit=limit)
-        track_source_url = 'x_rs_image_url' in product_tmpl._fields
-        existing_image_url_map = {}
-        try:
-            has_image_set = set(
-                product_tmpl.search([
-                    ('id', 'in', existing_ids), ('image_1920', '!=', False)
-                ]).ids
-            ) if existing_ids else set()
-        except Exception:
-            has_image_set = set()
-        if track_source_url and existing_ids:
-            try:
-                for row in product_tmpl.search_read(
-                    [('id', 'in', existing_ids), ('x_rs_image_url', '!=', False)],
-                    ['id', 'x_rs_image_url'],
-                ):
-                    existing_image_url_map[row['id']] = (row.get('x_rs_image_url') or '').strip()
-            except Exception:
-                existing_image_url_map = {}
-        image_sync_ctx = {
-            'token': token,
-            'cfg': cfg,
-            'session': self._make_session(),
-            'mode': image_mode,
-            'track_source_url': track_source_url,
-            '_has_image_set': has_image_set,
-            '_existing_image_url_map': existing_image_url_map,
-        }
+        image_sync_ctx = self._build_image_sync_ctx(cfg, cache, image_mode)
         stats = {}
-        error_ctx = self._init_sync_error_ctx()
+        error_ctx = self._init_sync_error_ctx(run_id=run_id)
+        try:
+            priority = self._compute_sync_priority(cache)
+        except Exception as e:
+            _logger.warning("[vnop_sync] Bỏ qua sync ưu tiên (không tính được điểm): %s", e)
+            priority = None
 
         # Lens
         s, f = self._sync_streaming(
             cfg['lens_endpoint'], token, 'lens', cache=cache, error_ctx=error_ctx, limit=limit,
-            image_sync_ctx=image_sync_ctx,
+            image_sync_ctx=image_sync_ctx, progress=progress, priority=priority,
         )
         stats['lens'] = s
         stats['failed'] = f
 
         try:
-            self._sync_lens_stock(token, cfg, cache)
+            self._sync_lens_stock(self._get_access_token(), cfg, cache)
         except Exception:
             pass
 
         # Opt
         s, f = self._sync_streaming(
             cfg['opts_endpoint'], token, 'opt', cache=cache, error_ctx=error_ctx, limit=limit,
-            image_sync_ctx=image_sync_ctx,
+            image_sync_ctx=image_sync_ctx, progress=progress, priority=priority,
         )
         stats['opt'] = s
         stats['failed'] += f
@@ -4151,38 +4408,343 @@ class ProductSync(models.Model):
         # Accessory
         s, f = self._sync_streaming(
             cfg['types_endpoint'], token, 'accessory', cache=cache, error_ctx=error_ctx, limit=limit,
-            image_sync_ctx=image_sync_ctx,
+            image_sync_ctx=image_sync_ctx, progress=progress, priority=priority,
         )
         stats['acc'] = s
         stats['failed'] += f
 
         total = stats['lens'] + stats['opt'] + stats['acc']
         msg = f"Đã đồng bộ {total} (Mắt:{stats['lens']}, Gọng:{stats['opt']}, Khác:{stats['acc']}). Lỗi: {stats['failed']}"
+        self._flush_sync_errors(error_ctx)
+        if priority:
+            msg += f" | Ưu tiên trước: {priority['hot']} (bán chạy/còn tồn), sau: {priority['cold']}"
+        full_log = self._build_sync_log(msg, image_mode, image_sync_ctx, error_ctx, norm_stats_start)
 
-        lines = [msg]
-        image_stats = image_sync_ctx.get('stats') or {}
-        if image_stats:
-            lines.append(
-                "\n── Ảnh sản phẩm ──\n"
-                f"  mode={image_mode} | downloaded={image_stats.get('downloaded', 0)} | "
-                f"fallback={image_stats.get('fallback_downloaded', 0)} | write={image_stats.get('written', 0)} | "
-                f"cache_hit={image_stats.get('cache_hits', 0)} | unchanged_skip={image_stats.get('unchanged_skipped', 0)} | "
-                f"existing_skip={image_stats.get('existing_kept', 0)} | no_url_skip={image_stats.get('no_url_skipped', 0)}"
+        return msg, full_log, stats
+
+    def _get_retry_settings(self):
+        """Cấu hình retry lỗi (.env).
+
+        API_RETRY_FILTER_PARAM: tên query param RS lọc theo CID (vd `cid`). Có cấu
+        hình → mỗi mã gọi 1 request nhỏ; để trống → duyệt page + lọc phía Odoo.
+        API_RETRY_BY_ID_MAX: số mã tối đa còn gọi theo mã (nhiều hơn thì duyệt page rẻ hơn).
+        """
+        try:
+            by_id_max = max(0, int(os.getenv('API_RETRY_BY_ID_MAX', '500')))
+        except (TypeError, ValueError):
+            by_id_max = 500
+        return {
+            'filter_param': (os.getenv('API_RETRY_FILTER_PARAM') or '').strip(),
+            'by_id_max': by_id_max,
+        }
+
+    def _iter_retry_batches(self, endpoint, token, product_type, refs, batch_size, error_ctx=None, matched_refs=None):
+        """Chỉ yield các item có mã nằm trong `refs`, gom thành batch `batch_size`.
+
+        `matched_refs` (set, tuỳ chọn): ghi lại các mã đã tìm thấy trên RS.
+        - Theo mã (API_RETRY_FILTER_PARAM): 1 request page nhỏ cho mỗi mã; RS bỏ qua
+          param thì vẫn lọc lại phía Odoo nên không xử lý nhầm item khác.
+        - Duyệt page: dừng ngay khi đã gặp đủ mọi mã (không phải đọc hết endpoint).
+        """
+        remaining = set(refs)
+        settings = self._get_retry_settings()
+        by_id = bool(settings['filter_param']) and len(remaining) <= settings['by_id_max']
+
+        def _match(items):
+            matched = []
+            for idx, item in enumerate(items):
+                ref = self._acc_item_sku(item, idx)
+                if ref in remaining:
+                    remaining.discard(ref)
+                    matched.append(item)
+                    if matched_refs is not None:
+                        matched_refs.add(ref)
+            return matched
+
+        if by_id:
+            buffer = []
+            for ref in sorted(remaining):
+                if ref not in remaining:
+                    continue
+                for items in self._iter_batches(endpoint, token, 20, limit=20,
+                                                params={settings['filter_param']: ref}):
+                    buffer.extend(_match(items))
+                if len(buffer) >= batch_size:
+                    yield buffer
+                    buffer = []
+            if buffer:
+                yield buffer
+        else:
+            for items in self._iter_batches(endpoint, token, batch_size):
+                matched = _match(items)
+                if matched:
+                    yield matched
+                if not remaining:
+                    return
+        for ref in sorted(remaining):
+            self._record_sync_error(
+                error_ctx, product_type, 'NOT_FOUND', ref=ref,
+                exc=UserError(_('Không tìm thấy mã %s trên RS.') % ref),
             )
-        if error_ctx.get('counts'):
-            counts_sorted = sorted(error_ctx['counts'].items(), key=lambda kv: (-kv[1], kv[0]))
-            lines.append("\n── Tóm tắt lỗi theo loại ──")
-            for k, v in counts_sorted:
-                lines.append(f"  {k}: {v} lỗi")
-        if error_ctx.get('samples'):
-            lines.append(f"\n── Chi tiết lỗi ({len(error_ctx['samples'])} mẫu) ──")
-            lines.extend(error_ctx['samples'])
 
-        full_log = "\n".join(lines)
-        max_chars = error_ctx.get('max_chars', 200000)
-        if len(full_log) > max_chars:
-            full_log = full_log[:max_chars] + "\n...(truncated)"
+    def _do_retry_sync(self, refs_by_type):
+        """Chạy lại đúng các mã bị lỗi ({product_type: [CID]}) qua luồng batch thường."""
+        token = self._get_access_token()
+        cache = self._preload_all_data()
+        cfg = self._get_api_config()
+        run_id = self._start_sync_run()
+        image_mode = self._get_image_sync_mode()
+        image_sync_ctx = self._build_image_sync_ctx(cfg, cache, image_mode)
+        error_ctx = self._init_sync_error_ctx(run_id=run_id, full_detail=True)
+        endpoints = {
+            'lens': cfg['lens_endpoint'],
+            'opt': cfg['opts_endpoint'],
+            'accessory': cfg['types_endpoint'],
+        }
+        batch_size = self._get_sync_batch_size(image_active=image_mode != 'off')
+        progress = SyncProgress(self.id, total=sum(len(v) for v in refs_by_type.values()))
+        stats = {'lens': 0, 'opt': 0, 'acc': 0, 'failed': 0}
+        for product_type, endpoint in endpoints.items():
+            refs = refs_by_type.get(product_type)
+            if not refs:
+                continue
+            progress.set_endpoint_total(product_type, product_type, len(refs))
+            matched_refs = set()
+            handled_refs = set()
+            s, f = self._sync_streaming(
+                endpoint, token, product_type, cache=cache, error_ctx=error_ctx,
+                image_sync_ctx=image_sync_ctx, progress=progress, handled_refs=handled_refs,
+                batches=self._iter_retry_batches(endpoint, token, product_type, refs, batch_size,
+                                                 error_ctx=error_ctx, matched_refs=matched_refs),
+            )
+            # Mọi mã tìm thấy trên RS phải đi qua _process_batch (thành công hoặc lỗi);
+            # mã hụt → ghi lại để lần retry sau vẫn thấy, không được lặng lẽ mất.
+            unprocessed = matched_refs - handled_refs
+            if unprocessed:
+                _logger.error(
+                    "[vnop_sync] Retry %s: %s/%s mã tìm thấy nhưng không được xử lý.",
+                    product_type, len(unprocessed), len(matched_refs),
+                )
+                for ref in sorted(unprocessed):
+                    self._record_sync_error(
+                        error_ctx, product_type, 'UNPROCESSED', ref=ref,
+                        exc=UserError(_('Mã %s không được xử lý khi thử lại.') % ref),
+                    )
+                f += len(unprocessed)
+            stats['acc' if product_type == 'accessory' else product_type] += s
+            stats['failed'] += f + error_ctx['counts'].get(f"{product_type.upper()}:NOT_FOUND", 0)
 
+        total = stats['lens'] + stats['opt'] + stats['acc']
+        msg = f"Thử lại: thành công {total} (Mắt:{stats['lens']}, Gọng:{stats['opt']}, Khác:{stats['acc']}). Lỗi: {stats['failed']}"
+        self._flush_sync_errors(error_ctx)
+        full_log = self._build_sync_log(msg, image_mode, image_sync_ctx, error_ctx)
+        return msg, full_log, stats
+
+    # ------------------------------------------------------------------
+    # Chạy thử (dry-run): prepare như sync thật, so với DB, không ghi gì.
+    # ------------------------------------------------------------------
+    def _dry_run_value(self, field, value):
+        """Chuẩn hoá 1 giá trị (vals hoặc read()) để so sánh theo kiểu field."""
+        ftype = field.type
+        if ftype == 'many2one':
+            if isinstance(value, (list, tuple)):
+                value = value[0] if value else False
+            elif isinstance(value, models.BaseModel):
+                value = value.id
+            return value or False
+        if ftype == 'many2many':
+            ids = set()
+            for cmd in value or []:
+                if isinstance(cmd, int):
+                    ids.add(cmd)
+                elif isinstance(cmd, (list, tuple)) and cmd:
+                    if cmd[0] == 6:
+                        ids = set(cmd[2] or [])
+                    elif cmd[0] == 4:
+                        ids.add(cmd[1])
+                    elif cmd[0] in (3, 2):
+                        ids.discard(cmd[1])
+                    elif cmd[0] == 5:
+                        ids = set()
+            return frozenset(ids)
+        if ftype in ('float', 'monetary'):
+            return round(self._to_float(value, default=0.0), 6)
+        if ftype == 'integer':
+            return int(value or 0)
+        if ftype == 'boolean':
+            return bool(value)
+        return value or False
+
+    @staticmethod
+    def _dry_run_sample_repr(value):
+        if isinstance(value, frozenset):
+            value = sorted(value)
+        text = repr(value)
+        return text if len(text) <= 80 else text[:77] + '...'
+
+    def _dry_run_image_action(self, item, pid, image_sync_ctx):
+        """Sync thật sẽ làm gì với ảnh (không tải ảnh): None | 'new' | 'replace'."""
+        image_url = self._extract_rs_image_url(item)
+        if not image_url:
+            return None
+        image_full_url = self._build_rs_image_full_url(image_url, image_sync_ctx['cfg'])
+        if not image_full_url:
+            return None
+        mode = image_sync_ctx['mode']
+        has_image = bool(pid) and pid in image_sync_ctx['_has_image_set']
+        if not has_image:
+            return 'new'
+        if mode == 'missing' or self._is_rs_default_image_url(image_url):
+            return None
+        if mode == 'changed' and image_sync_ctx['_existing_image_url_map'].get(pid) == image_full_url:
+            return None
+        return 'replace'
+
+    def _dry_run_prepare(self, item, idx, cache, product_type):
+        """(ref, pid, vals) qua đúng hàm prepare của sync thật."""
+        if product_type == 'lens':
+            coating_ids, coating_codes = self._resolve_lens_coatings(item, cache)
+            template_key = self._build_lens_template_key(item, coating_codes)
+            vals, _pid = self._prepare_base_vals(
+                item, cache, 'lens', coating_ids=coating_ids, lens_template_key=template_key,
+            )
+            pid = cache.get('lens_templates', {}).get(template_key)
+        elif product_type == 'accessory':
+            vals, pid = self._prepare_accessory_vals(item, cache, self._acc_item_sku(item, idx))
+        else:
+            vals, pid = self._prepare_base_vals(item, cache, product_type)
+        return vals.get('barcode') or self._acc_item_sku(item, idx), pid, vals
+
+    def _dry_run_page(self, items, cache, product_type, image_sync_ctx, report):
+        """Prepare 1 page, đọc giá trị hiện tại của các product liên quan bằng 1 lần
+        search_read, cộng dồn khác biệt theo field vào `report`."""
+        Template = self.env['product.template'].with_context(active_test=False)
+        tmpl_fields = Template._fields
+        rep = report['types'].setdefault(product_type, {
+            'create': 0, 'update': 0, 'unchanged': 0, 'error': 0,
+            'image_new': 0, 'image_replace': 0,
+            'fields': defaultdict(int), 'samples': defaultdict(list), 'errors': [],
+        })
+        rows = []
+        for idx, item in enumerate(items):
+            try:
+                # Savepoint: lệnh ghi sót lại bị READ ONLY chặn chỉ làm lỗi item này.
+                with self.env.cr.savepoint(flush=False):
+                    ref, pid, vals = self._dry_run_prepare(item, idx, cache, product_type)
+            except Exception as e:
+                rep['error'] += 1
+                if len(rep['errors']) < report['sample_limit']:
+                    original = getattr(e, 'original', e)
+                    rep['errors'].append(f"{self._acc_item_sku(item, idx)}: {str(original)[:200]}")
+                continue
+            rows.append((ref, pid, vals))
+            image_action = self._dry_run_image_action(item, pid, image_sync_ctx)
+            if image_action:
+                rep['image_' + image_action] += 1
+
+        pids = list({pid for _ref, pid, _vals in rows if pid})
+        names = sorted({
+            name for _ref, pid, vals in rows if pid for name in vals
+            if name in tmpl_fields and tmpl_fields[name].type not in ('one2many', 'binary')
+        })
+        current = {
+            r['id']: r for r in Template.search_read([('id', 'in', pids)], names)
+        } if pids and names else {}
+
+        for ref, pid, vals in rows:
+            row = current.get(pid) if pid else None
+            if row is None:
+                rep['create'] += 1
+                continue
+            changed = False
+            for name, new_value in vals.items():
+                if name not in row:
+                    continue
+                field = tmpl_fields[name]
+                old = self._dry_run_value(field, row[name])
+                new = self._dry_run_value(field, new_value)
+                if old == new:
+                    continue
+                changed = True
+                rep['fields'][name] += 1
+                samples = rep['samples'][name]
+                if len(samples) < report['sample_limit']:
+                    samples.append(
+                        f"{ref}: {self._dry_run_sample_repr(old)} → {self._dry_run_sample_repr(new)}"
+                    )
+            rep['update' if changed else 'unchanged'] += 1
+
+    def _format_dry_run_report(self, report):
+        labels = {'lens': 'Mắt', 'opt': 'Gọng', 'accessory': 'Phụ kiện'}
+        lines = []
+        for product_type, rep in report['types'].items():
+            lines.append(
+                f"\n── {labels.get(product_type, product_type)} ──\n"
+                f"  tạo mới={rep['create']} | cập nhật={rep['update']} | không đổi={rep['unchanged']} | "
+                f"lỗi prepare={rep['error']} | ảnh mới={rep['image_new']} | thay ảnh={rep['image_replace']}"
+            )
+            for name, count in sorted(rep['fields'].items(), key=lambda kv: (-kv[1], kv[0])):
+                lines.append(f"  {name}: {count}")
+                lines.extend(f"      {sample}" for sample in rep['samples'][name])
+            if rep['errors']:
+                lines.append("  Lỗi prepare (mẫu):")
+                lines.extend(f"      {err}" for err in rep['errors'])
+        new_masters = defaultdict(list)
+        for model_name, name in sorted(report.get('new_masters') or ()):
+            new_masters[model_name].append(name)
+        if new_masters:
+            lines.append("\n── Master data sẽ tạo ──")
+            for model_name, names in new_masters.items():
+                shown = ', '.join(names[:report['sample_limit']])
+                more = f" (+{len(names) - report['sample_limit']})" if len(names) > report['sample_limit'] else ''
+                lines.append(f"  {model_name}: {len(names)} — {shown}{more}")
+        return lines
+
+    def _do_sync_dry_run(self, limit=None):
+        """Chạy thử sync: stream page RS → prepare như thật → diff với DB theo từng page.
+
+        Không ghi gì: master data còn thiếu (màu, chất liệu...) chỉ được liệt kê
+        (`_dry_run_skip_create`), mỗi page chạy trên 1 cursor READ ONLY riêng nên
+        không giữ lock hay transaction dài. Không tải ảnh — thay đổi ảnh suy ra từ
+        URL + cờ x_has_image.
+        """
+        token = self._get_access_token()
+        cache = self._preload_all_data()
+        cfg = self._get_api_config()
+        image_sync_ctx = self._build_image_sync_ctx(cfg, cache, self._get_image_sync_mode(limit=limit))
+        try:
+            sample_limit = max(0, int(os.getenv('SYNC_DRY_RUN_SAMPLES', '5')))
+        except (TypeError, ValueError):
+            sample_limit = 5
+        report = {'types': {}, 'sample_limit': sample_limit}
+        endpoints = (
+            ('lens', cfg['lens_endpoint']),
+            ('opt', cfg['opts_endpoint']),
+            ('accessory', cfg['types_endpoint']),
+        )
+        batch_size = self._get_sync_batch_size()
+        db = self.env.cr.dbname
+        for product_type, endpoint in endpoints:
+            for batch_idx, items in enumerate(self._iter_batches(endpoint, token, batch_size, limit), start=1):
+                if self._is_cancel_requested():
+                    raise _SyncCancelledError(f"Dry-run cancelled at {product_type} batch {batch_idx}")
+                with Registry(db).cursor() as cr:
+                    cr.execute('SET TRANSACTION READ ONLY')
+                    dry = self.with_env(self.env(cr=cr)).with_context(
+                        vnop_sync_dry_run=True, tracking_disable=True)
+                    dry._dry_run_page(items, cache, product_type, image_sync_ctx, report)
+                    cr.rollback()
+        report['new_masters'] = cache.get('_dry_run_new_masters') or set()
+
+        types = report['types'].values()
+        stats = {'lens': 0, 'opt': 0, 'acc': 0, 'failed': sum(rep['error'] for rep in types)}
+        msg = (
+            f"Chạy thử: sẽ tạo {sum(rep['create'] for rep in types)}, "
+            f"cập nhật {sum(rep['update'] for rep in types)}, "
+            f"không đổi {sum(rep['unchanged'] for rep in types)}, "
+            f"lỗi prepare {stats['failed']} (không ghi dữ liệu)"
+        )
+        full_log = "\n".join([msg] + self._format_dry_run_report(report))
         return msg, full_log, stats
 
     def test_api_connection(self):
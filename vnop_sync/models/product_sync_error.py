@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Lỗi đồng bộ theo từng item (thay cho chuỗi sample dồn trong sync_log).
+
+- Worker gom lỗi vào `error_ctx['pending']`, ghi 1 lần (create list) cùng
+  commit của mỗi batch → không phát sinh transaction riêng.
+- Index (sync_id, run_id, product_type, stage) cho group by / đếm theo lần chạy.
+- Autovacuum giữ bảng có giới hạn: bỏ lỗi quá SYNC_ERROR_RETENTION_DAYS ngày
+  và chỉ giữ SYNC_ERROR_KEEP_RUNS lần chạy gần nhất của mỗi product.sync.
+"""
+import logging
+import os
+from collections import defaultdict
+from datetime import timedelta
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+from odoo.tools.sql import create_index, index_exists
+
+_logger = logging.getLogger(__name__)
+
+MESSAGE_MAX_CHARS = 1000
+
+# Ref không phải mã item RS (không retry được theo ref).
+_NON_ITEM_REF_PREFIXES = ('idx_', 'chunk=', 'tmpl_id=')
+
+
+def _env_int(name, default, minimum=0):
+    try:
+        return max(minimum, int(os.getenv(name, default)))
+    except (TypeError, ValueError):
+        return int(default)
+
+
+class ProductSyncError(models.Model):
+    _name = 'product.sync.error'
+    _description = 'Lỗi đồng bộ sản phẩm'
+    _order = 'id desc'
+    _rec_name = 'ref'
+
+    sync_id = fields.Many2one(
+        'product.sync', string='Cấu hình đồng bộ', required=True,
+        ondelete='cascade', index=True, readonly=True,
+    )
+    run_id = fields.Char('Lần chạy', required=True, readonly=True)
+    product_type = fields.Char('Loại sản phẩm', readonly=True)
+    stage = fields.Char('Bước', readonly=True)
+    ref = fields.Char('Mã tham chiếu', index=True, readonly=True)
+    product_tmpl_id = fields.Many2one(
+        'product.template', string='Sản phẩm', ondelete='set null', readonly=True,
+    )
+    message = fields.Text('Lỗi', readonly=True)
+
+    def init(self):
+        # Group by / đếm lỗi theo lần chạy (sync_id, run_id, product_type, stage)
+        # + autovacuum theo create_date.
+        if not index_exists(self._cr, 'product_sync_error_run_group_index'):
+            create_index(
+                self._cr, 'product_sync_error_run_group_index', self._table,
+                ['sync_id', 'run_id', 'product_type', 'stage'],
+            )
+        if not index_exists(self._cr, 'product_sync_error_create_date_index'):
+            create_index(
+                self._cr, 'product_sync_error_create_date_index', self._table, ['create_date'],
+            )
+
+    @api.model
+    def _prepare_row(self, sync_id, run_id, product_type, stage, ref, message, product_tmpl_id=None):
+        return {
+            'sync_id': sync_id,
+            'run_id': run_id,
+            'product_type': product_type or 'unknown',
+            'stage': stage,
+            'ref': (str(ref) if ref is not None else 'N/A')[:255],
+            'product_tmpl_id': product_tmpl_id or False,
+            'message': (message or 'Unknown error')[:MESSAGE_MAX_CHARS],
+        }
+
+    @api.model
+    def _flush_pending(self, error_ctx):
+        """Ghi toàn bộ lỗi đang chờ trong `error_ctx` bằng 1 lệnh create (theo lô)."""
+        if not error_ctx or not error_ctx.get('pending'):
+            return 0
+        rows = error_ctx['pending']
+        error_ctx['pending'] = []
+        self.sudo().create(rows)
+        return len(rows)
+
+    def _retry_refs_by_type(self):
+        """{product_type: [ref]} — mã item RS (CID/barcode) retry được từ các lỗi này."""
+        refs_by_type = defaultdict(set)
+        for err in self:
+            ref = (err.product_tmpl_id.barcode if err.product_tmpl_id else '') or (err.ref or '')
+            ref = ref.strip()
+            if not ref or ref == 'N/A' or ref.startswith(_NON_ITEM_REF_PREFIXES):
+                continue
+            refs_by_type[err.product_type].add(ref)
+        return {ptype: sorted(refs) for ptype, refs in refs_by_type.items()}
+
+    def action_retry_failed(self):
+        """Enqueue job chỉ xử lý lại các item lỗi đã chọn qua đúng luồng batch thường."""
+        if not self:
+            raise UserError(_('Chọn ít nhất 1 dòng lỗi để thử lại.'))
+        result = None
+        for sync in self.sync_id:
+            refs_by_type = self.filtered(lambda e: e.sync_id == sync)._retry_refs_by_type()
+            if not refs_by_type:
+                continue
+            result = sync._enqueue_sync_job('retry', refs=refs_by_type)
+        if result is None:
+            raise UserError(_('Các lỗi đã chọn không có mã sản phẩm RS để thử lại (lỗi cả batch hoặc thiếu CID).'))
+        return result
+
+    @api.autovacuum
+    def _gc_sync_errors(self):
+        """Giữ bảng lỗi có giới hạn: theo tuổi + số lần chạy gần nhất mỗi product.sync."""
+        retention_days = _env_int('SYNC_ERROR_RETENTION_DAYS', '30', minimum=1)
+        keep_runs = _env_int('SYNC_ERROR_KEEP_RUNS', '5', minimum=1)
+        cr = self.env.cr
+        cr.execute(
+            f"DELETE FROM {self._table} WHERE create_date < %s",
+            (fields.Datetime.now() - timedelta(days=retention_days),),
+        )
+        expired = cr.rowcount
+        cr.execute(f"""
+            DELETE FROM {self._table} e
+            USING (
+                SELECT sync_id, run_id
+                FROM (
+                    SELECT sync_id, run_id,
+                           row_number() OVER (PARTITION BY sync_id ORDER BY max(id) DESC) AS rn
+                    FROM {self._table}
+                    GROUP BY sync_id, run_id
+                ) runs
+                WHERE rn > %s
+            ) old
+            WHERE e.sync_id = old.sync_id AND e.run_id = old.run_id
+        """, (keep_runs,))
+        old_runs = cr.rowcount
+        if expired or old_runs:
+            _logger.info(
+                "vnop_sync: autovacuum xoá %s lỗi quá %s ngày, %s lỗi của các lần chạy cũ (giữ %s lần).",
+                expired, retention_days, old_runs, keep_runs,
+            )
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""Đẩy ngược tồn kho / giá từ Odoo về RS (outbox + queue_job).
+
+- Ghi nhận: override nhẹ trên stock.quant (quantity, kho nội bộ) và
+  product.template (list_price, x_ws_price) → upsert 1 dòng `pending` cho mỗi
+  (sản phẩm, loại) ngay trong transaction nghiệp vụ. Nhiều thay đổi liên tiếp
+  gộp vào cùng 1 dòng (partial unique index + ON CONFLICT), không gọi HTTP.
+- Đẩy: cron enqueue 1 queue.job (identity key → không chạy trùng), job lấy
+  các dòng theo thứ tự ghi nhận, dựng payload từ giá trị HIỆN TẠI, gửi theo lô
+  qua `server.connector._call_api`. Mỗi item có idempotency key (hash nội dung)
+  để RS bỏ qua bản gửi lặp khi retry.
+- Lỗi: backoff luỹ thừa theo `attempts`, quá RS_OUTBOX_MAX_ATTEMPTS → failed.
+- Ghi từ chính luồng sync RS → Odoo (context `vnop_sync_inbound`) không bị đẩy ngược.
+
+Thử với server giả lập: trỏ SPRINGBOOT_API_URL (server.connector) về 1 HTTP
+server local nhận POST RS_OUTBOX_STOCK_ENDPOINT / RS_OUTBOX_PRICE_ENDPOINT.
+
+    RS_OUTBOX_ENABLED         bật ghi nhận + đẩy, mặc định False
+    RS_OUTBOX_BATCH_SIZE      số item mỗi request, mặc định 200
+    RS_OUTBOX_MAX_ATTEMPTS    số lần thử tối đa mỗi dòng, mặc định 10
+"""
+import hashlib
+import json
+import logging
+import os
+from datetime import timedelta
+
+from odoo import _, api, fields, models
+from odoo.tools.sql import index_exists
+
+_logger = logging.getLogger(__name__)
+
+OUTBOX_KINDS = [('stock', 'Tồn kho'), ('price', 'Giá')]
+PRICE_FIELDS = ('list_price', 'x_ws_price')
+# Dòng 'sending' lâu hơn ngưỡng này coi như worker đã chết giữa chừng.
+STALE_SENDING_MINUTES = 30
+
+
+def outbox_enabled():
+    return os.getenv('RS_OUTBOX_ENABLED', 'False').lower() == 'true'
+
+
+def _env_int(name, default, minimum=1):
+    try:
+        return max(minimum, int(os.getenv(name, default)))
+    except (TypeError, ValueError):
+        return int(default)
+
+
+class ProductSyncOutbox(models.Model):
+    _name = 'product.sync.outbox'
+    _description = 'Hàng đợi đẩy tồn kho / giá về RS'
+    _order = 'id'
+
+    product_tmpl_id = fields.Many2one(
+        'product.template', string='Sản phẩm', required=True, ondelete='cascade', readonly=True,
+    )
+    kind = fields.Selection(OUTBOX_KINDS, string='Loại', required=True, readonly=True)
+    state = fields.Selection([
+        ('pending', 'Chờ gửi'),
+        ('sending', 'Đang gửi'),
+        ('sent', 'Đã gửi'),
+        ('failed', 'Lỗi'),
+    ], string='Trạng thái', required=True, default='pending', index=True, readonly=True)
+    changed_at = fields.Datetime('Thay đổi lúc', readonly=True)
+    sent_at = fields.Datetime('Gửi lúc', readonly=True)
+    attempts = fields.Integer('Số lần thử', readonly=True)
+    next_attempt_at = fields.Datetime('Thử lại lúc', readonly=True)
+    idempotency_key = fields.Char('Idempotency key', readonly=True)
+    payload = fields.Text('Payload đã gửi', readonly=True)
+    last_error = fields.Text('Lỗi gần nhất', readonly=True)
+
+    def init(self):
+        # 1 dòng pending cho mỗi (sản phẩm, loại) → ON CONFLICT gộp thay đổi.
+        if not index_exists(self._cr, 'product_sync_outbox_pending_uniq'):
+            self._cr.execute(
+                f"CREATE UNIQUE INDEX product_sync_outbox_pending_uniq "
+                f"ON {self._table} (product_tmpl_id, kind) WHERE state = 'pending'"
+            )
+
+    # ------------------------------------------------------------------
+    # Ghi nhận
+    # ------------------------------------------------------------------
+    @api.model
+    def _capture(self, tmpl_ids, kind):
+        """Upsert dòng pending cho các template (gộp với dòng pending đang có)."""
+        tmpl_ids = sorted({tid for tid in tmpl_ids if tid})
+        if not tmpl_ids or self.env.context.get('vnop_sync_inbound') or not outbox_enabled():
+            return
+        self.env.cr.execute(f"""
+            INSERT INTO {self._table}
+                (product_tmpl_id, kind, state, attempts, changed_at,
+                 create_uid, create_date, write_uid, write_date)
+            SELECT tmpl_id, %(kind)s, 'pending', 0, %(now)s, %(uid)s, %(now)s, %(uid)s, %(now)s
+            FROM unnest(%(ids)s::int[]) AS tmpl_id
+            ON CONFLICT (product_tmpl_id, kind) WHERE state = 'pending'
+            DO UPDATE SET changed_at = EXCLUDED.changed_at, write_date = EXCLUDED.write_date
+        """, {'kind': kind, 'now': fields.Datetime.now(), 'uid': self.env.uid, 'ids': tmpl_ids})
+
+    # ------------------------------------------------------------------
+    # Đẩy
+    # ------------------------------------------------------------------
+    @api.model
+    def _cron_push(self):
+        """Cron: enqueue job đẩy nếu còn backlog (identity key → tối đa 1 job chờ)."""
+        if not outbox_enabled():
+            return
+        self._reset_stale_sending()
+        if not self.search_count(self._due_domain(), limit=1):
+            return
+        from odoo.addons.queue_job.job import identity_exact
+        self.with_delay(
+            description=_('vnop_sync: Đẩy tồn kho / giá về RS'), identity_key=identity_exact,
+        )._push_pending()
+
+    @api.model
+    def _due_domain(self):
+        now = fields.Datetime.now()
+        return [
+            ('state', '=', 'pending'),
+            '|', ('next_attempt_at', '=', False), ('next_attempt_at', '<=', now),
+        ]
+
+    @api.model
+    def _reset_stale_sending(self):
+        cutoff = fields.Datetime.now() - timedelta(minutes=STALE_SENDING_MINUTES)
+        stale = self.search([('state', '=', 'sending'), ('write_date', '<', cutoff)])
+        if not stale:
+            return
+        # Đã có dòng pending mới cho cùng sản phẩm → dòng cũ thừa (payload dựng lại lúc gửi).
+        pending_keys = {
+            (r.product_tmpl_id.id, r.kind)
+            for r in self.search([('state', '=', 'pending'), ('product_tmpl_id', 'in', stale.product_tmpl_id.ids)])
+        }
+        duplicate = stale.filtered(lambda r: (r.product_tmpl_id.id, r.kind) in pending_keys)
+        duplicate.unlink()
+        (stale - duplicate).write({'state': 'pending'})
+
+    @api.model
+    def _push_pending(self):
+        """Job: gửi lần lượt các lô tới khi hết dòng đến hạn. Mỗi lô commit riêng."""
+        batch_size = _env_int('RS_OUTBOX_BATCH_SIZE', '200')
+        connector = self.env['server.connector'].get_default_connector()
+        pushed = 0
+        while True:
+            batch = self.search(self._due_domain(), order='id', limit=batch_size)
+            if not batch:
+                break
+            batch.write({'state': 'sending'})
+            self.env.cr.commit()  # claim: capture mới tạo dòng pending riêng, không chờ lock
+            for kind, _label in OUTBOX_KINDS:
+                rows = batch.filtered(lambda r: r.kind == kind)
+                if rows:
+                    pushed += rows._push_rows(connector, kind)
+            self.env.cr.commit()
+        return pushed
+
+    def _build_items(self, kind):
+        """{outbox_id: item} với giá trị hiện tại; dòng không có barcode bị bỏ qua."""
+        templates = self.product_tmpl_id.with_context(active_test=False)
+        qty_by_tmpl = {}
+        if kind == 'stock':
+            for product, quantity in self.env['stock.quant']._read_group(
+                [('product_id.product_tmpl_id', 'in', templates.ids), ('location_id.usage', '=', 'internal')],
+                ['product_id'], ['quantity:sum'],
+            ):
+                tmpl_id = product.product_tmpl_id.id
+                qty_by_tmpl[tmpl_id] = qty_by_tmpl.get(tmpl_id, 0.0) + (quantity or 0.0)
+        items = {}
+        for row in self:
+            tmpl = row.product_tmpl_id
+            if not tmpl.barcode:
+                continue
+            item = {'barcode': tmpl.barcode, 'default_code': tmpl.default_code or ''}
+            if kind == 'stock':
+                item['qty'] = qty_by_tmpl.get(tmpl.id, 0.0)
+            else:
+                item['list_price'] = tmpl.list_price
+                item['ws_price'] = tmpl.x_ws_price if 'x_ws_price' in tmpl._fields else 0.0
+            digest = json.dumps([kind, item], sort_keys=True, default=str)
+            item['idempotency_key'] = hashlib.sha1(digest.encode('utf-8')).hexdigest()
+            items[row.id] = item
+        return items
+
+    def _push_rows(self, connector, kind):
+        endpoint = (
+            os.getenv('RS_OUTBOX_STOCK_ENDPOINT', '/api/xnk/odoo/stock') if kind == 'stock'
+            else os.getenv('RS_OUTBOX_PRICE_ENDPOINT', '/api/xnk/odoo/prices')
+        )
+        items = self._build_items(kind)
+        no_barcode = self.filtered(lambda r: r.id not in items)
+        no_barcode.write({'state': 'failed', 'last_error': 'Sản phẩm không có barcode (mã RS).'})
+        rows = self - no_barcode
+        if not rows:
+            return 0
+        now = fields.Datetime.now()
+        try:
+            connector._call_api(endpoint, method='POST', data={
+                'source': 'odoo',
+                'db': self.env.cr.dbname,
+                'items': [items[row.id] for row in rows],
+            })
+        except Exception as e:
+            max_attempts = _env_int('RS_OUTBOX_MAX_ATTEMPTS', '10')
+            # Trong lúc gửi, thay đổi mới đã tạo dòng pending cho cùng sản phẩm → không
+            # đưa dòng lỗi về pending (vi phạm pending_uniq) mà gộp backoff vào dòng đó.
+            pending_by_key = {
+                (r.product_tmpl_id.id, r.kind): r
+                for r in self.search([('state', '=', 'pending'), ('product_tmpl_id', 'in', rows.product_tmpl_id.ids)])
+            }
+            merged = self.browse()
+            for row in rows:
+                attempts = row.attempts + 1
+                if attempts >= max_attempts:
+                    row.write({'state': 'failed', 'attempts': attempts, 'last_error': str(e)[:2000]})
+                    continue
+                # Backoff luỹ thừa: 1, 2, 4... phút, tối đa 1 giờ.
+                retry_vals = {
+                    'attempts': attempts,
+                    'next_attempt_at': now + timedelta(minutes=min(60, 2 ** (attempts - 1))),
+                    'last_error': str(e)[:2000],
+                }
+                pending = pending_by_key.get((row.product_tmpl_id.id, row.kind))
+                if pending:
+                    if attempts > pending.attempts:
+                        pending.write(retry_vals)
+                    merged |= row
+                    continue
+                row.write(dict(retry_vals, state='pending'))
+            merged.unlink()
+            _logger.warning("vnop_sync outbox: đẩy %s %s dòng thất bại: %s", kind, len(rows), e)
+            return 0
+        for row in rows:
+            item = items[row.id]
+            row.write({
+                'state': 'sent',
+                'sent_at': now,
+                'idempotency_key': item['idempotency_key'],
+                'payload': json.dumps(item, ensure_ascii=False, default=str),
+                'last_error': False,
+            })
+        return len(rows)
+
+    def action_retry(self):
+        """Đưa dòng lỗi về hàng đợi (bỏ qua nếu sản phẩm đã có dòng pending mới)."""
+        failed = self.filtered(lambda r: r.state == 'failed')
+        pending_keys = {
+            (r.product_tmpl_id.id, r.kind)
+            for r in self.search([('state', '=', 'pending'), ('product_tmpl_id', 'in', failed.product_tmpl_id.ids)])
+        }
+        retry = failed.filtered(lambda r: (r.product_tmpl_id.id, r.kind) not in pending_keys)
+        seen = set()
+        for row in retry:
+            key = (row.product_tmpl_id.id, row.kind)
+            if key in seen:
+                continue
+            seen.add(key)
+            row.write({'state': 'pending', 'attempts': 0, 'next_attempt_at': False})
+        return True
+
+    @api.model
+    def _backlog(self):
+        """Gauge backlog: số dòng chờ / lỗi và độ trễ (phút) của thay đổi cũ nhất chưa gửi."""
+        pending = self.search([('state', 'in', ('pending', 'sending'))], order='changed_at', limit=1)
+        lag = 0
+        if pending and pending.changed_at:
+            lag = int((fields.Datetime.now() - pending.changed_at).total_seconds() // 60)
+        return {
+            'pending': self.search_count([('state', 'in', ('pending', 'sending'))]),
+            'failed': self.search_count([('state', '=', 'failed')]),
+            'lag_minutes': lag,
+        }
+
+    @api.autovacuum
+    def _gc_sent(self):
+        """Dòng đã gửi chỉ để tra cứu → giữ RS_OUTBOX_KEEP_DAYS ngày (mặc định 7)."""
+        cutoff = fields.Datetime.now() - timedelta(days=_env_int('RS_OUTBOX_KEEP_DAYS', '7'))
+        self.search([('state', '=', 'sent'), ('sent_at', '<', cutoff)]).unlink()
+
+
+class ProductTemplate(models.Model):
+    _inherit = 'product.template'
+
+    def write(self, vals):
+        res = super().write(vals)
+        if any(name in vals for name in PRICE_FIELDS):
+            self.env['product.sync.outbox']._capture(self.ids, 'price')
+        return res
+
+
+class StockQuant(models.Model):
+    _inherit = 'stock.quant'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        quants = super().create(vals_list)
+        quants._capture_rs_outbox()
+        return quants
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'quantity' in vals:
+            self._capture_rs_outbox()
+        return res
+
+    def _capture_rs_outbox(self):
+        if self.env.context.get('vnop_sync_inbound') or not outbox_enabled():
+            return
+        self.env['product.sync.outbox']._capture(
+            {q.product_id.product_tmpl_id.id for q in self if q.location_id.usage == 'internal'},
+            'stock',
+        )
@@ -33,6 +33,24 @@ class ProductTemplateExtension(models.Model):
     ], string='Loại tròng')
 
     x_java_qr_url = fields.Char(string='QR URL (Java)', copy=False)
+
+    # ==================== ẢNH SYNC TỪ RS ====================
+    x_rs_image_url = fields.Char('URL ảnh RS', copy=False,
+                                 help='URL ảnh RS đã tải về image_1920 ở lần sync gần nhất')
+    x_rs_image_synced_at = fields.Datetime('Thời điểm sync ảnh', copy=False)
+    # sha1 của bytes ảnh đã ghi (trùng checksum filestore) → sync bỏ qua ghi lại ảnh cùng nội dung
+    x_rs_image_checksum = fields.Char('Checksum ảnh RS', copy=False)
+    # Cờ có ảnh lưu DB + index: sync lọc product đã có ảnh bằng 1 index scan,
+    # không phải join ir_attachment trên image_1920.
+    x_has_image = fields.Boolean(
+        'Có ảnh', compute='_compute_x_has_image', store=True, index=True, copy=False,
+    )
+
+    @api.depends('image_1920')
+    def _compute_x_has_image(self):
+        # bin_size: chỉ đọc kích thước attachment, không load nội dung ảnh
+        for rec in self.with_context(bin_size=True):
+            rec.x_has_image = bool(rec.image_1920)
     qr_code = fields.Binary(string='QR Code', compute='_compute_qr_code', store=False)
 
     @api.depends('x_java_qr_url')
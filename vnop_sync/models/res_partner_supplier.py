@@ -1,7 +1,7 @@
-import re
-import unicodedata
 from odoo import api, fields, models
 
+from .text_norm import compact_key
+
 # -*- coding: utf-8 -*-
 
 
@@ -21,15 +21,7 @@ class ResPartnerBank(models.Model):
     # Đã bỏ x_bank_country, dùng trực tiếp bank_id.country (Odoo base)
 
     def _normalize_bank_token(self, value):
-        if value in (None, False):
-            return ''
-        raw = str(value).strip().lower()
-        if not raw:
-            return ''
-        normalized = unicodedata.normalize('NFKD', raw)
-        normalized = ''.join(ch for ch in normalized if not unicodedata.combining(ch))
-        normalized = re.sub(r'[^a-z0-9]+', '', normalized)
-        return normalized
+        return compact_key(value)
 
     def _is_invalid_bank_token(self, value):
         normalized = self._normalize_bank_token(value)
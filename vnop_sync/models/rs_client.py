@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""HTTP client dùng chung cho mọi lời gọi RS (Spring Boot) trong 1 worker process.
+
+- Connection pool keep-alive dùng chung giữa các thread → ít TLS handshake.
+- Token bucket giới hạn số request/giây theo từng host → tải upstream ổn định.
+- Retry + exponential backoff có jitter cho lỗi mạng / 429 / 5xx tạm thời.
+
+Cấu hình qua biến môi trường (.env):
+    RS_RATE_LIMIT_PER_SEC   số request/giây cho mỗi host, mặc định 0 (không giới hạn)
+    RS_RATE_LIMIT_BURST     số request được phép bắn dồn, mặc định = 2 × rate
+    RS_HTTP_POOL_SIZE       số connection keep-alive tối đa mỗi host, mặc định 64
+    RS_HTTP_MAX_RETRIES     số lần retry mặc định, mặc định 5
+    RS_HTTP_BACKOFF_BASE    hệ số backoff (giây), mặc định 1
+    RS_HTTP_BACKOFF_MAX     backoff tối đa (giây), mặc định 60
+"""
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_logger = logging.getLogger(__name__)
+
+# Status HTTP tạm thời → retry được (không bao gồm 401/403: caller tự refresh token).
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+
+def _env_number(name, default, cast=int, minimum=None):
+    try:
+        value = cast(os.getenv(name, default))
+    except (TypeError, ValueError):
+        value = cast(default)
+    if minimum is not None:
+        value = max(minimum, value)
+    return value
+
+
+class TokenBucket:
+    """Token bucket thread-safe: `rate` token/giây, tối đa `capacity` token."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1.0):
+        """Chờ tới khi đủ token; trả về số giây đã phải chờ."""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class RsClient:
+    """Client HTTP dùng chung cho RS.
+
+    Mỗi thread có `requests.Session` riêng (Session không thread-safe) nhưng
+    tất cả mount CÙNG một `HTTPAdapter` → dùng chung connection pool của urllib3
+    (PoolManager thread-safe), nên keep-alive được tái sử dụng giữa các thread.
+    """
+
+    def __init__(self, ssl_verify=False):
+        self.ssl_verify = ssl_verify
+        pool_size = _env_number('RS_HTTP_POOL_SIZE', '64', minimum=1)
+        self.max_retries = _env_number('RS_HTTP_MAX_RETRIES', '5', minimum=0)
+        self.backoff_base = _env_number('RS_HTTP_BACKOFF_BASE', '1', cast=float, minimum=0.0)
+        self.backoff_max = _env_number('RS_HTTP_BACKOFF_MAX', '60', cast=float, minimum=0.0)
+        self.rate = _env_number('RS_RATE_LIMIT_PER_SEC', '0', cast=float, minimum=0.0)
+        self.burst = _env_number('RS_RATE_LIMIT_BURST', str(max(1.0, self.rate * 2)), cast=float, minimum=1.0)
+        self._adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self._local = threading.local()
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', self._adapter)
+            session.mount('http://', self._adapter)
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+            self._local.session = session
+        return session
+
+    def _bucket(self, url):
+        host = urlsplit(url).netloc.lower()
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            with self._buckets_lock:
+                bucket = self._buckets.setdefault(host, TokenBucket(self.rate, self.burst))
+        return bucket
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        wait = self.backoff_base * (2 ** attempt) + random.uniform(0, 2 * self.backoff_base)
+        return min(wait, self.backoff_max)
+
+    @staticmethod
+    def _retry_after(response):
+        raw = (response.headers.get('Retry-After') or '').strip()
+        try:
+            return max(0.0, float(raw)) if raw else None
+        except ValueError:
+            return None
+
+    def request(self, method, url, max_retries=None, **kwargs):
+        """Gửi request qua rate limiter, retry lỗi mạng / status tạm thời.
+
+        Hết số lần retry: lỗi mạng được raise lại nguyên bản, còn response
+        status tạm thời được trả về để caller tự `raise_for_status()`.
+        """
+        retries = self.max_retries if max_retries is None else max(0, int(max_retries))
+        kwargs.setdefault('verify', self.ssl_verify)
+        bucket = self._bucket(url)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            retry_after = None
+            try:
+                response = self._session().request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= retries:
+                    raise
+                _logger.debug("RS %s %s lỗi mạng (lần %s/%s): %s", method, url, attempt + 1, retries, e)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                    return response
+                retry_after = self._retry_after(response)
+                response.close()
+            attempt += 1
+            time.sleep(self._backoff(attempt, retry_after))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_rs_client(ssl_verify=False):
+    """Trả về RsClient dùng chung của process hiện tại.
+
+    Key theo pid để worker prefork không dùng lại pool (socket) của process cha.
+    """
+    key = (os.getpid(), bool(ssl_verify))
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = RsClient(ssl_verify=bool(ssl_verify))
+    return client
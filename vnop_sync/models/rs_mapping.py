@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+"""Mapping khai báo RS DTO → vals product.template.
+
+Mỗi `FieldSpec` mô tả 1 field Odoo:
+    - paths   : alias path theo thứ tự ưu tiên, gốc `item.` (record RS) hoặc
+                `dto.` (productdto), lồng nhau bằng dấu chấm: `dto.currencyZoneDTO.cid`.
+    - pick    : cách chọn giá trị giữa các alias
+                'get'     → dict.get(key, default) (chỉ 1 path)
+                'or'      → giá trị truthy đầu tiên (giống chuỗi `a or b or ...`)
+                'present' → giá trị đầu tiên khác None/'' (giữ được 0 / 0.00)
+    - convert : hàm chuyển đổi, hoặc tên converter bind lúc compile (vd 'sph').
+    - lookup  : tên master lookup (get-or-create) bind lúc compile với cache sync.
+    - empty   : nếu kết quả falsy thì thay bằng giá trị này (`x or None`, `x or False`).
+
+`compile_spec` biến danh sách spec thành tuple (field, accessor) phẳng — chỉ
+chạy 1 lần mỗi lần sync; vòng lặp item chỉ còn gọi accessor, không dựng lại
+closure hay duyệt lại cấu hình. Thêm field mới = thêm 1 dòng FieldSpec.
+"""
+from functools import lru_cache
+
+from .text_norm import CACHE_SIZE, fold_vn
+
+_MISSING = object()
+
+RS_GENDER_MAP = {'0': 'M', '1': 'F', '2': 'U'}
+
+
+# ─── Converters (thuần Python, không đụng ORM) ──────────────────────────────
+def parse_float(val, default=0.0):
+    """Float an toàn cho payload API (hay trả string 'none'/'null')."""
+    if val is None:
+        return default
+    if isinstance(val, (int, float)):
+        return float(val)
+    if isinstance(val, str):
+        s = val.strip()
+        if not s:
+            return default
+        if s.lower() in ('none', 'null', 'nan', 'n/a', 'na'):
+            return default
+        s = s.replace(',', '')
+        try:
+            return float(s)
+        except (TypeError, ValueError):
+            return default
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return default
+
+
+def safe_float(val):
+    if val is None or val == '':
+        return None
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
+
+
+def safe_int_mm(val):
+    if val is None or val == '':
+        return None
+    try:
+        return int(str(val).replace('mm', '').replace('MM', '').strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_number(raw):
+    if isinstance(raw, dict):
+        raw = raw.get('value') or raw.get('val') or raw.get('name') or raw.get('cid')
+    return raw
+
+
+def extract_label(value):
+    if isinstance(value, dict):
+        return (value.get('name') or value.get('cid') or '').strip()
+    if isinstance(value, (list, tuple)):
+        labels = [extract_label(v) for v in value]
+        return ', '.join(label for label in labels if label)
+    if value in (None, '', False):
+        return ''
+    return str(value).strip()
+
+
+def first_non_empty(*values):
+    for val in values:
+        if isinstance(val, dict):
+            text = extract_label(val)
+        else:
+            text = str(val).strip() if val not in (None, '', False) else ''
+        if text:
+            return text
+    return ''
+
+
+def dto_name(dto):
+    """Plain text từ DTO (ưu tiên name, fallback cid). Dùng cho field Char."""
+    if not dto:
+        return False
+    if isinstance(dto, str):
+        return dto.strip() or False
+    if not isinstance(dto, dict):
+        return False
+    return (dto.get('name') or dto.get('cid') or '').strip() or False
+
+
+def looks_like_code(s):
+    # Avoid treating English name (contains spaces) as a code/default_code.
+    return bool(s) and not any(ch.isspace() for ch in str(s))
+
+
+def pick_code(src, keys):
+    if not isinstance(src, dict):
+        return ''
+    for k in keys:
+        v = src.get(k)
+        if v in (None, False):
+            continue
+        s = str(v).strip()
+        if s and looks_like_code(s):
+            return s
+    return ''
+
+
+def to_selection(raw_val, allowed_keys):
+    """Convert numeric SPH/CYL value to selection key string '-X.XX'.
+    Trả về False nếu giá trị không nằm trong allowed_keys."""
+    if raw_val is None or raw_val == '':
+        return False
+    try:
+        fval = float(raw_val)
+    except (TypeError, ValueError):
+        return False
+    key = f"-{abs(fval):.2f}" if fval < 0 else f"{fval:.2f}"
+    return key if key in allowed_keys else False
+
+
+def as_float(default=0.0):
+    return lambda v: parse_float(v, default)
+
+
+def as_int(v):
+    return int(v or 0)
+
+
+def as_selection(allowed_keys):
+    keys = frozenset(allowed_keys)
+    return lambda v: to_selection(extract_number(v), keys)
+
+
+def number_float(v):
+    return safe_float(extract_number(v))
+
+
+def stripped(v):
+    return (v or '').strip()
+
+
+def rs_gender(v):
+    # RS gender: 0=Nam, 1=Nữ, 2=Unisex → map sang giá trị Selection M/F/U
+    return RS_GENDER_MAP.get(str(v) if v is not None else '', False)
+
+
+# ─── Spec ────────────────────────────────────────────────────────────────────
+class FieldSpec:
+    __slots__ = ('field', 'paths', 'pick', 'default', 'convert', 'lookup', 'empty')
+
+    def __init__(self, field, paths, pick='get', default=None, convert=None, lookup=None, empty=_MISSING):
+        if pick == 'get' and len(paths) != 1:
+            raise ValueError("FieldSpec %s: pick='get' cần đúng 1 path" % field)
+        self.field = field
+        self.paths = tuple(paths)
+        self.pick = pick
+        self.default = default
+        self.convert = convert
+        self.lookup = lookup
+        self.empty = empty
+
+
+SPH_PATHS = ('item.sph', 'item.SPH', 'item.sphValue', 'item.sphVal', 'item.sphDTO', 'item.sphDto', 'item.sphdto')
+CYL_PATHS = ('item.cyl', 'item.CYL', 'item.cylValue', 'item.cylVal', 'item.cylDTO', 'item.cylDto', 'item.cyldto')
+ADD_PATHS = ('item.lensAdd', 'item.add', 'item.ADD', 'item.addValue', 'item.addVal',
+             'item.addDTO', 'item.addDto', 'item.adddto')
+
+# Field chung mọi loại sản phẩm (phần còn lại của _prepare_base_vals là logic
+# nhiều bước: categ, currency, supplier, tax, classification...).
+BASE_SPEC = (
+    FieldSpec('list_price', ['dto.rtPrice'], convert=as_float(0.0)),
+    FieldSpec('country_id', ['dto.codto'], lookup='country'),
+    FieldSpec('warranty_id', ['dto.warrantydto'], lookup='warranty'),
+    FieldSpec('warranty_supplier_id', ['dto.warrantySupplierdto'], lookup='warranty'),
+    FieldSpec('warranty_retail_id', ['dto.warrantyRetailDTO'], lookup='warranty'),
+    FieldSpec('x_eng_name', ['dto.engName'], default=''),
+    FieldSpec('description', ['dto.note'], default=''),
+    FieldSpec('x_uses', ['dto.uses'], default=''),
+    FieldSpec('x_guide', ['dto.guide'], default=''),
+    FieldSpec('x_warning', ['dto.warning'], default=''),
+    FieldSpec('x_preserve', ['dto.preserve'], default=''),
+    FieldSpec('x_accessory_total', ['dto.accessoryTotal'], convert=as_int),
+    FieldSpec('x_currency_zone_code', ['dto.currencyZoneDTO.cid'], default=''),
+    FieldSpec('x_currency_zone_value', ['dto.currencyZoneDTO.value'], convert=as_float(0.0)),
+    FieldSpec('x_ws_price', ['dto.wsPrice', 'dto.wsPriceMax'], pick='or', convert=as_float(0.0)),
+    FieldSpec('x_ws_price_min', ['dto.wsPriceMin'], convert=as_float(0.0)),
+    FieldSpec('x_ws_price_max', ['dto.wsPriceMax'], convert=as_float(0.0)),
+    FieldSpec('manufacturer_months', ['dto.warrantydto.value'], convert=as_int),
+    FieldSpec('company_months', ['dto.warrantySupplierdto.value'], convert=as_int),
+    FieldSpec('bao_hanh_ban_le', ['dto.warrantyRetailDTO.value'], convert=as_int),
+)
+
+# Lens: giá trị None bị bỏ khỏi vals (giữ nguyên dữ liệu cũ trên DB).
+LENS_SPEC = (
+    FieldSpec('lens_base_curve', ['item.base'], convert=safe_float),
+    FieldSpec('lens_uv_id', ['item.uvdto', 'item.uvDto', 'item.uvDTO'], pick='or', lookup='uv', empty=None),
+    FieldSpec('lens_color_int', ['item.colorInt'], pick='or', empty=None),
+    # Màu sắc HMC / Photochromic / Tinted (get-or-create product.cl)
+    FieldSpec('lens_cl_hmc_id', ['item.clhmcdto', 'item.clHmcdto', 'item.clHMCdto', 'item.clHmcDto'],
+              pick='or', lookup='color', empty=None),
+    FieldSpec('lens_cl_pho_id', ['item.clphodto', 'item.clPhodto', 'item.clPHOdto', 'item.clPhoDto'],
+              pick='or', lookup='color', empty=None),
+    FieldSpec('lens_cl_tint_id', ['item.clTintdto', 'item.cltintdto', 'item.clTINTdto', 'item.clTintDto'],
+              pick='or', lookup='color', empty=None),
+    # SPH / CYL Selection: chỉ ghi nếu khớp với danh mục cho phép
+    FieldSpec('x_sph', SPH_PATHS, pick='present', convert='sph'),
+    FieldSpec('x_cyl', CYL_PATHS, pick='present', convert='cyl'),
+    FieldSpec('x_add', ADD_PATHS, pick='present', convert=number_float),
+    FieldSpec('x_axis', ['item.axis', 'item.Axis', 'item.AXIS'], pick='present', convert=safe_int_mm),
+    # x_prism là Float — phải qua safe_float để né placeholder string ("none","null")
+    FieldSpec('x_prism', ['item.prism'], convert=number_float),
+    FieldSpec('x_prism_base', ['item.prismBase', 'item.prism_base'], pick='or', convert=extract_label, empty=False),
+    FieldSpec('x_mir_coating', ['item.mirCoating'], convert=extract_label, empty=None),
+    FieldSpec('x_diameter', ['item.diameter'], convert=safe_int_mm),
+)
+
+# Opt: field scalar + master Many2one; Many2many (material/coating) vẫn ở _prepare_opt_vals.
+OPT_SPEC = (
+    FieldSpec('opt_season', ['item.season'], default=''),
+    FieldSpec('opt_model', ['item.model'], default=''),
+    FieldSpec('opt_serial', ['item.serial'], default=''),
+    FieldSpec('opt_sku', ['item.sku'], default=''),
+    FieldSpec('opt_color', ['item.color'], default=''),
+    FieldSpec('opt_gender', ['item.gender'], convert=rs_gender),
+    FieldSpec('opt_temple_width', ['item.templeWidth'], convert=as_int),
+    FieldSpec('opt_lens_width', ['item.lensWidth'], convert=as_int),
+    FieldSpec('opt_lens_span', ['item.lensSpan'], convert=as_int),
+    FieldSpec('opt_lens_height', ['item.lensHeight'], convert=as_int),
+    FieldSpec('opt_bridge_width', ['item.bridgeWidth'], convert=as_int),
+    # Màu mắt kính / kiểu gọng / càng: API trả tên plain text → Char
+    FieldSpec('opt_color_lens', ['item.colorLensdto'], convert=dto_name),
+    FieldSpec('opt_frame_style', ['item.framedto'], convert=dto_name),
+    FieldSpec('opt_temple_style', ['item.templedto'], convert=dto_name),
+    # Master data gọng – auto-create nếu chưa có bản ghi
+    FieldSpec('opt_frame_type_id', ['item.frameTypedto'], lookup='frame_type'),
+    FieldSpec('opt_shape_id', ['item.shapedto'], lookup='shape'),
+    FieldSpec('opt_ve_id', ['item.vedto'], lookup='ve'),
+    FieldSpec('opt_material_ve_id', ['item.materialVedto'], lookup='material'),
+    FieldSpec('opt_material_lens_id', ['item.materialLensdto'], lookup='material'),
+    # Màu sắc: API trả plain string, lưu vào Char
+    FieldSpec('opt_color_front', ['item.colorFront'], convert=stripped, empty=False),
+    FieldSpec('opt_color_temple', ['item.colorTemple'], convert=stripped, empty=False),
+)
+
+
+# ─── Compiler ────────────────────────────────────────────────────────────────
+def _compile_path(path):
+    root, _, rest = path.partition('.')
+    if root not in ('item', 'dto') or not rest:
+        raise ValueError("Alias path không hợp lệ: %r" % path)
+    use_dto = root == 'dto'
+    keys = rest.split('.')
+    head, last = tuple(keys[:-1]), keys[-1]
+
+    if not head:
+        if use_dto:
+            return lambda item, dto, default=None: dto.get(last, default)
+        return lambda item, dto, default=None: item.get(last, default)
+
+    def getter(item, dto, default=None):
+        src = dto if use_dto else item
+        for key in head:
+            src = src.get(key) or {}
+        return src.get(last, default)
+    return getter
+
+
+def _compile_picker(spec):
+    getters = tuple(_compile_path(p) for p in spec.paths)
+    default = spec.default
+
+    if spec.pick == 'get':
+        getter = getters[0]
+        return lambda item, dto: getter(item, dto, default)
+
+    if spec.pick == 'or':
+        def pick_or(item, dto):
+            for getter in getters:
+                value = getter(item, dto)
+                if value:
+                    return value
+            return default
+        return pick_or
+
+    if spec.pick == 'present':
+        def pick_present(item, dto):
+            for getter in getters:
+                value = getter(item, dto)
+                if value is not None and value != '':
+                    return value
+            return default
+        return pick_present
+
+    raise ValueError("FieldSpec %s: pick=%r không hỗ trợ" % (spec.field, spec.pick))
+
+
+def compile_spec(specs, lookups=None, converters=None):
+    """Compile spec → tuple (field, accessor). Gọi 1 lần mỗi lần sync.
+
+    `lookups`: {tên: fn(rec, cache, value)} — rec/cache truyền lúc apply vì mỗi
+    batch sync chạy trên cursor/env riêng. `converters`: {tên: fn(value)}.
+    """
+    lookups = lookups or {}
+    converters = converters or {}
+    compiled = []
+    for spec in specs:
+        pick = _compile_picker(spec)
+        convert = converters[spec.convert] if isinstance(spec.convert, str) else spec.convert
+        lookup = lookups[spec.lookup] if spec.lookup else None
+        empty = spec.empty
+
+        def accessor(item, dto, rec, cache, pick=pick, convert=convert, lookup=lookup, empty=empty):
+            value = pick(item, dto)
+            if convert is not None:
+                value = convert(value)
+            if lookup is not None:
+                value = lookup(rec, cache, value)
+            if empty is not _MISSING and not value:
+                return empty
+            return value
+        compiled.append((spec.field, accessor))
+    return tuple(compiled)
+
+
+def apply_spec(compiled, item, dto, rec, cache, vals, drop_none=False):
+    """Ghi kết quả các accessor vào `vals` (bỏ None nếu drop_none)."""
+    for field, accessor in compiled:
+        value = accessor(item, dto, rec, cache)
+        if drop_none and value is None:
+            continue
+        vals[field] = value
+    return vals
+
+
+# ─── Phân nhóm (product.classification) ─────────────────────────────────────
+# Quyết định phân nhóm = bảng tra tính sẵn theo
+# (loại, lớp keyword của tên nhóm + tên SP, lớp dấu SPH/CYL, đổi màu).
+# Lớp keyword được memo theo text đã chuẩn hoá → tên nhóm lặp lại không phải quét lại.
+_SPH_KEYS = ('sph', 'SPH', 'sphValue', 'sphVal', 'sphDTO', 'sphDto', 'sphdto')
+_CYL_KEYS = ('cyl', 'CYL', 'cylValue', 'cylVal', 'cylDTO', 'cylDto', 'cyldto')
+
+# Đơn tròng: lớp dấu → (mã thường, mã đổi màu).
+_SINGLE_VISION_CODES = {
+    'zero': ('020101', '020106'),
+    'neg': ('020102', '020107'),
+    'neg_cyl': ('020103', '020108'),
+    'pos': ('020104', '020109'),
+    'pos_cyl': ('020105', '020110'),
+}
+
+
+def _build_classification_table():
+    table = {
+        ('lens', 'bifocal', None, False): '020204',
+        ('lens', 'progressive_far', None, False): '20302',
+        ('lens', 'progressive', None, False): '20301',
+        ('frame', 'sunglass', None, False): '0301',
+        ('frame', 'frame', None, False): '010101',
+        ('accessory', 'case', None, False): '050101',
+        ('accessory', 'cloth', None, False): '050201',
+        ('accessory', 'other', None, False): '050301',
+    }
+    for sign, (plain, photochromic) in _SINGLE_VISION_CODES.items():
+        table[('lens', 'single', sign, False)] = plain
+        table[('lens', 'single', sign, True)] = photochromic
+    return table
+
+
+CLASSIFICATION_TABLE = _build_classification_table()
+
+
+def classification_kind(product_type, default_code=''):
+    dc2 = (default_code or '')[:2]
+    if product_type == 'lens' or dc2 in ('01', '15'):
+        return 'lens'
+    # Trong sync, gọng kính dùng product_type='opt' (không phải 'frame').
+    if product_type in ('frame', 'opt') or dc2 == '04':
+        return 'frame'
+    if product_type == 'accessory':
+        return 'accessory'
+    return None
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def classify_text(kind, group_text, name_text):
+    """(lớp keyword, đổi màu) từ tên nhóm + tên SP đã chuẩn hoá (fold_vn)."""
+    text = ' '.join(h for h in (group_text, name_text) if h)
+    if kind == 'lens':
+        if 'hai trong' in text or 'bifocal' in text or 'flap top' in text:
+            return 'bifocal', False
+        if 'da trong' in text:
+            # Đa tròng: phân biệt cận/viễn theo keyword (nếu có), default cận.
+            return ('progressive_far' if 'vien' in text else 'progressive'), False
+        return 'single', ('doi mau' in text or ' dm ' in f' {text} ')
+    if kind == 'frame':
+        if 'kinh ram' in text or 'sunglass' in text or 'sun glass' in text:
+            return 'sunglass', False
+        return 'frame', False
+    if 'bao kinh' in text:
+        return 'case', False
+    if 'khan lau' in text:
+        return 'cloth', False
+    return 'other', False
+
+
+def _lens_power(src, keys):
+    raw = None
+    for key in keys:
+        if key in src:
+            value = src.get(key)
+            if value is not None and value != '':
+                raw = value
+                break
+    if isinstance(raw, dict):
+        raw = raw.get('value') or raw.get('val') or raw.get('name') or raw.get('cid')
+    if raw in (None, '', False):
+        return None
+    try:
+        return float(raw)
+    except (TypeError, ValueError):
+        return None
+
+
+def power_sign_class(sph, cyl):
+    if sph is None:
+        return None
+    if sph == 0:
+        return 'zero'
+    has_cyl = cyl is not None and cyl != 0
+    return ('neg' if sph < 0 else 'pos') + ('_cyl' if has_cyl else '')
+
+
+def classification_code(product_type, default_code='', group_name='', product_name='', item=None):
+    """Mã product.classification cho 1 item RS, None nếu không suy ra được."""
+    kind = classification_kind(product_type, default_code)
+    if kind is None:
+        return None
+    text_class, photochromic = classify_text(kind, fold_vn(group_name), fold_vn(product_name))
+    sign = None
+    if text_class == 'single':
+        src = item if isinstance(item, dict) else {}
+        sign = power_sign_class(_lens_power(src, _SPH_KEYS), _lens_power(src, _CYL_KEYS))
+    return CLASSIFICATION_TABLE.get((kind, text_class, sign, photochromic))
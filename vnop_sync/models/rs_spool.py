@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""Spool RS dùng chung giữa các company / database trên cùng máy.
+
+Nhiều company (và DB staging) cùng đọc 1 catalog RS: thay vì mỗi nơi tự tải
+lại đủ page + ảnh, consumer đầu tiên tải và ghi xuống spool, các consumer sau
+đọc file local. Spool chỉ chứa dữ liệu thô của RS (JSON page, bytes ảnh); phần
+phụ thuộc company (seller company, thuế mua hàng...) vẫn được áp lúc xử lý
+trong `_preload_all_data` của từng consumer.
+
+- Page: `<dir>/pages/<key endpoint>/<generation>/p<N>.json.gz`. Generation là
+  thời điểm bắt đầu 1 lượt tải; producer (lượt mở generation) giữ flock
+  `producer.lock` tới khi duyệt xong endpoint. Consumer chỉ nhập vào generation
+  khi producer còn chạy (và chưa quá RS_SPOOL_TTL_SEC) → các company chạy cùng
+  lúc đọc chung 1 snapshot, còn lượt sync mở sau khi producer đã xong (kể cả
+  sync lại ngay sau khi sửa dữ liệu RS) luôn tải generation mới.
+- Ảnh: `<dir>/images/<aa>/<sha1 url>` (dòng đầu là content-type), hết hạn sau
+  RS_SPOOL_IMAGE_TTL_SEC.
+- `flock` theo page / ảnh: consumer tới sau chờ consumer đang tải xong rồi đọc
+  file, không gọi RS lần 2. Ghi file qua tmp + rename nên không đọc file dở.
+
+    RS_SPOOL_ENABLED         bật spool, mặc định False
+    RS_SPOOL_DIR             thư mục spool, mặc định <data_dir>/vnop_rs_spool
+    RS_SPOOL_TTL_SEC         tuổi tối đa để nhập vào 1 generation page, mặc định 3600
+    RS_SPOOL_IMAGE_TTL_SEC   tuổi tối đa ảnh, mặc định 86400
+"""
+import fcntl
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+_logger = logging.getLogger(__name__)
+
+_PRODUCER_LOCK = 'producer.lock'
+
+
+def _env_int(name, default, minimum=0):
+    try:
+        return max(minimum, int(os.getenv(name, default)))
+    except (TypeError, ValueError):
+        return int(default)
+
+
+def spool_enabled():
+    return os.getenv('RS_SPOOL_ENABLED', 'False').lower() == 'true'
+
+
+def _spool_root():
+    root = (os.getenv('RS_SPOOL_DIR') or '').strip()
+    if not root:
+        from odoo.tools import config
+        root = os.path.join(config['data_dir'], 'vnop_rs_spool')
+    return root
+
+
+def _sha1(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def _write_atomic(path, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _file_lock(path):
+    """Khoá exclusive liên process (mọi worker / DB trên cùng máy dùng chung file)."""
+    with open(f'{path}.lock', 'a') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _producer_alive(generation_dir):
+    """True khi producer của generation vẫn giữ flock (process chết → flock tự nhả)."""
+    try:
+        fh = open(os.path.join(generation_dir, _PRODUCER_LOCK), 'a')
+    except OSError:
+        return False
+    with fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(fh, fcntl.LOCK_UN)
+        return False
+
+
+class PageSpool:
+    """Page JSON của 1 endpoint RS (cùng base_url, params, page size) trong 1 generation."""
+
+    def __init__(self, base_url, endpoint, size, params=None):
+        self.ttl = _env_int('RS_SPOOL_TTL_SEC', '3600', minimum=1)
+        key = json.dumps([base_url, endpoint, int(size), sorted((params or {}).items())])
+        self.endpoint_dir = os.path.join(_spool_root(), 'pages', _sha1(key))
+        os.makedirs(self.endpoint_dir, exist_ok=True)
+        self.reused = False
+        self._producer_fh = None
+        self.generation_dir = self._acquire_generation()
+
+    def _acquire_generation(self):
+        """Nhập vào generation có producer đang chạy, không thì mở generation mới."""
+        now = int(time.time())
+        with _file_lock(self.endpoint_dir):
+            generations = sorted(
+                (int(name) for name in os.listdir(self.endpoint_dir) if name.isdigit()),
+                reverse=True,
+            )
+            if generations:
+                latest = os.path.join(self.endpoint_dir, str(generations[0]))
+                if now - generations[0] < self.ttl and _producer_alive(latest):
+                    self.reused = True
+                    return latest
+                # Không bao giờ mở lại thư mục của lượt trước (cùng giây).
+                now = max(now, generations[0] + 1)
+            path = os.path.join(self.endpoint_dir, str(now))
+            os.makedirs(path, exist_ok=True)
+            fh = open(os.path.join(path, _PRODUCER_LOCK), 'a')
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            self._producer_fh = fh
+            return path
+
+    def close(self):
+        """Producer duyệt xong: generation không nhận consumer mới (no-op với consumer)."""
+        if self._producer_fh is not None:
+            fcntl.flock(self._producer_fh, fcntl.LOCK_UN)
+            self._producer_fh.close()
+            self._producer_fh = None
+
+    def fetch(self, page, loader):
+        """JSON của page: đọc spool nếu đã có, không thì gọi `loader()` rồi ghi spool.
+
+        Trả (res, from_spool)."""
+        path = os.path.join(self.generation_dir, f'p{int(page)}.json.gz')
+        with _file_lock(path):
+            if os.path.exists(path):
+                with gzip.open(path, 'rb') as fh:
+                    return json.loads(fh.read()), True
+            res = loader()
+            _write_atomic(path, gzip.compress(json.dumps(res, ensure_ascii=False).encode('utf-8')))
+            return res, False
+
+
+class ImageSpool:
+    """Bytes ảnh RS theo URL đầy đủ; an toàn khi gọi từ thread tải ảnh."""
+
+    def __init__(self):
+        self.ttl = _env_int('RS_SPOOL_IMAGE_TTL_SEC', '86400', minimum=1)
+        self.root = os.path.join(_spool_root(), 'images')
+
+    def _path(self, url):
+        digest = _sha1(url)
+        folder = os.path.join(self.root, digest[:2])
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, digest)
+
+    def _read(self, path):
+        try:
+            if time.time() - os.path.getmtime(path) >= self.ttl:
+                return None
+            with open(path, 'rb') as fh:
+                content_type, _sep, content = fh.read().partition(b'\n')
+        except OSError:
+            return None
+        return content, content_type.decode('ascii', 'ignore')
+
+    def fetch(self, url, loader):
+        """(content, content_type, from_spool); `loader()` trả (content, content_type).
+
+        Chỉ spool ảnh hợp lệ — lỗi / nội dung rỗng để consumer sau tự thử lại."""
+        path = self._path(url)
+        cached = self._read(path)
+        if cached:
+            return cached[0], cached[1], True
+        with _file_lock(path):
+            cached = self._read(path)
+            if cached:
+                return cached[0], cached[1], True
+            content, content_type = loader()
+            if content and (not content_type or content_type.startswith('image/')):
+                _write_atomic(path, (content_type or '').encode('ascii', 'ignore') + b'\n' + content)
+            return content, content_type, False
+
+
+def gc_spool():
+    """Xoá generation page quá hạn (producer đã xong) và ảnh quá hạn."""
+    root = _spool_root()
+    if not os.path.isdir(root):
+        return 0
+    now = time.time()
+    page_ttl = _env_int('RS_SPOOL_TTL_SEC', '3600', minimum=1)
+    image_ttl = _env_int('RS_SPOOL_IMAGE_TTL_SEC', '86400', minimum=1)
+    removed = 0
+    pages_root = os.path.join(root, 'pages')
+    for endpoint in os.listdir(pages_root) if os.path.isdir(pages_root) else ():
+        endpoint_dir = os.path.join(pages_root, endpoint)
+        if not os.path.isdir(endpoint_dir):
+            continue
+        generations = sorted((name for name in os.listdir(endpoint_dir) if name.isdigit()), key=int)
+        # Generation cũ hơn 2 × TTL, producer đã xong → không còn lượt sync nào đang đọc.
+        for name in generations:
+            generation_dir = os.path.join(endpoint_dir, name)
+            if now - int(name) >= 2 * page_ttl and not _producer_alive(generation_dir):
+                shutil.rmtree(generation_dir, ignore_errors=True)
+                removed += 1
+    images_root = os.path.join(root, 'images')
+    for dirpath, _dirs, files in os.walk(images_root):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            try:
+                if now - os.path.getmtime(path) >= image_ttl:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+    return removed
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Quản lý token đăng nhập RS (Spring Boot) trong bộ nhớ, dùng chung trong 1 worker process.
+
+- Key theo credential (login URL + username + hash password) → product.sync,
+  server.connector và các thread tải ảnh dùng chung 1 token.
+- Gần hết hạn (RS_TOKEN_REFRESH_MARGIN giây) → refresh NỀN, caller vẫn nhận
+  token cũ còn hạn nên không bị khựng giữa lúc paging.
+- Hết hạn / bị invalidate (401) → chỉ 1 thread login, các thread khác chờ kết quả.
+
+Thời hạn token lấy từ `expiresIn` của response, sau đó claim `exp` của JWT,
+cuối cùng là RS_TOKEN_TTL (mặc định 3600 giây).
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from .rs_client import get_rs_client
+
+_logger = logging.getLogger(__name__)
+
+
+class RsAuthError(Exception):
+    """Login RS thất bại (sai credential, RS không trả token, lỗi mạng...)."""
+    pass
+
+
+def _env_seconds(name, default):
+    try:
+        return max(0.0, float(os.getenv(name, default)))
+    except (TypeError, ValueError):
+        return float(default)
+
+
+def _token_ttl(data, token):
+    """Số giây còn hiệu lực của token vừa nhận."""
+    for key in ('expiresIn', 'expires_in', 'expiresInSeconds'):
+        try:
+            ttl = float(data.get(key))
+        except (TypeError, ValueError):
+            continue
+        if ttl > 0:
+            return ttl
+    try:
+        payload = str(token).split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+        if exp:
+            ttl = float(exp) - time.time()
+            if ttl > 0:
+                return ttl
+    except Exception:
+        pass
+    return _env_seconds('RS_TOKEN_TTL', '3600') or 3600.0
+
+
+class RsTokenManager:
+    """Token cache thread-safe cho 1 bộ credential RS."""
+
+    def __init__(self, login_url, username, password, ssl_verify=False, timeout=30):
+        self.login_url = login_url
+        self.username = username
+        self.password = password
+        self.ssl_verify = ssl_verify
+        self.timeout = timeout
+        self.refresh_margin = _env_seconds('RS_TOKEN_REFRESH_MARGIN', '120')
+        self._token = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._inflight = False
+        self._generation = 0
+        self._last_error = None
+        self._cond = threading.Condition()
+
+    def _login(self):
+        try:
+            response = get_rs_client(self.ssl_verify).post(
+                self.login_url,
+                json={'username': self.username, 'password': self.password},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            data = response.json() or {}
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise RsAuthError(str(e)) from e
+        token = data.get('token') if isinstance(data, dict) else None
+        if not token:
+            raise RsAuthError('Login failed: No token received')
+        return token, _token_ttl(data, token)
+
+    def _login_and_store(self):
+        try:
+            token, ttl = self._login()
+        except Exception as e:
+            with self._cond:
+                self._inflight = False
+                self._last_error = e
+                now = time.monotonic()
+                if self._token and now < self._expires_at:
+                    # Refresh nền lỗi: giữ token cũ, thử lại sau (không spam login).
+                    self._refresh_at = now + min(30.0, (self._expires_at - now) / 2)
+                self._generation += 1
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            now = time.monotonic()
+            self._token = token
+            self._expires_at = now + ttl
+            self._refresh_at = now + ttl - min(self.refresh_margin, ttl / 2)
+            self._inflight = False
+            self._last_error = None
+            self._generation += 1
+            self._cond.notify_all()
+        _logger.info("RS token refreshed for %s (hết hạn sau %ss)", self.username, int(ttl))
+        return token
+
+    def _refresh_in_background(self):
+        try:
+            self._login_and_store()
+        except Exception as e:
+            _logger.warning("RS token background refresh failed for %s: %s", self.username, e)
+
+    def get_token(self):
+        """Trả token còn hạn; login (1 lần cho mọi thread đang chờ) nếu cần."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._token and now < self._expires_at:
+                    if now >= self._refresh_at and not self._inflight:
+                        self._inflight = True
+                        threading.Thread(
+                            target=self._refresh_in_background,
+                            name='rs-token-refresh', daemon=True,
+                        ).start()
+                    return self._token
+                if not self._inflight:
+                    self._inflight = True
+                    break
+                generation = self._generation
+                self._cond.wait_for(lambda: self._generation != generation)
+                if not self._token and self._last_error is not None:
+                    raise RsAuthError(str(self._last_error))
+        return self._login_and_store()
+
+    def invalidate(self, token=None):
+        """Bỏ token (vd RS trả 401). Chỉ bỏ nếu `token` vẫn là token hiện tại,
+        tránh xoá token mới mà thread khác vừa refresh xong."""
+        with self._cond:
+            if token is None or token == self._token:
+                self._token = None
+                self._expires_at = 0.0
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(login_url, username, password, ssl_verify=False, timeout=30):
+    """Trả RsTokenManager dùng chung của process cho bộ credential này."""
+    secret = hashlib.sha256(str(password or '').encode('utf-8')).hexdigest()
+    key = (os.getpid(), login_url, username, secret, bool(ssl_verify))
+    manager = _managers.get(key)
+    if manager is None:
+        with _managers_lock:
+            manager = _managers.get(key)
+            if manager is None:
+                manager = _managers[key] = RsTokenManager(
+                    login_url, username, password, ssl_verify=bool(ssl_verify), timeout=timeout,
+                )
+    manager.timeout = timeout
+    return manager
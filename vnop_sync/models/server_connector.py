@@ -1,10 +1,12 @@
 import os
 import requests
 import logging
-from datetime import datetime, timedelta
 from odoo import models, fields, api
 from odoo.exceptions import UserError
 
+from .rs_client import get_rs_client
+from .rs_token import RsAuthError, get_token_manager
+
 _logger = logging.getLogger(__name__)
 
 
@@ -29,10 +31,6 @@ class ServerConnector(models.Model):
         required=True
     )
 
-    # Token cache (transient - không lưu DB)
-    access_token = fields.Char(string='Access Token', store=False)
-    token_expires_at = fields.Datetime(string='Token hết hạn lúc', store=False)
-
     # Status
     last_sync_date = fields.Datetime(string='Lần đồng bộ gần nhất', readonly=True)
     last_sync_status = fields.Selection([
@@ -52,53 +50,33 @@ class ServerConnector(models.Model):
             })
         return connector
 
-    def _get_valid_token(self):
+    def _get_token_manager(self):
+        """Token manager in-memory dùng chung (product.sync, thread ảnh, _call_api)."""
         self.ensure_one()
+        return get_token_manager(
+            f"{self.api_url}/api/auth/service-token",
+            self.service_username,
+            self.service_password,
+            ssl_verify=True,
+            timeout=10,
+        )
 
-        # Check token cache
-        now = fields.Datetime.now()
-        if self.access_token and self.token_expires_at and self.token_expires_at > now:
-            _logger.info("✅ Using cached token")
-            return self.access_token
-
-        # Token hết hạn → refresh
-        return self._refresh_token()
-
-    def _refresh_token(self):
-        """Lấy token mới từ Spring Boot service account"""
+    def _get_valid_token(self):
+        """Token còn hạn từ cache in-memory của process (tự refresh nền trước khi hết hạn)."""
         self.ensure_one()
-
         try:
-            url = f"{self.api_url}/api/auth/service-token"
-            payload = {
-                "username": self.service_username,
-                "password": self.service_password
-            }
-
-            _logger.info(f"🔄 Requesting token from {url}")
-
-            response = requests.post(url, json=payload, timeout=10)
-            response.raise_for_status()
-
-            data = response.json()
-            token = data.get('token')
-            expires_in = data.get('expiresIn', 3600)
-
-            if not token:
-                raise UserError("No token received from API")
-
-            # Cache token
-            self.access_token = token
-            self.token_expires_at = fields.Datetime.now() + timedelta(seconds=expires_in)
-
-            _logger.info(f"✅ Token refreshed successfully, expires in {expires_in}s")
-            return token
-
-        except requests.exceptions.RequestException as e:
+            return self._get_token_manager().get_token()
+        except RsAuthError as e:
             error_msg = f"Cannot get token from Spring Boot: {str(e)}"
             _logger.error(f"❌ {error_msg}")
             raise UserError(error_msg)
 
+    def _refresh_token(self, stale_token=None):
+        """Bỏ token hiện tại (vd API trả 401) và lấy token mới từ Spring Boot."""
+        self.ensure_one()
+        self._get_token_manager().invalidate(stale_token)
+        return self._get_valid_token()
+
     def _call_api(self, endpoint, method='GET', data=None):
         """Generic method để call API với authentication"""
         self.ensure_one()
@@ -114,16 +92,22 @@ class ServerConnector(models.Model):
         try:
             _logger.info(f"📡 Calling API: {method} {url}")
 
-            if method == 'GET':
-                response = requests.get(url, headers=headers, timeout=30)
-            elif method == 'POST':
-                response = requests.post(url, json=data, headers=headers, timeout=30)
-            elif method == 'PUT':
-                response = requests.put(url, json=data, headers=headers, timeout=30)
-            elif method == 'DELETE':
-                response = requests.delete(url, headers=headers, timeout=30)
-            else:
+            if method not in ('GET', 'POST', 'PUT', 'DELETE'):
                 raise ValueError(f"Unsupported HTTP method: {method}")
+            # RS client dùng chung: pool keep-alive + rate limit + retry/backoff.
+            # Chỉ retry method idempotent để không gửi trùng POST.
+            client = get_rs_client(ssl_verify=True)
+            kwargs = {'headers': headers, 'timeout': 30}
+            if method in ('POST', 'PUT'):
+                kwargs['json'] = data
+            if method == 'POST':
+                kwargs['max_retries'] = 0
+            response = client.request(method, url, **kwargs)
+            if response.status_code == 401:
+                # Token bị revoke trước hạn → login lại 1 lần rồi gửi lại request.
+                token = self._refresh_token(stale_token=token)
+                headers['Authorization'] = f"Bearer {token}"
+                response = client.request(method, url, **kwargs)
 
             response.raise_for_status()
             return response.json()
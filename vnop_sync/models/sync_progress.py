@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Tiến độ sync realtime + cờ dừng trong process.
+
+- `SyncProgress`: đếm theo endpoint, tính throughput/ETA, payload gửi qua bus
+  (`bus.bus._sendone`) ngay trong transaction commit của batch — không thêm
+  commit riêng. Ghi DB (progress_done/progress_message) chỉ ở checkpoint thô
+  (SYNC_PROGRESS_CHECKPOINT_SEC, mặc định 30 giây).
+- `CancelListener`: 1 connection LISTEN `vnop_sync_cancel` cho mỗi (process, db).
+  `action_request_stop` gửi NOTIFY → worker đang sync thấy cờ ngay trong bộ nhớ,
+  không phải mở cursor mới đọc `cancel_requested` trước mỗi batch.
+"""
+import logging
+import os
+import selectors
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+PROGRESS_NOTIFICATION = 'vnop_sync_progress'
+CANCEL_CHANNEL = 'vnop_sync_cancel'
+
+
+def progress_channel(sync_id):
+    return f'{PROGRESS_NOTIFICATION}_{sync_id}'
+
+
+def _checkpoint_interval():
+    try:
+        return max(0.0, float(os.getenv('SYNC_PROGRESS_CHECKPOINT_SEC', '30')))
+    except (TypeError, ValueError):
+        return 30.0
+
+
+class SyncProgress:
+    """Bộ đếm tiến độ của 1 lần sync (chỉ sống trong worker đang chạy)."""
+
+    def __init__(self, sync_id, total=0):
+        self.sync_id = sync_id
+        self.total = int(total or 0)
+        self.done = 0
+        self.failed = 0
+        self.message = ''
+        self.endpoints = {}
+        self.started = time.monotonic()
+        self.checkpoint_interval = _checkpoint_interval()
+        self._last_checkpoint = self.started
+
+    def set_endpoint_total(self, product_type, label, total):
+        self._endpoint(product_type, label)['total'] = int(total or 0)
+
+    def _endpoint(self, product_type, label=None):
+        ep = self.endpoints.get(product_type)
+        if ep is None:
+            ep = self.endpoints[product_type] = {
+                'label': label or product_type, 'done': 0, 'failed': 0, 'total': 0,
+            }
+        return ep
+
+    def add(self, product_type, label, success, failed, message=''):
+        ep = self._endpoint(product_type, label)
+        processed = (success or 0) + (failed or 0)
+        ep['done'] += processed
+        ep['failed'] += failed or 0
+        self.done += processed
+        self.failed += failed or 0
+        if message:
+            self.message = message
+
+    def checkpoint_due(self):
+        """True nếu đã tới lúc ghi tiến độ xuống DB (và đánh dấu đã ghi)."""
+        now = time.monotonic()
+        if now - self._last_checkpoint >= self.checkpoint_interval:
+            self._last_checkpoint = now
+            return True
+        return False
+
+    def payload(self, state='running'):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        rate = self.done / elapsed
+        remaining = max(self.total - self.done, 0)
+        eta = int(remaining / rate) if (rate > 0 and self.total) else None
+        return {
+            'sync_id': self.sync_id,
+            'state': state,
+            'done': self.done,
+            'failed': self.failed,
+            'total': self.total,
+            'percent': round(self.done * 100.0 / self.total, 1) if self.total else 0.0,
+            'rate': round(rate, 1),
+            'eta': eta,
+            'elapsed': int(elapsed),
+            'message': self.message,
+            'endpoints': [dict(ep, key=key) for key, ep in self.endpoints.items()],
+        }
+
+
+class CancelListener:
+    """LISTEN vnop_sync_cancel trên connection riêng; giữ set sync id bị yêu cầu dừng."""
+
+    # Giây chờ mỗi vòng select — cũng là độ trễ tối đa để thread nhận lệnh stop.
+    POLL_TIMEOUT = 1.0
+
+    def __init__(self, dbname):
+        self.dbname = dbname
+        self.refcount = 0
+        self.alive = False
+        self._cancelled = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f'vnop-sync-cancel-{self.dbname}', daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        from odoo import sql_db
+        try:
+            with sql_db.db_connect(self.dbname).cursor() as cr, selectors.DefaultSelector() as sel:
+                cr.execute(f'LISTEN {CANCEL_CHANNEL}')
+                cr.commit()
+                conn = cr._cnx
+                sel.register(conn, selectors.EVENT_READ)
+                self.alive = True
+                while not self._stop.is_set():
+                    if sel.select(self.POLL_TIMEOUT):
+                        conn.poll()
+                        while conn.notifies:
+                            payload = conn.notifies.pop().payload
+                            try:
+                                self._cancelled.add(int(payload))
+                            except (TypeError, ValueError):
+                                continue
+        except Exception as e:
+            _logger.warning("vnop_sync cancel listener (%s) dừng: %s", self.dbname, e)
+        finally:
+            self.alive = False
+
+    def mark(self, sync_id):
+        self._cancelled.add(sync_id)
+
+    def clear(self, sync_id):
+        self._cancelled.discard(sync_id)
+
+    def is_cancelled(self, sync_id):
+        return sync_id in self._cancelled
+
+
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+
+def acquire_cancel_listener(dbname, sync_id):
+    """Bật listener (nếu chưa có) cho db hiện tại; gọi khi job sync bắt đầu."""
+    key = (os.getpid(), dbname)
+    with _listeners_lock:
+        listener = _listeners.get(key)
+        if listener is None or not (listener.alive or listener.refcount):
+            listener = _listeners[key] = CancelListener(dbname)
+            listener.start()
+        listener.refcount += 1
+        listener.clear(sync_id)
+    return listener
+
+
+def release_cancel_listener(dbname, sync_id):
+    """Giảm refcount; job cuối cùng của process thì đóng connection LISTEN."""
+    key = (os.getpid(), dbname)
+    with _listeners_lock:
+        listener = _listeners.get(key)
+        if listener is None:
+            return
+        listener.clear(sync_id)
+        listener.refcount -= 1
+        if listener.refcount <= 0:
+            listener.stop()
+            _listeners.pop(key, None)
+
+
+def get_cancel_listener(dbname):
+    return _listeners.get((os.getpid(), dbname))
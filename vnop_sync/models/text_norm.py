@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Chuẩn hoá text dùng chung cho sync/import, memo bằng LRU có giới hạn.
+
+Payload RS lặp lại rất nhiều chuỗi (tên nhóm, quốc gia, placeholder 'khong',
+'N/A'...). Mỗi hàm dưới đây chỉ chạy `unicodedata.normalize` + regex 1 lần cho
+mỗi chuỗi khác nhau; lần sau lấy từ cache của process.
+
+    TEXT_NORM_CACHE_SIZE   số chuỗi tối đa giữ trong mỗi cache, mặc định 50000
+"""
+import os
+import re
+import unicodedata
+from functools import lru_cache
+
+try:
+    CACHE_SIZE = max(128, int(os.getenv('TEXT_NORM_CACHE_SIZE', '50000')))
+except (TypeError, ValueError):
+    CACHE_SIZE = 50000
+
+PLACEHOLDER_TOKENS = frozenset({
+    'khong', 'none', 'null', 'nil', 'na', 'nill', 'undefined', 'empty',
+    'khongco', 'khongapdung', 'khongxacdinh', 'khongcos', 'noco',
+    'khongbiet', 'khongro', '""', "''",
+})
+
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9]+')
+_SPACES_RE = re.compile(r'\s+')
+
+
+def _strip_combining(text):
+    return ''.join(ch for ch in unicodedata.normalize('NFKD', text) if not unicodedata.combining(ch))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _fold_vn(text):
+    text = unicodedata.normalize('NFD', text)
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    return text.lower().strip()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _spaced_key(text):
+    text = _NON_ALNUM_RE.sub(' ', _strip_combining(text.strip().lower())).strip()
+    return _SPACES_RE.sub(' ', text)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _compact_key(text):
+    return _NON_ALNUM_RE.sub('', _strip_combining(text.strip().lower()))
+
+
+def fold_vn(value):
+    """Bỏ dấu tiếng Việt (đ → d), lower, strip: 'Kính Đổi Màu' → 'kinh doi mau'."""
+    if not value:
+        return ''
+    return _fold_vn(str(value))
+
+
+def spaced_key(value):
+    """Key so khớp tên (quốc gia...): chỉ a-z0-9, các cụm cách nhau 1 space."""
+    if value in (None, False):
+        return ''
+    return _spaced_key(str(value))
+
+
+def compact_key(value):
+    """Key so khớp token (placeholder, số tài khoản...): chỉ a-z0-9, không space."""
+    if value in (None, False):
+        return ''
+    return _compact_key(str(value))
+
+
+def is_placeholder(value):
+    """True khi value rỗng hoặc là placeholder kiểu 'khong', 'none', 'n/a'."""
+    if value in (None, False):
+        return True
+    raw = str(value)
+    if not raw.strip():
+        return True
+    key = _compact_key(raw)
+    return not key or key in PLACEHOLDER_TOKENS
+
+
+def cache_stats():
+    """(hits, misses) cộng dồn của các cache chuẩn hoá — để ghi vào nhật ký sync."""
+    hits = misses = 0
+    for fn in (_fold_vn, _spaced_key, _compact_key):
+        info = fn.cache_info()
+        hits += info.hits
+        misses += info.misses
+    return hits, misses
@@ -0,0 +1,71 @@
+/** @odoo-module **/
+
+import { Component, onMounted, onWillUnmount, useRef, useState } from "@odoo/owl";
+import { registry } from "@web/core/registry";
+import { useService } from "@web/core/utils/hooks";
+import { standardWidgetProps } from "@web/views/widgets/standard_widget_props";
+
+const PAGE_SIZE = 100;
+
+/**
+ * Dòng dữ liệu của file đang kiểm thử trên wizard import: tải từng trang qua
+ * `get_preview_page` khi cuộn tới cuối bảng, thay vì render cả file vào
+ * preview_text (form nhẹ, record wizard nhỏ kể cả file 100k dòng).
+ */
+export class ImportPreviewRows extends Component {
+    static template = "vnop_sync.ImportPreviewRows";
+    static props = { ...standardWidgetProps };
+
+    setup() {
+        this.orm = useService("orm");
+        this.sentinel = useRef("sentinel");
+        this.state = useState({
+            columns: [],
+            rows: [],
+            hasMore: true,
+            loading: false,
+            error: "",
+        });
+        onMounted(() => {
+            this.observer = new IntersectionObserver((entries) => {
+                if (entries.some((entry) => entry.isIntersecting)) {
+                    this.loadMore();
+                }
+            });
+            if (this.sentinel.el) {
+                this.observer.observe(this.sentinel.el);
+            }
+        });
+        onWillUnmount(() => this.observer && this.observer.disconnect());
+    }
+
+    get total() {
+        return this.props.record.data.preview_row_count || 0;
+    }
+
+    async loadMore() {
+        const resId = this.props.record.resId;
+        if (!resId || this.state.loading || !this.state.hasMore) {
+            return;
+        }
+        this.state.loading = true;
+        try {
+            const page = await this.orm.call("product.import.wizard", "get_preview_page", [[resId]], {
+                offset: this.state.rows.length,
+                limit: PAGE_SIZE,
+            });
+            this.state.columns = page.columns;
+            this.state.rows.push(...page.rows);
+            this.state.hasMore = page.has_more;
+        } catch (error) {
+            this.state.error = (error.data && error.data.message) || error.message || String(error);
+            this.state.hasMore = false;
+        } finally {
+            this.state.loading = false;
+        }
+    }
+}
+
+registry.category("view_widgets").add("vnop_import_preview_rows", {
+    component: ImportPreviewRows,
+});
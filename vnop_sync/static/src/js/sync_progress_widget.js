@@ -0,0 +1,69 @@
+/** @odoo-module **/
+
+import { Component, onWillUnmount, useState } from "@odoo/owl";
+import { registry } from "@web/core/registry";
+import { useService } from "@web/core/utils/hooks";
+import { standardWidgetProps } from "@web/views/widgets/standard_widget_props";
+
+const NOTIFICATION = "vnop_sync_progress";
+
+/**
+ * Tiến độ sync realtime trên form product.sync: nhận payload từ bus
+ * (throughput, ETA, bộ đếm theo endpoint) thay vì bấm "Cập nhật" reload form.
+ */
+export class SyncProgressWidget extends Component {
+    static template = "vnop_sync.SyncProgressWidget";
+    static props = { ...standardWidgetProps };
+
+    setup() {
+        this.busService = useService("bus_service");
+        const data = this.props.record.data;
+        this.state = useState({
+            done: data.progress_done || 0,
+            total: data.progress_total || 0,
+            failed: 0,
+            percent: Math.round((data.progress_percent || 0) * 10) / 10,
+            rate: 0,
+            eta: null,
+            message: data.progress_message || "",
+            endpoints: [],
+        });
+        this.channel = `${NOTIFICATION}_${this.props.record.resId}`;
+        this.onProgress = (payload) => this._onProgress(payload);
+        this.busService.addChannel(this.channel);
+        this.busService.subscribe(NOTIFICATION, this.onProgress);
+        onWillUnmount(() => {
+            this.busService.unsubscribe(NOTIFICATION, this.onProgress);
+            this.busService.deleteChannel(this.channel);
+        });
+    }
+
+    _onProgress(payload) {
+        if (!payload || payload.sync_id !== this.props.record.resId) {
+            return;
+        }
+        if (payload.state !== "running") {
+            // Kết thúc (done / cancelled / error): reload để thấy trạng thái + nhật ký.
+            this.props.record.model.load();
+            return;
+        }
+        Object.assign(this.state, payload);
+    }
+
+    formatEta(seconds) {
+        if (seconds === null || seconds === undefined) {
+            return "";
+        }
+        const h = Math.floor(seconds / 3600);
+        const m = Math.floor((seconds % 3600) / 60);
+        const s = seconds % 60;
+        if (h) {
+            return `${h} giờ ${m} phút`;
+        }
+        return m ? `${m} phút ${s} giây` : `${s} giây`;
+    }
+}
+
+registry.category("view_widgets").add("vnop_sync_progress", {
+    component: SyncProgressWidget,
+});
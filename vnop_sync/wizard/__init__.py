@@ -1,2 +1,4 @@
 # -*- coding: utf-8 -*-
+from . import import_file_handoff
+from . import excel_line_import
 from . import product_import_wizard
@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+"""Engine import dòng chứng từ từ Excel (đề nghị mua, đơn bán...) dùng chung.
+
+Wizard con chỉ khai báo model dòng, field cha, cột template và `_line_vals`;
+engine lo phần còn lại:
+
+- đọc sheet dạng stream (openpyxl read_only), không dựng list dict cả file;
+- tra sản phẩm theo mã từng lô `_LINE_BATCH_SIZE`: khớp nguyên văn mã nội bộ
+  trước, sau đó qua chỉ mục mã chuẩn hoá (`product.code.index`: mã nội bộ / mã
+  vạch / mã NCC, không phân biệt hoa thường, khoảng trắng), thuế tra 1 lần; cache
+  dùng chung cho lượt kiểm thử và lượt tạo;
+- tạo dòng theo lô, tắt tracking, không flush giữa các lô → tổng tiền chứng từ
+  cha chỉ recompute 1 lần ở flush cuối;
+- file trên `_LINE_SYNC_THRESHOLD` dòng → queue_job nền, wizard hiển thị tiến độ.
+  Job chạy trong 1 transaction (lỗi → rollback cả file như import đồng bộ), tiến
+  độ ghi bằng cursor riêng.
+"""
+import base64
+import io
+import logging
+
+from openpyxl import load_workbook
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+from odoo.tools import split_every
+
+_logger = logging.getLogger(__name__)
+
+_TAX_USE_LABELS = {'sale': 'bán hàng', 'purchase': 'mua hàng'}
+
+
+class VnopExcelLineImport(models.AbstractModel):
+    _name = 'vnop.excel.line.import'
+    _inherit = ['vnop.import.file.handoff']
+    _description = 'Import dòng chứng từ từ Excel'
+
+    # Khai báo ở wizard con.
+    _line_model = None              # vd 'sale.order.line'
+    _line_parent_field = None       # field m2o của wizard trỏ tới chứng từ cha, vd 'order_id'
+    _line_columns = []              # [(technical_key, label, hint)] — cột template
+    _line_required = ()             # technical_key bắt buộc
+    _line_qty_key = 'quantity'
+    _line_price_key = 'price_unit'
+    _line_tax_use = 'sale'          # type_tax_use của thuế trong cột "taxes"
+    _line_data_start_row = 3        # dòng Excel đầu tiên chứa dữ liệu
+
+    # Số dòng mỗi lô tra sản phẩm + create.
+    _LINE_BATCH_SIZE = 500
+    # Ngưỡng dòng tối đa import đồng bộ (request HTTP). Vượt ngưỡng → đẩy queue_job.
+    _LINE_SYNC_THRESHOLD = 1000
+
+    file_data = fields.Binary(string='File Excel')
+    file_name = fields.Char()
+
+    state = fields.Selection([
+        ('upload', 'Upload'),
+        ('validated', 'Kiểm thử'),
+        ('running', 'Đang import'),
+        ('done', 'Hoàn tất'),
+    ], default='upload')
+    validated_count = fields.Integer(string='Dòng hợp lệ', readonly=True)
+    imported_count = fields.Integer(readonly=True)
+    error_text = fields.Text(readonly=True)
+    progress_total = fields.Integer(string='Tổng số dòng', readonly=True)
+    progress_done = fields.Integer(string='Đã xử lý', readonly=True)
+    progress_percent = fields.Float(string='Tiến độ (%)', compute='_compute_progress_percent')
+    progress_message = fields.Char(string='Trạng thái xử lý', readonly=True)
+
+    @api.depends('progress_total', 'progress_done')
+    def _compute_progress_percent(self):
+        for r in self:
+            r.progress_percent = (r.progress_done / r.progress_total * 100.0) if r.progress_total else 0.0
+
+    # ────────────────────────────────────────────────────────────
+    #   ACTIONS
+    # ────────────────────────────────────────────────────────────
+
+    def action_validate(self):
+        """Kiểm thử file Excel — chỉ validate, không ghi DB."""
+        self.ensure_one()
+        rows, errors = self._iter_line_rows(self._line_file_bytes())
+        if errors:
+            self.write({
+                'state': 'validated',
+                'validated_count': 0,
+                'error_text': '\n'.join(errors),
+            })
+            return self._reopen()
+
+        count, import_errors = self._scan_lines(rows, self._line_lookup_caches())
+        self.write({
+            'state': 'validated',
+            'validated_count': count,
+            'error_text': '\n'.join(import_errors) if import_errors else False,
+        })
+        return self._reopen()
+
+    def action_import(self):
+        """Import chính thức: kiểm toàn file trước, có lỗi thì không tạo dòng nào."""
+        self.ensure_one()
+        raw = self._line_file_bytes()
+        rows, errors = self._iter_line_rows(raw)
+        if errors:
+            self.write({
+                'state': 'done',
+                'imported_count': 0,
+                'error_text': '\n'.join(errors),
+            })
+            return self._reopen()
+
+        caches = self._line_lookup_caches()
+        count, import_errors = self._scan_lines(rows, caches)
+        if import_errors:
+            self.write({
+                'state': 'done',
+                'imported_count': 0,
+                'error_text': '\n'.join(import_errors),
+            })
+            return self._reopen()
+        if not count:
+            raise UserError(_('File không có dữ liệu hợp lệ.'))
+
+        if count > self._LINE_SYNC_THRESHOLD:
+            self.write({
+                'state': 'running',
+                'progress_total': count,
+                'progress_done': 0,
+                'progress_message': _('Đã đưa vào hàng đợi, đang chờ xử lý...'),
+                'error_text': False,
+            })
+            # Commit để worker đọc được state mới; job nhận file theo tham chiếu (filestore).
+            self.env.cr.commit()
+            attachment_id, checksum = self._stash_import_file(raw, self.file_name)
+            self.with_delay(
+                description=_('Import dòng %s: %s (%s dòng)') % (
+                    self[self._line_parent_field].display_name, self.file_name or '?', count),
+            )._import_lines_job(attachment_id, checksum)
+            return self._reopen()
+
+        rows, _errors = self._iter_line_rows(raw)
+        created = self._create_lines(rows, caches)
+        self.write({
+            'state': 'done',
+            'imported_count': created,
+        })
+        return self._reopen()
+
+    def action_back_upload(self):
+        """Quay lại bước upload."""
+        self.ensure_one()
+        self.write({
+            'state': 'upload',
+            'validated_count': 0,
+            'imported_count': 0,
+            'error_text': False,
+            'progress_total': 0,
+            'progress_done': 0,
+            'progress_message': False,
+        })
+        return self._reopen()
+
+    def action_refresh_progress(self):
+        """Reload wizard form (nút Cập nhật ở state 'running')."""
+        self.ensure_one()
+        return self._reopen()
+
+    # ────────────────────────────────────────────────────────────
+    #   BACKGROUND JOB
+    # ────────────────────────────────────────────────────────────
+
+    def _import_lines_job(self, attachment_id, checksum=None):
+        """Worker queue_job: tạo toàn bộ dòng trong 1 transaction rồi ghi kết quả."""
+        self.ensure_one()
+        try:
+            with self._open_import_file(attachment_id, checksum) as fh:
+                rows, errors = self._iter_line_rows(fh)
+                if errors:
+                    raise UserError('\n'.join(errors))
+                created = self._create_lines(
+                    rows, self._line_lookup_caches(), on_batch=self._report_line_progress)
+            # Flush 1 lần: recompute tổng tiền chứng từ cha cho cả file.
+            self.env.flush_all()
+            self.env.cr.commit()
+            self.write({
+                'state': 'done',
+                'imported_count': created,
+                'progress_done': self.progress_total,
+                'progress_message': _('Hoàn tất.'),
+            })
+        except Exception as e:
+            self.env.cr.rollback()
+            _logger.exception('Import dòng %s lỗi', self._line_model)
+            self.write({
+                'state': 'done',
+                'imported_count': 0,
+                'progress_message': _('Lỗi.'),
+                'error_text': str(e),
+            })
+        finally:
+            self._drop_import_file(attachment_id)
+
+    def _report_line_progress(self, done):
+        """Ghi tiến độ bằng cursor riêng (transaction import không commit giữa chừng).
+
+        Transaction chính không ghi wizard trước khi commit nên không tranh khoá / xung đột."""
+        with self.env.registry.cursor() as cr:
+            self.with_env(self.env(cr=cr)).write({
+                'progress_done': done,
+                'progress_message': _('Đã xử lý %s/%s dòng') % (done, self.progress_total),
+            })
+
+    # ────────────────────────────────────────────────────────────
+    #   PARSE (stream)
+    # ────────────────────────────────────────────────────────────
+
+    def _line_file_bytes(self):
+        if not self.file_data:
+            raise UserError(_('Vui lòng upload file Excel.'))
+        return base64.b64decode(self.file_data)
+
+    def _iter_line_rows(self, source):
+        """Mở sheet 1 lượt → (rows_iter, errors).
+
+        `source`: bytes hoặc file object 'rb'. Dòng 1 là technical key; `rows_iter`
+        yield dict {_row, <key>: giá trị} từ `_line_data_start_row`, bỏ dòng trống,
+        workbook đóng khi duyệt xong.
+        """
+        stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+        try:
+            wb = load_workbook(stream, read_only=True, data_only=True)
+        except Exception as e:
+            return iter(()), [_('Không đọc được file Excel: %s') % str(e)]
+
+        ws = wb.active
+        if ws is None:
+            wb.close()
+            return iter(()), [_('File Excel không có sheet nào.')]
+
+        col_keys = {c[0] for c in self._line_columns}
+        col_mapping = {}
+        header = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())
+        for col_idx, val in enumerate(header):
+            val = str(val).strip() if val else ''
+            if val in col_keys:
+                col_mapping[val] = col_idx
+
+        missing = [k for k in self._line_required if k not in col_mapping]
+        if missing:
+            wb.close()
+            return iter(()), [_('Thiếu cột bắt buộc: %s') % ', '.join(missing)]
+        return self._line_rows(wb, ws, col_mapping), []
+
+    def _line_rows(self, wb, ws, col_mapping):
+        start = self._line_data_start_row
+        try:
+            for row_idx, row_cells in enumerate(ws.iter_rows(min_row=start, values_only=True), start=start):
+                if row_cells is None:
+                    continue
+                if all(c is None or str(c).strip() == '' for c in row_cells):
+                    continue
+                row_data = {'_row': row_idx}
+                for key, ci in col_mapping.items():
+                    row_data[key] = row_cells[ci] if ci < len(row_cells) else None
+                yield row_data
+        finally:
+            wb.close()
+
+    # ────────────────────────────────────────────────────────────
+    #   VALIDATE / CREATE (theo lô)
+    # ────────────────────────────────────────────────────────────
+
+    def _line_lookup_caches(self):
+        """{products: {mã: product}, ambiguous / missing: {mã} (nạp dần theo lô),
+        taxes: {amount: tax}}."""
+        taxes = self.env['account.tax'].search([('type_tax_use', '=', self._line_tax_use)])
+        return {
+            'products': {},
+            'ambiguous': set(),
+            'missing': set(),
+            'taxes': {tax.amount: tax for tax in taxes},
+        }
+
+    def _scan_lines(self, rows, caches):
+        """Duyệt toàn file theo lô, không ghi DB → (số dòng hợp lệ, errors)."""
+        count = 0
+        errors = []
+        data_rows = 0
+        for batch in split_every(self._LINE_BATCH_SIZE, rows, list):
+            vals_list, batch_errors = self._prepare_line_vals(batch, caches)
+            count += len(vals_list)
+            errors.extend(batch_errors)
+            data_rows += len(batch)
+        if not data_rows:
+            errors.append(_('File không có dữ liệu (data bắt đầu từ row %s).') % self._line_data_start_row)
+        return count, errors
+
+    def _create_lines(self, rows, caches, on_batch=None):
+        """Tạo dòng theo lô; `on_batch(số dòng đã xử lý)` sau mỗi lô. Trả số dòng đã tạo."""
+        Line = self.env[self._line_model].with_context(
+            tracking_disable=True, mail_create_nolog=True, mail_notrack=True,
+        )
+        created = 0
+        done = 0
+        for batch in split_every(self._LINE_BATCH_SIZE, rows, list):
+            vals_list, errors = self._prepare_line_vals(batch, caches)
+            if errors:
+                # Dữ liệu đổi giữa lúc kiểm thử và lúc import (vd sản phẩm bị archive).
+                raise UserError('\n'.join(errors))
+            Line.create(vals_list)
+            created += len(vals_list)
+            done += len(batch)
+            if on_batch:
+                on_batch(done)
+        return created
+
+    def _prepare_line_vals(self, rows, caches):
+        """1 lô parsed rows → (list create vals, errors)."""
+        errors = []
+        vals_list = []
+
+        # Nạp sản phẩm của lô vào cache (mỗi mã tra chỉ mục tối đa 1 lần cho cả file).
+        product_by_code = caches['products']
+        ambiguous = caches['ambiguous']
+        missing = caches['missing']
+        codes = {self._normalize_code(r.get('default_code')) for r in rows}
+        codes -= {''} | set(product_by_code) | ambiguous | missing
+        if codes:
+            found, multi = self.env['product.code.index']._resolve_codes(codes)
+            product_by_code.update(found)
+            ambiguous.update(multi)
+            missing.update(codes - set(found) - multi)
+        tax_by_amount = caches['taxes']
+
+        labels = {c[0]: c[1] for c in self._line_columns}
+        qty_label = labels.get(self._line_qty_key, self._line_qty_key)
+        price_label = labels.get(self._line_price_key, self._line_price_key)
+        tax_use_label = _TAX_USE_LABELS.get(self._line_tax_use, self._line_tax_use)
+
+        for row in rows:
+            row_num = row['_row']
+
+            code = self._normalize_code(row.get('default_code'))
+            if not code:
+                errors.append(_('Dòng %d: Thiếu mã sản phẩm.') % row_num)
+                continue
+            if code in ambiguous:
+                errors.append(_("Dòng %d: Mã '%s' khớp nhiều sản phẩm, vui lòng dùng mã nội bộ.") % (row_num, code))
+                continue
+            product = product_by_code.get(code)
+            if not product:
+                errors.append(_("Dòng %d: Không tìm thấy sản phẩm với mã '%s'.") % (row_num, code))
+                continue
+
+            try:
+                qty = float(row.get(self._line_qty_key) or 0)
+                if qty <= 0:
+                    raise ValueError
+            except (ValueError, TypeError):
+                errors.append(_('Dòng %d: %s không hợp lệ.') % (row_num, qty_label))
+                continue
+
+            try:
+                price = float(row.get(self._line_price_key) or 0)
+                if price < 0:
+                    raise ValueError
+            except (ValueError, TypeError):
+                errors.append(_('Dòng %d: %s không hợp lệ.') % (row_num, price_label))
+                continue
+
+            tax_ids = []
+            raw_tax = row.get('taxes')
+            tax_raw = str(raw_tax or '').strip()
+            if tax_raw:
+                for part in tax_raw.split(','):
+                    part = part.strip().replace('%', '')
+                    if not part:
+                        continue
+                    try:
+                        amount = float(part)
+                    except ValueError:
+                        errors.append(_("Dòng %d: Thuế '%s' không hợp lệ.") % (row_num, part))
+                        continue
+                    # Excel có thể đọc "8%" thành 0.08 → nhân 100
+                    if amount < 1 and isinstance(raw_tax, float):
+                        amount = round(amount * 100, 2)
+                    tax = tax_by_amount.get(amount)
+                    if not tax:
+                        errors.append(_('Dòng %d: Không tìm thấy thuế %s %s%%.') % (row_num, tax_use_label, part))
+                        continue
+                    tax_ids.append(tax.id)
+
+            vals_list.append(self._line_vals(row, product, qty, price, tax_ids))
+
+        return vals_list, errors
+
+    def _line_vals(self, row, product, qty, price, tax_ids):
+        """Create vals của 1 dòng — wizard con override."""
+        raise NotImplementedError()
+
+    @staticmethod
+    def _normalize_code(raw):
+        """Chuẩn hóa mã SP từ Excel: float 400100000004.0 → str '400100000004'."""
+        if raw is None:
+            return ''
+        if isinstance(raw, float):
+            if raw == int(raw):
+                return str(int(raw)).strip()
+            return str(raw).strip()
+        return str(raw).strip()
+
+    def _reopen(self):
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Bàn giao file upload của wizard cho queue_job theo tham chiếu.
+
+File Excel vài MB không đi qua `queue_job.args` (JSON base64 bị đọc lại mỗi lần
+load job: list view, requeue, quét dead job). Field Binary của wizard đã là
+ir.attachment trong filestore → job chỉ nhận (attachment_id, checksum) của chính
+attachment đó, worker đọc thẳng file trong filestore.
+"""
+import base64
+import io
+from contextlib import contextmanager
+
+from odoo import _, models
+from odoo.exceptions import UserError
+
+
+class VnopImportFileHandoff(models.AbstractModel):
+    _name = 'vnop.import.file.handoff'
+    _description = 'Bàn giao file import cho background job'
+
+    def _import_file_attachment(self, field_name='file_data'):
+        """ir.attachment (filestore) đang giữ nội dung field Binary `field_name` của wizard."""
+        self.ensure_one()
+        return self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_id', '=', self.id),
+            ('res_field', '=', field_name),
+        ], limit=1)
+
+    def _stash_import_file(self, raw=None, filename=None, field_name='file_data'):
+        """(attachment_id, checksum) của file upload để truyền cho job.
+
+        Dùng lại attachment của field Binary; chỉ tạo attachment mới khi field
+        không lưu dạng attachment.
+        """
+        self.ensure_one()
+        attachment = self._import_file_attachment(field_name)
+        if not attachment:
+            if raw is None:
+                raw = base64.b64decode(self[field_name] or b'')
+            attachment = self.env['ir.attachment'].sudo().create({
+                'name': filename or 'import.xlsx',
+                'raw': raw,
+                'res_model': self._name,
+                'res_id': self.id,
+            })
+        return attachment.id, attachment.checksum
+
+    @contextmanager
+    def _open_import_file(self, attachment_id, checksum=None):
+        """File object (rb) của attachment: đọc trực tiếp từ filestore, không nạp cả file."""
+        attachment = self.env['ir.attachment'].sudo().browse(attachment_id).exists()
+        if not attachment:
+            raise UserError(_('File import không còn tồn tại (đã bị dọn hoặc xoá).'))
+        if checksum and attachment.checksum != checksum:
+            raise UserError(_('File import đã bị thay đổi sau khi đưa vào hàng đợi.'))
+        if attachment.store_fname:
+            with open(attachment._full_path(attachment.store_fname), 'rb') as fh:
+                yield fh
+        else:
+            # ir_attachment.location = db: nội dung nằm trong cột db_datas.
+            yield io.BytesIO(attachment.raw or b'')
+
+    def _drop_import_file(self, attachment_id):
+        """Xoá attachment do `_stash_import_file` tạo thêm; attachment của field
+        Binary thuộc về wizard (transient) nên để nguyên."""
+        attachment = self.env['ir.attachment'].sudo().browse(attachment_id).exists()
+        if attachment and not attachment.res_field:
+            attachment.unlink()
@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
 import base64
 import io
+import itertools
+import json
 import logging
 import re
+import threading
+from contextlib import contextmanager
 
 from openpyxl import load_workbook
 
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError
+from odoo.addons.queue_job.delay import group
 
+from ..models.import_staging import StagingProductImport, gc_staging_tables, staging_enabled
+from ..models.import_validation import ImportKeyIndex
 from ..models.product_import_base_inherit import (
     VNOP_TEMPLATE_FIELD_CODE_OVERRIDES,
     VNOP_TEMPLATE_VIRTUAL_IMPORT_COLUMNS,
@@ -16,6 +23,11 @@ from ..models.product_import_base_inherit import (
 
 _logger = logging.getLogger(__name__)
 
+# Map tra cứu master data của `_build_lookup_caches`, dùng chung trong process:
+# {(dbname, company_ids, lang): (chữ ký write_date, caches)}.
+_LOOKUP_CACHE = {}
+_LOOKUP_CACHE_LOCK = threading.Lock()
+
 PRODUCT_TYPE_SELECTION = [
     ('auto', 'Theo Mã nhóm hàng'),
 ]
@@ -299,8 +311,71 @@ class ProductImportMissingRef(models.TransientModel):
         }
 
 
+class ProductImportChunk(models.TransientModel):
+    """Staging 1 đoạn dòng của import VN-label lớn — mỗi đoạn là 1 queue_job.
+
+    Dòng dữ liệu (đã chuẩn hoá) được lưu sẵn khi chia đoạn nên chunk job không
+    phải đọc lại file Excel. `rows_done` + sản phẩm đã tạo được ghi cùng commit
+    của mỗi batch → job chết giữa chừng chạy lại chỉ làm phần còn thiếu.
+    """
+    _name = 'product.import.chunk'
+    _description = 'Đoạn dữ liệu import sản phẩm'
+    _order = 'sequence'
+
+    wizard_id = fields.Many2one('product.import.wizard', ondelete='cascade', required=True, index=True)
+    sequence = fields.Integer(required=True)
+    row_start = fields.Integer(string='Dòng bắt đầu', help='Offset (0-based) trong các dòng dữ liệu của file.')
+    row_count = fields.Integer(string='Số dòng')
+    rows_json = fields.Text(string='Dữ liệu dòng')
+    rows_done = fields.Integer(string='Đã xử lý')
+    state = fields.Selection([
+        ('pending', 'Chờ xử lý'),
+        ('done', 'Xong'),
+    ], default='pending', required=True)
+    created_product_ids = fields.Many2many(
+        'product.template', 'product_import_chunk_product_rel', 'chunk_id', 'product_id',
+        string='Sản phẩm đã tạo',
+    )
+    skipped_existing = fields.Integer()
+    skipped_barcode = fields.Integer()
+    error_text = fields.Text()
+
+    def _run_import_chunk(self):
+        """Job của 1 đoạn: tạo sản phẩm từ `rows_done`, commit tiến độ theo batch."""
+        self.ensure_one()
+        if self.state == 'done':
+            return
+        wizard = self.wizard_id
+        col_index = json.loads(wizard.vn_col_index_json or '{}')
+        rows = json.loads(self.rows_json or '[]')
+        start = self.rows_done
+        base_ids = self.created_product_ids.ids
+        base_existing, base_barcode = self.skipped_existing, self.skipped_barcode
+        base_errors = [e for e in (self.error_text or '').split('\n') if e]
+
+        def _checkpoint(done, result, final=False):
+            vals = {
+                'rows_done': start + done,
+                'created_product_ids': [(6, 0, base_ids + result['created_ids'])],
+                'skipped_existing': base_existing + result['skipped_existing'],
+                'skipped_barcode': base_barcode + result['skipped_barcode'],
+                'error_text': '\n'.join(base_errors + result['errors']) or False,
+            }
+            if final:
+                vals['state'] = 'done'
+            self.write(vals)
+            if not final:
+                self.env.cr.commit()
+
+        result = wizard._create_vn_rows(
+            rows[start:], col_index, row_offset=self.row_start + start, on_batch=_checkpoint,
+        )
+        _checkpoint(len(rows) - start, result, final=True)
+
+
 class ProductImportWizard(models.TransientModel):
     _name = 'product.import.wizard'
+    _inherit = ['vnop.import.file.handoff']
     _description = 'Import sản phẩm từ Excel'
 
     product_type = fields.Selection(
@@ -338,7 +413,9 @@ class ProductImportWizard(models.TransientModel):
         readonly=True,
     )
     error_text = fields.Text(string='Chi tiết lỗi', readonly=True)
+    # Chỉ tóm tắt + issue (vài KB); dòng dữ liệu xem qua `get_preview_page` (widget cuộn).
     preview_text = fields.Html(string='Kết quả kiểm thử', readonly=True, sanitize=False)
+    preview_row_count = fields.Integer(string='Số dòng xem trước', readonly=True)
     missing_ref_ids = fields.One2many(
         'product.import.missing.ref', 'wizard_id',
         string='Master data thiếu',
@@ -346,6 +423,10 @@ class ProductImportWizard(models.TransientModel):
     missing_ref_count = fields.Integer(
         string='SL master thiếu', compute='_compute_missing_ref_count',
     )
+    # Import VN-label lớn: staging theo đoạn, mỗi đoạn 1 queue_job (xem product.import.chunk).
+    import_chunk_ids = fields.One2many('product.import.chunk', 'wizard_id', string='Đoạn import')
+    import_pending_chunk_count = fields.Integer(compute='_compute_import_pending_chunk_count')
+    vn_col_index_json = fields.Char()
 
     @api.depends('missing_ref_ids', 'missing_ref_ids.state')
     def _compute_missing_ref_count(self):
@@ -354,6 +435,11 @@ class ProductImportWizard(models.TransientModel):
                 1 for m in r.missing_ref_ids if m.state == 'pending'
             )
 
+    @api.depends('import_chunk_ids.state')
+    def _compute_import_pending_chunk_count(self):
+        for r in self:
+            r.import_pending_chunk_count = sum(1 for c in r.import_chunk_ids if c.state != 'done')
+
     @api.depends('progress_total', 'progress_done')
     def _compute_progress_percent(self):
         for r in self:
@@ -363,10 +449,15 @@ class ProductImportWizard(models.TransientModel):
     _IMPORT_SYNC_THRESHOLD = 200
     # Kích thước batch khi tạo product.template hàng loạt.
     _IMPORT_BATCH_SIZE = 200
+    # Số dòng mỗi chunk job (import nền chạy song song trên nhiều worker).
+    _IMPORT_CHUNK_SIZE = 1000
+    # Số dòng mỗi lần product.template.load() khi import format kỹ thuật ở nền.
+    _TECH_LOAD_CHUNK_SIZE = 500
 
     def action_refresh_progress(self):
         """Reload wizard form (dùng cho nút Cập nhật ở state 'running')."""
         self.ensure_one()
+        self._sync_chunk_progress()
         return self._reopen()
 
     _MAX_SAMPLE = 5
@@ -417,9 +508,10 @@ class ProductImportWizard(models.TransientModel):
             raise UserError(_('Vui lòng chọn file Excel.'))
 
         raw = base64.b64decode(self.file_data)
-        fmt = self._detect_format(raw)
-        if fmt == 'vn_label':
-            return self._action_test_vn_label(raw)
+        # 1 lần mở workbook: dò header VN-label, nếu có thì đọc tiếp luôn data rows.
+        header, rows, _errors = self._iter_vn_label_excel(raw)
+        if header:
+            return self._action_test_vn_label(header, rows)
         return self._action_test_technical(raw)
 
     def action_import(self):
@@ -428,17 +520,20 @@ class ProductImportWizard(models.TransientModel):
             raise UserError(_('Vui lòng chọn file Excel.'))
 
         raw = base64.b64decode(self.file_data)
-        fmt = self._detect_format(raw)
-        if fmt == 'vn_label':
-            return self._action_import_vn_label(raw)
+        header, rows, _errors = self._iter_vn_label_excel(raw)
+        if header:
+            return self._action_import_vn_label(raw, header, rows)
         return self._action_import_technical(raw)
 
     def action_back_upload(self):
         self.ensure_one()
         self.missing_ref_ids.unlink()
+        self.import_chunk_ids.unlink()
         self.write({
             'state': 'upload',
+            'vn_col_index_json': False,
             'preview_text': False,
+            'preview_row_count': 0,
             'imported_count': 0,
             'imported_lens_count': 0,
             'imported_frame_count': 0,
@@ -476,129 +571,208 @@ class ProductImportWizard(models.TransientModel):
             'context': {'group_by': ['classification_type']},
         }
 
+    # ────────────────────────────────────────────────────────────
+    #   PREVIEW ROWS (phân trang, widget vnop_import_preview_rows)
+    # ────────────────────────────────────────────────────────────
+
+    # Số dòng mỗi trang mặc định / tối đa khi widget xem trước gọi `get_preview_page`.
+    _PREVIEW_PAGE_SIZE = 100
+    _PREVIEW_PAGE_MAX = 500
+    # Số dòng đầu sheet dùng để dò header format kỹ thuật khi xem trước theo trang.
+    _TECH_HEADER_SCAN_ROWS = 50
+
+    def get_preview_page(self, offset=0, limit=None):
+        """1 trang dòng dữ liệu của file đang kiểm thử, đọc lười từ filestore.
+
+        Không lưu dòng nào vào DB: file upload (attachment của `file_data`) chính
+        là kho staging, mỗi trang chỉ đọc tới dòng `offset + limit`. Trả
+        {columns: [{key, label}], rows: [{row_no, cells, error}], offset, has_more}.
+        """
+        self.ensure_one()
+        offset = max(0, int(offset or 0))
+        limit = min(max(1, int(limit or self._PREVIEW_PAGE_SIZE)), self._PREVIEW_PAGE_MAX)
+        with self._open_preview_file() as fh:
+            header, rows, errors = self._iter_vn_label_excel(fh)
+            if not header:
+                rows.close()
+                fh.seek(0)
+                header, rows, errors = self._iter_technical_excel(fh)
+            if not header and not errors:
+                # Header kỹ thuật nằm sâu hơn vùng dò → parse cả sheet (hiếm).
+                rows.close()
+                fh.seek(0)
+                header, data_rows, errors = self._parse_excel(fh)
+                rows = self._close_rows(iter(data_rows))
+            if errors:
+                rows.close()
+                raise UserError('\n'.join(errors))
+            columns = [i for i, f in enumerate(header) if f]
+            keys = [header[i] for i in columns]
+            try:
+                page = list(itertools.islice(rows, offset, offset + limit + 1))
+            finally:
+                rows.close()
+
+        product_fields = self.env['product.template']._fields
+        name_pos = keys.index('name') if 'name' in keys else None
+        result_rows = []
+        for r_idx, row in enumerate(page[:limit]):
+            cells = [row[i] if i < len(row) else '' for i in columns]
+            result_rows.append({
+                'row_no': offset + r_idx + 1,
+                'cells': cells,
+                'error': name_pos is not None and not cells[name_pos],
+            })
+        return {
+            'columns': [
+                {'key': k, 'label': product_fields[k].string if k in product_fields else k}
+                for k in keys
+            ],
+            'rows': result_rows,
+            'offset': offset,
+            'has_more': len(page) > limit,
+        }
+
+    @contextmanager
+    def _open_preview_file(self):
+        """File object của `file_data` (attachment filestore), không giải base64 cả file."""
+        attachment = self._import_file_attachment('file_data')
+        if attachment:
+            with self._open_import_file(attachment.id) as fh:
+                yield fh
+        elif self.file_data:
+            yield io.BytesIO(base64.b64decode(self.file_data))
+        else:
+            raise UserError(_('Vui lòng chọn file Excel.'))
+
     # ────────────────────────────────────────────────────────────
     #   FORMAT DETECTION
     # ────────────────────────────────────────────────────────────
 
-    def _detect_format(self, file_bytes):
-        """'vn_label' nếu có dòng chứa nhãn TV (≥3 nhãn), ngược lại 'technical'."""
-        try:
-            wb = load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
-        except Exception:
-            return 'technical'
-        ws = wb.active
-        if ws is None:
-            wb.close()
-            return 'technical'
+    # Số dòng đầu sheet dùng để dò header nhãn tiếng Việt.
+    _VN_HEADER_SCAN_ROWS = 21
+    # Dòng ghi chú trong file mẫu (không phải data) — chỉ kiểm khi dòng không có tên.
+    _VN_NOTE_MARKERS = (
+        'cho phép tự điền', 'được phép ngăn cách', 'my thêm cột', 'ghi màu phủ gương',
+    )
 
-        for row_idx, row in enumerate(ws.iter_rows(values_only=True)):
-            if row_idx > 20:
-                break
-            cells = [_norm_label(c) for c in row if c not in (None, '')]
-            matches = sum(1 for c in cells if c in VN_LABEL_TO_FIELD)
-            if matches >= 5:
-                wb.close()
-                return 'vn_label'
-        wb.close()
-        return 'technical'
+    def _detect_format(self, file_bytes):
+        """'vn_label' nếu có dòng chứa nhãn TV (≥5 nhãn), ngược lại 'technical'."""
+        header, rows, _errors = self._iter_vn_label_excel(file_bytes)
+        rows.close()
+        return 'vn_label' if header else 'technical'
 
     # ────────────────────────────────────────────────────────────
     #   VN-LABEL FORMAT: PARSE
     # ────────────────────────────────────────────────────────────
 
-    def _parse_vn_label_excel(self, file_bytes):
-        """Parse Excel format VN-label → (header_fields, data_rows, errors)."""
+    def _iter_vn_label_excel(self, file_bytes):
+        """Đọc sheet 1 lượt → (header_fields, rows_iter, errors).
+
+        `file_bytes`: bytes hoặc file object mở 'rb' (file trong filestore, xem
+        `_open_import_file`).
+
+        Header dò trong `_VN_HEADER_SCAN_ROWS` dòng đầu (chỉ các dòng này được giữ
+        tạm); `rows_iter` là generator yield từng data row đã chuẩn hoá, workbook
+        đóng khi generator chạy hết / bị close. Dùng chung cho nhận diện format,
+        kiểm thử và import — không giữ toàn bộ sheet trong bộ nhớ.
+        """
+        empty = iter(())
+        source = io.BytesIO(file_bytes) if isinstance(file_bytes, (bytes, bytearray)) else file_bytes
         try:
-            wb = load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
+            wb = load_workbook(source, read_only=True, data_only=True)
         except Exception as e:
-            return [], [], [_('Không đọc được file Excel: %s') % str(e)]
+            return [], self._close_rows(empty), [_('Không đọc được file Excel: %s') % str(e)]
 
         ws = wb.active
         if ws is None:
             wb.close()
-            return [], [], [_('File Excel không có sheet nào.')]
-
-        all_rows = []
-        for row in ws.iter_rows(values_only=True):
-            all_rows.append([self._normalize_cell(c) for c in row])
-        wb.close()
-
-        if not all_rows:
-            return [], [], [_('File Excel trống.')]
+            return [], self._close_rows(empty), [_('File Excel không có sheet nào.')]
 
+        sheet_rows = ws.iter_rows(values_only=True)
+        head = []
         header_index = None
         best_score = 0
-        for idx, row in enumerate(all_rows):
-            if idx > 20:
-                break
-            cells = [_norm_label(c) for c in row]
-            score = sum(1 for c in cells if c in VN_LABEL_TO_FIELD)
+        for idx, row in enumerate(sheet_rows):
+            head.append(row)
+            score = sum(1 for c in row if c not in (None, '') and _norm_label(c) in VN_LABEL_TO_FIELD)
             if score > best_score and score >= 5:
                 best_score = score
                 header_index = idx
+            if idx + 1 >= self._VN_HEADER_SCAN_ROWS:
+                break
 
+        if not head:
+            wb.close()
+            return [], self._close_rows(empty), [_('File Excel trống.')]
         if header_index is None:
-            return [], [], [_('Không tìm thấy dòng header nhãn tiếng Việt (vd: "Tên đầy đủ", "Mã nhóm hàng").')]
+            wb.close()
+            return [], self._close_rows(empty), [
+                _('Không tìm thấy dòng header nhãn tiếng Việt (vd: "Tên đầy đủ", "Mã nhóm hàng").')
+            ]
 
-        raw_header = all_rows[header_index]
-        # Map từng cột: nhãn → field name | None (skip)
+        # Map từng cột: nhãn → field name | None (cột trống / bỏ đi / không nhận diện)
         header_fields = []
-        for cell in raw_header:
+        for cell in head[header_index]:
             norm = _norm_label(cell)
-            if not norm:
-                header_fields.append(None)
-            elif norm in VN_LABEL_IGNORE:
+            if not norm or norm in VN_LABEL_IGNORE:
                 header_fields.append(None)
-            elif norm in VN_LABEL_TO_FIELD:
-                header_fields.append(VN_LABEL_TO_FIELD[norm])
             else:
-                header_fields.append(None)  # cột không nhận diện → bỏ qua
+                header_fields.append(VN_LABEL_TO_FIELD.get(norm))
 
-        # Data start: dòng tiếp theo có "Tên đầy đủ" hoặc "Mã nhóm hàng" non-empty
-        try:
-            name_col = header_fields.index('name')
-        except ValueError:
-            name_col = None
+        rest = head[header_index + 1:]
+        del head
+        return header_fields, self._vn_data_rows(wb, rest, sheet_rows, header_fields), []
+
+    @staticmethod
+    def _close_rows(rows):
+        """Generator rỗng — để caller luôn nhận được `rows_iter` có `.close()`."""
+        yield from rows
+
+    def _vn_data_rows(self, wb, buffered, sheet_rows, header_fields):
+        """Yield data row chuẩn hoá (mỗi cell normalize đúng 1 lần), bỏ dòng trống / ghi chú.
+
+        Data row = có "Tên đầy đủ" hoặc "Mã nhóm hàng"; dòng ghi chú (marker) không
+        có tên bị bỏ.
+        """
+        width = len(header_fields)
+        name_col = header_fields.index('name') if 'name' in header_fields else None
+        classif_col = (header_fields.index('classification_code')
+                       if 'classification_code' in header_fields else None)
+        normalize = self._normalize_cell
         try:
-            classif_col = header_fields.index('classification_code')
-        except ValueError:
-            classif_col = None
+            for source in (buffered, sheet_rows):
+                for row in source:
+                    cells = [normalize(c) for c in row[:width]]
+                    if len(cells) < width:
+                        cells.extend([''] * (width - len(cells)))
+                    if name_col is not None and cells[name_col]:
+                        yield cells
+                        continue
+                    if classif_col is None or not cells[classif_col]:
+                        continue
+                    joined = ' '.join(cells).lower()
+                    if any(marker in joined for marker in self._VN_NOTE_MARKERS):
+                        continue
+                    yield cells
+        finally:
+            wb.close()
 
-        data_rows = []
-        for row in all_rows[header_index + 1:]:
-            cells = list(row) + [''] * max(0, len(header_fields) - len(row))
-            cells = cells[:len(header_fields)]
-            # Bỏ dòng trống
-            if all(not self._normalize_cell(c) for c in cells):
-                continue
-            # Bỏ note rows (chứa cụm từ note đặc trưng)
-            joined = ' '.join(self._normalize_cell(c).lower() for c in cells)
-            if any(marker in joined for marker in [
-                'cho phép tự điền', 'được phép ngăn cách', 'my thêm cột', 'ghi màu phủ gương',
-            ]) and not (name_col is not None and self._normalize_cell(cells[name_col])):
-                continue
-            # Phải có ít nhất name HOẶC classification để là data row
-            has_name = name_col is not None and self._normalize_cell(cells[name_col])
-            has_classif = classif_col is not None and self._normalize_cell(cells[classif_col])
-            if not has_name and not has_classif:
-                continue
-            data_rows.append([self._normalize_cell(c) for c in cells])
+    def _parse_vn_label_excel(self, file_bytes):
+        """Parse Excel format VN-label → (header_fields, data_rows, errors) với data_rows là list.
 
-        return header_fields, data_rows, []
+        Chỉ dùng cho bước cần duyệt nhiều lượt (import); kiểm thử dùng `_iter_vn_label_excel`.
+        """
+        header, rows, errors = self._iter_vn_label_excel(file_bytes)
+        return header, list(rows), errors
 
     # ────────────────────────────────────────────────────────────
     #   VN-LABEL FORMAT: TEST (preview)
     # ────────────────────────────────────────────────────────────
 
-    def _action_test_vn_label(self, raw):
-        header, rows, errors = self._parse_vn_label_excel(raw)
-        if errors:
-            self.write({
-                'state': 'preview',
-                'preview_text': self._html_error_panel(_('Lỗi đọc file'), '<br/>'.join(errors)),
-            })
-            return self._reopen()
-        if not rows:
+    def _action_test_vn_label(self, header, rows):
+        first = next(rows, None)
+        if first is None:
             self.write({
                 'state': 'preview',
                 'preview_text': self._html_error_panel(
@@ -606,15 +780,22 @@ class ProductImportWizard(models.TransientModel):
             })
             return self._reopen()
 
-        issues, classification_buckets = self._validate_vn_rows(header, rows)
-        html = self._build_vn_preview_html(header, rows, issues, classification_buckets)
-        self.write({'state': 'preview', 'preview_text': html})
+        issues, classification_buckets = self._validate_vn_rows(header, itertools.chain([first], rows))
+        html = self._build_vn_preview_html(header, issues, classification_buckets)
+        self.write({
+            'state': 'preview',
+            'preview_text': html,
+            'preview_row_count': sum(classification_buckets.values()),
+        })
         return self._reopen()
 
     def _validate_vn_rows(self, header, rows):
-        """Trả về (issues, buckets) — buckets={lens: [n], frame: [n], accessory: [n], other: [n]}."""
+        """Duyệt `rows` (iterable) đúng 1 lượt → (issues, buckets).
+
+        buckets={lens: n, frame: n, accessory: n, other: n} — số dòng theo loại.
+        """
         issues = []
-        buckets = {'lens': [], 'frame': [], 'accessory': [], 'other': []}
+        buckets = {'lens': 0, 'frame': 0, 'accessory': 0, 'other': 0}
 
         col_index = {f: i for i, f in enumerate(header) if f}
 
@@ -632,21 +813,29 @@ class ProductImportWizard(models.TransientModel):
 
         empty_name_rows = []
         unknown_classif = {}
-        duplicate_names = {}
-        seen_names = {}
+        key_index = ImportKeyIndex(self.env)
+        # Giá trị master data theo cột, gom ngay trong lượt duyệt này.
+        ref_cols = [(token, col_index[token], token in REF_MULTI_KEYS)
+                    for token in REF_SPECS if token in col_index]
+        ref_values = {token: set() for token, _idx, _multi in ref_cols}
 
         for r_idx, row in enumerate(rows):
             row_no = r_idx + 1
+            for token, idx, multi in ref_cols:
+                raw = (row[idx] or '').strip()
+                if not raw:
+                    continue
+                if multi:
+                    ref_values[token].update(v.strip() for v in re.split(r'[,;]', raw) if v.strip())
+                else:
+                    ref_values[token].add(raw)
             name = (row[name_idx] or '').strip()
             if not name:
                 empty_name_rows.append(row_no)
                 continue
 
             # Duplicate trong file
-            if name in seen_names:
-                duplicate_names.setdefault(name, [seen_names[name]]).append(row_no)
-            else:
-                seen_names[name] = row_no
+            key_index.add(row_no, name)
 
             # Suy category_type
             ctype = 'other'
@@ -659,7 +848,7 @@ class ProductImportWizard(models.TransientModel):
                         ctype = classif.category_type or 'other'
                     else:
                         unknown_classif[code] = unknown_classif.get(code, 0) + 1
-            buckets[ctype].append(row_no)
+            buckets[ctype] += 1
 
         if empty_name_rows:
             sample = empty_name_rows[:self._MAX_SAMPLE]
@@ -673,6 +862,7 @@ class ProductImportWizard(models.TransientModel):
                 'details': [detail],
             })
 
+        duplicate_names = key_index.dup_names
         if duplicate_names:
             details = []
             sample = list(duplicate_names.keys())[:self._MAX_SAMPLE]
@@ -693,13 +883,9 @@ class ProductImportWizard(models.TransientModel):
                 'details': details,
             })
 
-        # 3. Kiểm tra name đã tồn tại trong DB
-        unique_names = list(seen_names.keys())
-        if unique_names:
-            existing = self.env['product.template'].with_context(active_test=False).search_read(
-                [('name', 'in', unique_names)], ['name']
-            )
-            existing_names = [r['name'] for r in existing if r['name']]
+        # 3. Kiểm tra name đã tồn tại trong DB (tra theo lô)
+        if key_index.names:
+            existing_names = sorted(key_index.existing_names())
             if existing_names:
                 details = [', '.join(existing_names[:10])]
                 if len(existing_names) > 10:
@@ -712,12 +898,15 @@ class ProductImportWizard(models.TransientModel):
                 })
 
         # 4. Kiểm tra giá trị M2O/M2M tồn tại
-        self._validate_vn_relational(issues, header, rows, col_index)
+        self._validate_vn_relational(issues, ref_values)
 
         return issues, buckets
 
-    def _validate_vn_relational(self, issues, header, rows, col_index):
-        """Phát hiện giá trị cid/code không tồn tại → đẩy vào missing_ref_ids."""
+    def _validate_vn_relational(self, issues, ref_values):
+        """Phát hiện giá trị cid/code không tồn tại → đẩy vào missing_ref_ids.
+
+        `ref_values`: {token: set giá trị trong file} (gom sẵn ở `_validate_vn_rows`).
+        """
         # Xóa danh sách cũ để tránh nhân đôi khi user ấn Kiểm thử nhiều lần
         self.missing_ref_ids.unlink()
 
@@ -726,23 +915,7 @@ class ProductImportWizard(models.TransientModel):
         total_missing = 0
 
         for token, (model, search_field, field_label, model_label) in REF_SPECS.items():
-            if token not in col_index:
-                continue
-            idx = col_index[token]
-            multi = token in REF_MULTI_KEYS
-            values = set()
-            for row in rows:
-                raw = (row[idx] or '').strip()
-                if not raw:
-                    continue
-                if multi:
-                    for v in re.split(r'[,;]', raw):
-                        v = v.strip()
-                        if v:
-                            values.add(v)
-                else:
-                    values.add(raw)
-
+            values = ref_values.get(token)
             if not values:
                 continue
             if model not in self.env:
@@ -806,22 +979,20 @@ class ProductImportWizard(models.TransientModel):
     #   VN-LABEL FORMAT: IMPORT
     # ────────────────────────────────────────────────────────────
 
-    def _action_import_vn_label(self, raw):
-        # Parse + validate nhanh ở foreground để cho user feedback ngay nếu file lỗi.
-        header, rows, errors = self._parse_vn_label_excel(raw)
-        if errors:
-            self.write({
-                'state': 'done', 'imported_count': 0,
-                'error_text': '\n'.join(errors),
-            })
-            return self._reopen()
-        if not rows:
+    def _action_import_vn_label(self, raw, header, rows):
+        """`rows`: generator từ `_iter_vn_label_excel` — chỉ duyệt 1 lượt để đếm dòng và
+        dựng ImportKeyIndex, không giữ rows trong request (file lớn để job tự đọc lại).
+        """
+        # Validate nhanh ở foreground để cho user feedback ngay nếu file lỗi.
+        col_index = {f: i for i, f in enumerate(header) if f}
+        key_index = self._import_key_index(rows, col_index)
+        total = key_index.row_count
+        if not total:
             self.write({
                 'state': 'done', 'imported_count': 0,
                 'error_text': _('File không có dữ liệu hợp lệ.'),
             })
             return self._reopen()
-        col_index = {f: i for i, f in enumerate(header) if f}
         if 'name' not in col_index:
             self.write({
                 'state': 'done', 'imported_count': 0,
@@ -830,7 +1001,7 @@ class ProductImportWizard(models.TransientModel):
             return self._reopen()
 
         # Chặn import nếu file có trùng tên/barcode hoặc đã tồn tại trong DB.
-        dup_errors = self._assert_no_duplicates(rows, col_index)
+        dup_errors = self._assert_no_duplicates(None, col_index, key_index)
         if dup_errors:
             self.write({
                 'state': 'done', 'imported_count': 0,
@@ -838,15 +1009,16 @@ class ProductImportWizard(models.TransientModel):
             })
             return self._reopen()
 
-        total = len(rows)
         # File nhỏ → chạy đồng bộ (vẫn batched để giảm overhead) để user nhận kết quả ngay.
+        # Chỉ ở nhánh này mới đọc lại file thành list (bị chặn bởi _IMPORT_SYNC_THRESHOLD).
         if total <= self._IMPORT_SYNC_THRESHOLD:
             self.write({
                 'state': 'running', 'progress_total': total, 'progress_done': 0,
                 'progress_message': _('Đang import...'),
                 'imported_count': 0, 'error_text': False,
             })
-            self._run_vn_label_import(header, rows, col_index)
+            _header, small_rows, _errors = self._iter_vn_label_excel(raw)
+            self._run_vn_label_import(header, list(small_rows), col_index, key_index)
             return self._reopen()
 
         # File lớn → enqueue queue_job, UI chuyển sang state 'running' với progressbar.
@@ -861,48 +1033,52 @@ class ProductImportWizard(models.TransientModel):
         })
         # Commit để background worker đọc được state mới + để vượt qua giới hạn HTTP.
         self.env.cr.commit()
-        raw_b64 = base64.b64encode(raw).decode('ascii')
+        # Job chỉ nhận id + checksum của file trong filestore (không nhét base64 vào queue_job.args).
+        attachment_id, checksum = self._stash_import_file(raw, self.file_name)
         self.with_delay(
             description=_('Import VN-label: %s (%s dòng)') % (self.file_name or '?', total),
-        )._import_vn_label_job(raw_b64)
+        )._import_vn_label_job(attachment_id, checksum)
         return self._reopen()
 
-    def _run_vn_label_import(self, header, rows, col_index):
-        """Logic import thực tế. Cập nhật progress sau mỗi batch và commit để
-        UI (state, progress_done) phản ánh tiến độ ngay khi user reload form.
-        Dùng chung cho cả flow đồng bộ và queue_job worker.
+    def _run_vn_label_import(self, header, rows, col_index, key_index=None):
+        """Import đồng bộ (file nhỏ) trong 1 lượt. Cập nhật progress sau mỗi batch và
+        commit để UI (state, progress_done) phản ánh tiến độ ngay khi user reload form.
+        File lớn đi qua chunk job (`_import_vn_label_job`).
         """
         self.ensure_one()
-        caches = self._build_lookup_caches()
+        total = len(rows)
 
-        all_names = list({(r[col_index['name']] or '').strip() for r in rows
-                          if (r[col_index['name']] or '').strip()})
-        existing_names = set()
-        if all_names:
-            existing_names = set(
-                self.env['product.template'].with_context(active_test=False).search([
-                    ('name', 'in', all_names)
-                ]).mapped('name')
-            )
+        def _progress(done, result):
+            self.write({
+                'progress_done': done,
+                'progress_message': _('Đã xử lý %s/%s dòng (%s sản phẩm)') % (
+                    done, total, len(result['created_ids']),
+                ),
+            })
+            # Commit theo batch: persist progress + giải phóng locks.
+            self.env.cr.commit()
 
-        # Barcode duy nhất: pre-fetch các barcode đã tồn tại trong DB.
-        bc_idx = col_index.get('barcode')
-        dc_idx = col_index.get('default_code')  # VN label dùng default_code → barcode
-        all_barcodes = set()
-        for r in rows:
-            for ix in (bc_idx, dc_idx):
-                if ix is None:
-                    continue
-                v = (r[ix] or '').strip() if ix < len(r) else ''
-                if v:
-                    all_barcodes.add(v)
-        existing_barcodes = set()
-        if all_barcodes:
-            existing_barcodes = set(
-                self.env['product.template'].with_context(active_test=False).search([
-                    ('barcode', 'in', list(all_barcodes))
-                ]).mapped('barcode')
-            )
+        result = self._create_vn_rows(rows, col_index, on_batch=_progress, key_index=key_index)
+        self._write_import_result(
+            total, result['created_ids'], result['skipped_existing'],
+            result['skipped_barcode'], result['errors'],
+        )
+
+    def _create_vn_rows(self, rows, col_index, row_offset=0, on_batch=None, key_index=None):
+        """Tạo product.template cho `rows` theo batch `_IMPORT_BATCH_SIZE`.
+
+        `row_offset`: vị trí của rows[0] trong file (để báo số dòng lỗi đúng).
+        `on_batch(done, result)`: gọi sau mỗi batch đầy (caller tự commit).
+        `key_index`: ImportKeyIndex đã dựng ở bước kiểm trùng (dùng lại kết quả tra DB).
+        Trả result = {created_ids, skipped_existing, skipped_barcode, errors}.
+        """
+        caches = self._build_lookup_caches()
+
+        # Tên / mã (barcode + default_code → barcode) đã tồn tại trong DB.
+        if key_index is None:
+            key_index = self._import_key_index(rows, col_index)
+        existing_names = set(key_index.existing_names())
+        existing_barcodes = set(key_index.existing_codes())
 
         # Tắt mail tracking + chatter để giảm chi phí khi tạo hàng loạt.
         Product = self.env['product.template'].with_context(
@@ -911,14 +1087,12 @@ class ProductImportWizard(models.TransientModel):
             mail_notrack=True,
         )
 
-        created_ids = []
-        skipped_existing = 0
-        skipped_barcode = 0
-        errors_per_row = []
+        result = {'created_ids': [], 'skipped_existing': 0, 'skipped_barcode': 0, 'errors': []}
+        created_ids = result['created_ids']
+        errors_per_row = result['errors']
         batch_vals = []
-        batch_meta = []  # [(row_idx, name)]
+        batch_meta = []  # [(row_no, name)]
         batch_size = self._IMPORT_BATCH_SIZE
-        total = len(rows)
 
         def _flush(batch_vals, batch_meta):
             if not batch_vals:
@@ -928,31 +1102,32 @@ class ProductImportWizard(models.TransientModel):
                 created_ids.extend(recs.ids)
             except Exception:
                 # Fallback row-by-row để xác định dòng lỗi cụ thể, không phá hỏng cả batch.
-                for v, (ri, nm) in zip(batch_vals, batch_meta):
+                for v, (row_no, nm) in zip(batch_vals, batch_meta):
                     try:
                         with self.env.cr.savepoint():
                             rec = Product.create(v)
                         created_ids.append(rec.id)
                     except Exception as ee:
-                        errors_per_row.append('Dòng %s ("%s"): %s' % (ri + 1, nm, ee))
+                        errors_per_row.append('Dòng %s ("%s"): %s' % (row_no, nm, ee))
 
         for r_idx, row in enumerate(rows):
+            row_no = row_offset + r_idx + 1
             try:
                 vals = self._row_to_vals(row, col_index, caches)
             except Exception as e:
-                errors_per_row.append('Dòng %s: %s' % (r_idx + 1, str(e)))
+                errors_per_row.append('Dòng %s: %s' % (row_no, str(e)))
                 continue
             if not vals.get('name'):
                 continue
             if vals['name'] in existing_names:
-                skipped_existing += 1
+                result['skipped_existing'] += 1
                 continue
             bc = (vals.get('barcode') or '').strip()
             if bc and bc in existing_barcodes:
-                skipped_barcode += 1
+                result['skipped_barcode'] += 1
                 errors_per_row.append(
                     'Dòng %s ("%s"): mã vạch "%s" đã tồn tại, bỏ qua.' % (
-                        r_idx + 1, vals.get('name'), bc,
+                        row_no, vals.get('name'), bc,
                     )
                 )
                 continue
@@ -960,31 +1135,29 @@ class ProductImportWizard(models.TransientModel):
             if bc:
                 existing_barcodes.add(bc)  # tránh trùng barcode trong cùng file
             batch_vals.append(vals)
-            batch_meta.append((r_idx, vals['name']))
+            batch_meta.append((row_no, vals['name']))
 
             if len(batch_vals) >= batch_size:
                 _flush(batch_vals, batch_meta)
                 batch_vals, batch_meta = [], []
-                done = r_idx + 1
-                self.write({
-                    'progress_done': done,
-                    'progress_message': _('Đã xử lý %s/%s dòng (%s sản phẩm)') % (
-                        done, total, len(created_ids),
-                    ),
-                })
-                # Commit theo batch: persist progress + giải phóng locks.
-                self.env.cr.commit()
+                if on_batch:
+                    on_batch(r_idx + 1, result)
 
         # Flush phần còn lại.
         _flush(batch_vals, batch_meta)
+        return result
 
+    def _write_import_result(self, total, created_ids, skipped_existing, skipped_barcode, errors_per_row):
+        """Ghi kết quả cuối (state done + bộ đếm theo phân loại) lên wizard."""
         # Counters phân loại
-        created = self.env['product.template'].browse(created_ids) if created_ids \
-            else self.env['product.template']
-        lens_n = sum(1 for p in created if p.classification_type == 'lens')
-        frame_n = sum(1 for p in created if p.classification_type == 'frame')
-        acc_n = sum(1 for p in created if p.classification_type == 'accessory')
-        other_n = len(created) - lens_n - frame_n - acc_n
+        counts = {'lens': 0, 'frame': 0, 'accessory': 0}
+        if created_ids:
+            for ctype, count in self.env['product.template'].with_context(active_test=False)._read_group(
+                [('id', 'in', created_ids)], ['classification_type'], ['__count'],
+            ):
+                if ctype in counts:
+                    counts[ctype] += count
+        other_n = len(created_ids) - sum(counts.values())
 
         error_text_parts = []
         if skipped_existing:
@@ -1001,43 +1174,60 @@ class ProductImportWizard(models.TransientModel):
             'progress_done': total,
             'progress_message': _('Hoàn tất.'),
             'imported_count': len(created_ids),
-            'imported_lens_count': lens_n,
-            'imported_frame_count': frame_n,
-            'imported_accessory_count': acc_n,
+            'imported_lens_count': counts['lens'],
+            'imported_frame_count': counts['frame'],
+            'imported_accessory_count': counts['accessory'],
             'imported_other_count': other_n,
             'imported_product_ids': [(6, 0, created_ids)],
             'error_text': '\n\n'.join(error_text_parts) if error_text_parts else False,
         })
 
-    def _import_vn_label_job(self, raw_b64):
-        """Worker queue_job: chạy import VN-label trong background."""
+    def _import_vn_label_job(self, attachment_id, checksum=None):
+        """Worker queue_job: đọc file, chia thành các đoạn staging rồi enqueue chunk job.
+
+        File đọc từ attachment do `_stash_import_file` trả về (attachment của `file_data`).
+        Job chạy lại khi đã chia đoạn (retry / requeue) thì chỉ enqueue lại các đoạn
+        chưa xong, không kiểm trùng lại (sản phẩm đã tạo sẽ bị coi là trùng).
+        File đủ lớn + IMPORT_STAGING_ENGINE → engine staging (COPY + merge SQL) thay cho chunk job.
+        """
         self.ensure_one()
         try:
-            raw = base64.b64decode(raw_b64)
-            header, rows, errors = self._parse_vn_label_excel(raw)
-            if errors or not rows:
-                self.write({
-                    'state': 'done',
-                    'imported_count': 0,
-                    'error_text': '\n'.join(errors) if errors else _('File không có dữ liệu hợp lệ.'),
-                })
-                return
-            col_index = {f: i for i, f in enumerate(header) if f}
-            if 'name' not in col_index:
-                self.write({
-                    'state': 'done', 'imported_count': 0,
-                    'error_text': _('Thiếu cột "Tên đầy đủ" trong file.'),
-                })
+            engine = StagingProductImport(self.env, self.id)
+            if engine.exists():
+                # Job chạy lại sau khi đã COPY: merge tiếp các dòng chưa xong.
+                self._run_vn_label_staging(engine)
                 return
-            # Re-validate trùng vì DB có thể đã đổi giữa lúc enqueue và lúc chạy.
-            dup_errors = self._assert_no_duplicates(rows, col_index)
-            if dup_errors:
-                self.write({
-                    'state': 'done', 'imported_count': 0,
-                    'error_text': _('Không thể import do trùng tên/mã vạch:') + '\n\n' + '\n\n'.join(dup_errors),
-                })
-                return
-            self._run_vn_label_import(header, rows, col_index)
+            if not self.import_chunk_ids:
+                with self._open_import_file(attachment_id, checksum) as fh:
+                    header, rows, errors = self._parse_vn_label_excel(fh)
+                if errors or not rows:
+                    self.write({
+                        'state': 'done',
+                        'imported_count': 0,
+                        'error_text': '\n'.join(errors) if errors else _('File không có dữ liệu hợp lệ.'),
+                    })
+                    return
+                col_index = {f: i for i, f in enumerate(header) if f}
+                if 'name' not in col_index:
+                    self.write({
+                        'state': 'done', 'imported_count': 0,
+                        'error_text': _('Thiếu cột "Tên đầy đủ" trong file.'),
+                    })
+                    return
+                # Re-validate trùng vì DB có thể đã đổi giữa lúc enqueue và lúc chạy.
+                dup_errors = self._assert_no_duplicates(rows, col_index)
+                if dup_errors:
+                    self.write({
+                        'state': 'done', 'imported_count': 0,
+                        'error_text': _('Không thể import do trùng tên/mã vạch:') + '\n\n' + '\n\n'.join(dup_errors),
+                    })
+                    return
+                if staging_enabled(len(rows)):
+                    self._stage_vn_label_rows(engine, rows, col_index)
+                    self._run_vn_label_staging(engine)
+                    return
+                self._split_vn_label_chunks(rows, col_index)
+            self._enqueue_vn_label_chunks()
         except Exception as e:
             _logger.exception('Import VN-label job lỗi')
             self.write({
@@ -1045,6 +1235,143 @@ class ProductImportWizard(models.TransientModel):
                 'progress_message': _('Lỗi.'),
                 'error_text': str(e),
             })
+        finally:
+            self._drop_import_file(attachment_id)
+
+    def _stage_vn_label_rows(self, engine, rows, col_index):
+        """Engine staging: vals từng dòng → COPY vào bảng staging → đánh dấu trùng bằng SQL."""
+        caches = self._build_lookup_caches()
+
+        def _items():
+            for r_idx, row in enumerate(rows):
+                try:
+                    vals = self._row_to_vals(row, col_index, caches)
+                except Exception as e:
+                    yield r_idx + 1, None, str(e)
+                    continue
+                if vals.get('name'):
+                    yield r_idx + 1, vals, None
+
+        engine.create_table()
+        engine.copy_rows(_items())
+        engine.mark_duplicates()
+        self.write({'progress_message': _('Đã nạp %s dòng vào bảng staging, đang ghi sản phẩm...') % len(rows)})
+        # Commit: bảng staging (UNLOGGED) sống qua commit → job lỗi giữa chừng thì chạy tiếp được.
+        self.env.cr.commit()
+
+    def _run_vn_label_staging(self, engine):
+        """Merge bảng staging theo lô (commit mỗi lô) rồi ghi kết quả + xoá bảng."""
+        total = self.progress_total
+
+        def _progress(done, created):
+            self.write({
+                'progress_done': min(total, engine.processed_count()),
+                'progress_message': _('Đã ghi %s dòng (lô vừa xong: %s sản phẩm)') % (done, len(created)),
+            })
+            self.env.cr.commit()
+
+        engine.merge(on_batch=_progress)
+        result = engine.result()
+        self._write_import_result(
+            total, result['created_ids'], result['skipped_existing'],
+            result['skipped_barcode'], result['errors'],
+        )
+        engine.drop()
+
+    @api.autovacuum
+    def _gc_import_staging(self):
+        """DROP bảng staging của wizard đã bị dọn (transient vacuum / job chết giữa chừng)."""
+        gc_staging_tables(self.env.cr, set(self.search([]).ids))
+
+    def _split_vn_label_chunks(self, rows, col_index):
+        """Ghi các đoạn `_IMPORT_CHUNK_SIZE` dòng vào staging product.import.chunk."""
+        size = self._IMPORT_CHUNK_SIZE
+        self.write({
+            'vn_col_index_json': json.dumps(col_index),
+            'progress_message': _('Đang import %s đoạn...') % ((len(rows) + size - 1) // size),
+        })
+        self.env['product.import.chunk'].create([{
+            'wizard_id': self.id,
+            'sequence': seq,
+            'row_start': start,
+            'row_count': len(rows[start:start + size]),
+            'rows_json': json.dumps(rows[start:start + size], ensure_ascii=False),
+        } for seq, start in enumerate(range(0, len(rows), size))])
+
+    def _enqueue_vn_label_chunks(self):
+        """Enqueue các đoạn chưa xong song song (delay group) + job tổng hợp khi tất cả xong."""
+        pending = self.import_chunk_ids.filtered(lambda c: c.state != 'done')
+        if not pending:
+            self._finalize_vn_label_import()
+            return
+        name = self.file_name or '?'
+        chunk_jobs = [
+            chunk.delayable(
+                description=_('Import VN-label: %s (đoạn %s/%s)') % (
+                    name, chunk.sequence + 1, len(self.import_chunk_ids)),
+            )._run_import_chunk()
+            for chunk in pending
+        ]
+        group(*chunk_jobs).on_done(
+            self.delayable(
+                description=_('Import VN-label: %s (tổng hợp)') % name,
+                identity_key=self._finalize_identity_key(),
+            )._finalize_vn_label_import()
+        ).delay()
+
+    def _finalize_identity_key(self):
+        return 'product.import.wizard:%s:finalize' % self.id
+
+    def _cancel_pending_finalize(self):
+        """Huỷ job tổng hợp của lượt trước: có đoạn lỗi thì nó chờ phụ thuộc mãi mãi."""
+        stale = self.env['queue.job'].sudo().search([
+            ('identity_key', '=', self._finalize_identity_key()),
+            ('state', 'in', ('wait_dependencies', 'pending', 'enqueued')),
+        ])
+        if stale:
+            stale.button_cancelled()
+
+    def _finalize_vn_label_import(self):
+        """Job cuối: gộp kết quả các đoạn staging vào bộ đếm của wizard."""
+        self.ensure_one()
+        chunks = self.import_chunk_ids
+        if any(c.state != 'done' for c in chunks):
+            self._sync_chunk_progress()
+            return
+        errors = []
+        for chunk in chunks:
+            errors.extend(e for e in (chunk.error_text or '').split('\n') if e)
+        self._write_import_result(
+            sum(chunks.mapped('row_count')),
+            chunks.created_product_ids.ids,
+            sum(chunks.mapped('skipped_existing')),
+            sum(chunks.mapped('skipped_barcode')),
+            errors,
+        )
+
+    def _sync_chunk_progress(self):
+        """progress_done = tổng rows_done của các đoạn (chunk job không ghi wizard để tránh tranh khoá)."""
+        chunks = self.import_chunk_ids
+        if not chunks or self.state != 'running':
+            return
+        done = sum(chunks.mapped('rows_done'))
+        self.write({
+            'progress_done': done,
+            'progress_message': _('Đã xử lý %s/%s dòng, %s/%s đoạn xong (%s sản phẩm)') % (
+                done, self.progress_total, len(chunks.filtered(lambda c: c.state == 'done')),
+                len(chunks), len(chunks.created_product_ids),
+            ),
+        })
+
+    def action_resume_import(self):
+        """Chạy tiếp các đoạn chưa xong (vd: job đoạn bị lỗi / worker chết)."""
+        self.ensure_one()
+        if not self.import_chunk_ids.filtered(lambda c: c.state != 'done'):
+            raise UserError(_('Không còn đoạn dữ liệu nào cần import.'))
+        self.write({'state': 'running'})
+        self._cancel_pending_finalize()
+        self._enqueue_vn_label_chunks()
+        return self._reopen()
 
     # ────────────────────────────────────────────────────────────
     #   VN-LABEL: ROW → VALS
@@ -1056,71 +1383,95 @@ class ProductImportWizard(models.TransientModel):
         'pcs': 'Cái', 'piece': 'Cái', 'pc': 'Cái',
     }
 
+    # (cache key, model, field khoá, domain) của các map tra cứu master data.
+    _LOOKUP_SPECS = [
+        ('classification_code', 'product.classification', 'code', []),
+        ('category_code', 'product.category', 'code', []),
+        ('country_code', 'res.country', 'code', []),
+        ('uom_name', 'uom.uom', 'name', []),
+        ('lens_index_name', 'product.lens.index', 'name', []),
+        ('lens_design_cid', 'product.design', 'code', []),
+        ('lens_material_code', 'product.lens.material', 'code', []),
+        ('lens_film_cid', 'product.lens.film', 'cid', []),
+        ('lens_uv_cid', 'product.uv', 'cid', []),
+        ('lens_coating_cid', 'product.coating', 'cid', []),
+        ('lens_cl_pho_cid', 'product.lens.photochromic', 'cid', []),
+        ('opt_frame_type_cid', 'product.frame.type', 'cid', []),
+        ('opt_frame_structure_cid', 'product.frame.structure', 'cid', []),
+        ('opt_shape_cid', 'product.shape', 'cid', []),
+        ('opt_ve_cid', 'product.ve', 'cid', []),
+        ('opt_temple_tip_cid', 'product.temple.tip', 'cid', []),
+        ('opt_material_cid', 'product.material', 'cid', []),
+        ('supplier_ref', 'res.partner', 'ref', [('supplier_rank', '>', 0), ('ref', '!=', False)]),
+        ('taxes_name', 'account.tax', 'name', [('type_tax_use', '=', 'sale')]),
+        ('supplier_taxes_name', 'account.tax', 'name', [('type_tax_use', '=', 'purchase')]),
+    ]
+
+    def _lookup_cache_signature(self, model_names):
+        """(model, số dòng, write_date lớn nhất) của các bảng master — 1 query UNION ALL.
+
+        Tạo / sửa / archive làm đổi write_date, xoá làm đổi số dòng → cache bị bỏ.
+        """
+        tables = sorted({self.env[m]._table for m in model_names if m in self.env})
+        if not tables:
+            return ()
+        self.env.flush_all()
+        self.env.cr.execute(' UNION ALL '.join(
+            f"(SELECT '{table}', count(*), max(write_date) FROM {table})" for table in tables
+        ))
+        return tuple(self.env.cr.fetchall())
+
     def _build_lookup_caches(self):
-        env = self.env
+        """Map giá trị Excel → id master data, cache theo (db, company, ngôn ngữ) trong process.
 
-        def cache_by(model, key):
+        Dùng chung giữa các wizard và queue worker cùng process; build lại khi chữ ký
+        write_date / số dòng của bảng master thay đổi. Caller không được sửa map trả về.
+        """
+        env = self.env
+        model_names = [spec[1] for spec in self._LOOKUP_SPECS] + ['product.brand']
+        cache_key = (env.cr.dbname, tuple(env.companies.ids), env.lang)
+        signature = self._lookup_cache_signature(model_names)
+        with _LOOKUP_CACHE_LOCK:
+            cached = _LOOKUP_CACHE.get(cache_key)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        def cache_by(model, key, domain):
             if model not in env:
                 return {}
             CoModel = env[model]
             if key not in CoModel._fields:
                 return {}
             res = {}
-            for r in CoModel.search([]):
+            for r in CoModel.search_read(domain, [key]):
                 v = r[key]
                 if v:
-                    res[str(v).strip()] = r.id
+                    res[str(v).strip()] = r['id']
             return res
 
+        caches = {
+            cache_name: cache_by(model, key, domain)
+            for cache_name, model, key, domain in self._LOOKUP_SPECS
+        }
+
         # UoM cache + alias (CAI / cai → Cái)
-        uom_cache = cache_by('uom.uom', 'name')
+        uom_cache = caches['uom_name']
         for alias, canonical in self._UOM_ALIASES.items():
             if canonical in uom_cache and alias not in uom_cache:
                 uom_cache[alias] = uom_cache[canonical]
 
         # Brand: cho phép tra cứu theo cả code (CID) lẫn name
         brand_cache = {}
-        for r in env['product.brand'].search([]):
-            if r.code:
-                brand_cache[str(r.code).strip()] = r.id
-            if r.name:
-                brand_cache.setdefault(str(r.name).strip(), r.id)
+        for r in env['product.brand'].search_read([], ['code', 'name']):
+            if r['code']:
+                brand_cache[str(r['code']).strip()] = r['id']
+            if r['name']:
+                brand_cache.setdefault(str(r['name']).strip(), r['id'])
+        caches['brand_code'] = brand_cache
 
-        return {
-            'classification_code': cache_by('product.classification', 'code'),
-            'category_code': cache_by('product.category', 'code'),
-            'country_code': cache_by('res.country', 'code'),
-            'brand_code': brand_cache,
-            'uom_name': uom_cache,
-            'lens_index_name': cache_by('product.lens.index', 'name'),
-            'lens_design_cid': cache_by('product.design', 'code'),
-            'lens_material_code': cache_by('product.lens.material', 'code'),
-            'lens_film_cid': cache_by('product.lens.film', 'cid'),
-            'lens_uv_cid': cache_by('product.uv', 'cid'),
-            'lens_coating_cid': cache_by('product.coating', 'cid'),
-            'lens_cl_pho_cid': cache_by('product.lens.photochromic', 'cid'),
-            'opt_frame_type_cid': cache_by('product.frame.type', 'cid'),
-            'opt_frame_structure_cid': cache_by('product.frame.structure', 'cid'),
-            'opt_shape_cid': cache_by('product.shape', 'cid'),
-            'opt_ve_cid': cache_by('product.ve', 'cid'),
-            'opt_temple_tip_cid': cache_by('product.temple.tip', 'cid'),
-            'opt_material_cid': cache_by('product.material', 'cid'),
-            'supplier_ref': {
-                p.ref.strip(): p.id for p in env['res.partner'].search([
-                    ('supplier_rank', '>', 0), ('ref', '!=', False),
-                ]) if p.ref
-            },
-            'taxes_name': {
-                t.name.strip(): t.id for t in env['account.tax'].search([
-                    ('type_tax_use', '=', 'sale'),
-                ]) if t.name
-            },
-            'supplier_taxes_name': {
-                t.name.strip(): t.id for t in env['account.tax'].search([
-                    ('type_tax_use', '=', 'purchase'),
-                ]) if t.name
-            },
-        }
+        with _LOOKUP_CACHE_LOCK:
+            _LOOKUP_CACHE[cache_key] = (signature, caches)
+        return caches
 
     def _row_to_vals(self, row, col_index, caches):
         """Convert một dòng Excel thành dict vals cho product.template.create()."""
@@ -1364,10 +1715,10 @@ class ProductImportWizard(models.TransientModel):
         'other': ('🗂️ Khác / chưa phân loại', 'secondary', '#6c757d'),
     }
 
-    def _build_vn_preview_html(self, header, rows, issues, buckets):
+    def _build_vn_preview_html(self, header, issues, buckets):
         parts = []
 
-        total = sum(len(v) for v in buckets.values())
+        total = sum(buckets.values())
         parts.append(
             '<div class="card mb-3"><div class="card-header fw-bold">📊 Tổng quan</div>'
             '<div class="card-body">'
@@ -1452,15 +1803,17 @@ class ProductImportWizard(models.TransientModel):
                 'details': [', '.join(unknown)],
             })
 
+        # 1 lượt duyệt + tra DB theo lô, dùng chung cho 4 bước kiểm trùng dưới.
+        key_index = self._import_key_index(rows, col_map)
         self._test_required_fields(issues, rows, col_map)
-        self._test_duplicate_names(issues, rows, col_map)
-        self._test_existing_names(issues, rows, col_map)
-        self._test_duplicate_barcodes(issues, rows, col_map)
-        self._test_existing_barcodes(issues, rows, col_map)
+        self._test_duplicate_names(issues, key_index)
+        self._test_existing_names(issues, key_index)
+        self._test_duplicate_barcodes(issues, key_index)
+        self._test_existing_barcodes(issues, key_index)
         self._test_relational_fields(issues, rows, col_map, product_fields)
 
         html = self._build_preview_html(header, rows, col_map, issues)
-        self.write({'state': 'preview', 'preview_text': html})
+        self.write({'state': 'preview', 'preview_text': html, 'preview_row_count': len(rows)})
         return self._reopen()
 
     def _action_import_technical(self, raw):
@@ -1490,95 +1843,144 @@ class ProductImportWizard(models.TransientModel):
             })
             return self._reopen()
 
+        total = len(rows)
+        if total <= self._IMPORT_SYNC_THRESHOLD:
+            # File nhỏ: 1 lần load() trong request, lỗi → rollback cả file như trước.
+            try:
+                ids, error_messages = self._load_technical_chunk(header, rows)
+            except Exception as e:
+                self.write({
+                    'state': 'done',
+                    'imported_count': 0,
+                    'error_text': str(e),
+                })
+                return self._reopen()
+            if error_messages:
+                self.write({
+                    'state': 'done',
+                    'imported_count': 0,
+                    'error_text': '\n'.join(error_messages),
+                })
+                return self._reopen()
+            self._write_import_result(total, ids, 0, 0, [])
+            return self._reopen()
+
+        # File lớn → queue_job, load() theo đoạn + commit từng đoạn (không chạm limit_time_real).
+        self.write({
+            'state': 'running', 'progress_total': total, 'progress_done': 0,
+            'progress_message': _('Đã đưa vào hàng đợi, đang chờ xử lý...'),
+            'imported_count': 0,
+            'imported_lens_count': 0, 'imported_frame_count': 0,
+            'imported_accessory_count': 0, 'imported_other_count': 0,
+            'imported_product_ids': [(5, 0, 0)],
+            'error_text': False,
+        })
+        self.env.cr.commit()
+        attachment_id, checksum = self._stash_import_file(raw, self.file_name)
+        self.with_delay(
+            description=_('Import kỹ thuật: %s (%s dòng)') % (self.file_name or '?', total),
+        )._import_technical_job(attachment_id, checksum)
+        return self._reopen()
+
+    def _load_technical_chunk(self, header, rows, row_offset=0):
+        """1 lần `product.template.load()` → (ids, error_messages).
+
+        load() tự rollback cả đoạn khi có lỗi; message được gắn số dòng theo file.
+        """
         ProductTemplate = self.env['product.template'].with_context(
             import_file=True,
             vnop_import_product_type=self.product_type if self.product_type != 'auto' else 'lens',
         )
+        result = ProductTemplate.load(header, rows)
+        error_messages = []
+        for msg in result.get('messages', []):
+            if msg.get('type') != 'error':
+                continue
+            text = msg.get('message', '')
+            span = msg.get('rows') or {}
+            if 'from' in span:
+                first, last = row_offset + span['from'] + 1, row_offset + span.get('to', span['from']) + 1
+                text = ('Dòng %s: %s' % (first, text)) if first == last else ('Dòng %s-%s: %s' % (first, last, text))
+            error_messages.append(text)
+        if error_messages:
+            return [], error_messages
+        return result.get('ids') or [], []
+
+    def _import_technical_job(self, attachment_id, checksum=None):
+        """Worker queue_job: import format kỹ thuật theo đoạn `_TECH_LOAD_CHUNK_SIZE` dòng.
+
+        Mỗi đoạn 1 lần load() + commit; đoạn lỗi bị bỏ (load rollback đoạn đó),
+        message của mọi đoạn được gộp vào error_text.
+        """
+        self.ensure_one()
         try:
-            result = ProductTemplate.load(header, rows)
+            with self._open_import_file(attachment_id, checksum) as fh:
+                header, rows, errors = self._parse_excel(fh)
+            if errors or not rows:
+                self.write({
+                    'state': 'done', 'imported_count': 0,
+                    'error_text': '\n'.join(errors) if errors else _('File không có dữ liệu.'),
+                })
+                return
+            col_map = {h: i for i, h in enumerate(header) if h}
+            # Re-validate trùng vì DB có thể đã đổi giữa lúc enqueue và lúc chạy.
+            dup_errors = self._assert_no_duplicates(rows, col_map)
+            if dup_errors:
+                self.write({
+                    'state': 'done', 'imported_count': 0,
+                    'error_text': _('Không thể import do trùng tên/mã vạch:') + '\n\n' + '\n\n'.join(dup_errors),
+                })
+                return
+
+            total = len(rows)
+            size = self._TECH_LOAD_CHUNK_SIZE
+            created_ids, error_messages = [], []
+            for start in range(0, total, size):
+                try:
+                    ids, chunk_errors = self._load_technical_chunk(header, rows[start:start + size], row_offset=start)
+                except Exception as e:
+                    self.env.cr.rollback()
+                    ids, chunk_errors = [], ['Dòng %s-%s: %s' % (start + 1, min(start + size, total), e)]
+                created_ids.extend(ids)
+                error_messages.extend(chunk_errors)
+                done = min(start + size, total)
+                self.write({
+                    'progress_done': done,
+                    'progress_message': _('Đã xử lý %s/%s dòng (%s sản phẩm)') % (done, total, len(created_ids)),
+                })
+                # Commit theo đoạn: sản phẩm đã load + tiến độ được giữ kể cả khi đoạn sau lỗi.
+                self.env.cr.commit()
+            self._write_import_result(total, created_ids, 0, 0, error_messages)
         except Exception as e:
+            _logger.exception('Import kỹ thuật job lỗi')
             self.write({
                 'state': 'done',
-                'imported_count': 0,
+                'progress_message': _('Lỗi.'),
                 'error_text': str(e),
             })
-            return self._reopen()
-
-        messages = result.get('messages', [])
-        error_messages = [m.get('message', '') for m in messages if m.get('type') == 'error']
-        if error_messages:
-            self.write({
-                'state': 'done',
-                'imported_count': 0,
-                'error_text': '\n'.join(error_messages),
-            })
-            return self._reopen()
-
-        ids = result.get('ids') or []
-        created = self.env['product.template'].browse(ids) if ids else self.env['product.template']
-        lens_n = sum(1 for p in created if p.classification_type == 'lens')
-        frame_n = sum(1 for p in created if p.classification_type == 'frame')
-        acc_n = sum(1 for p in created if p.classification_type == 'accessory')
-        other_n = len(created) - lens_n - frame_n - acc_n
-
-        self.write({
-            'state': 'done',
-            'imported_count': len(ids),
-            'imported_lens_count': lens_n,
-            'imported_frame_count': frame_n,
-            'imported_accessory_count': acc_n,
-            'imported_other_count': other_n,
-            'imported_product_ids': [(6, 0, ids)],
-            'error_text': False,
-        })
-        return self._reopen()
+        finally:
+            self._drop_import_file(attachment_id)
 
     _DUP_SAMPLE_LIMIT = 10
 
-    def _assert_no_duplicates(self, rows, col_map):
+    def _import_key_index(self, rows, col_map):
+        """ImportKeyIndex của file: trùng tên / mã vạch trong file + tra tồn tại trong DB."""
+        return ImportKeyIndex.from_rows(
+            self.env, rows, col_map.get('name'), col_map.get('barcode'), col_map.get('default_code'),
+        )
+
+    def _assert_no_duplicates(self, rows, col_map, key_index=None):
         """Phát hiện trùng tên/barcode trong file và đã tồn tại trong DB.
         Trả về list message lỗi (rỗng = OK). Caller phải dừng import nếu non-empty.
         """
-        name_idx = col_map.get('name')
-        bc_idx = col_map.get('barcode')
-        if name_idx is None and bc_idx is None:
+        if col_map.get('name') is None and col_map.get('barcode') is None:
             return []
-
-        def _cell(row, idx):
-            return (row[idx] or '').strip() if idx is not None and idx < len(row) else ''
-
-        # Trùng trong file
-        seen_names, dup_names_in_file = {}, {}
-        seen_bcs, dup_bcs_in_file = {}, {}
-        all_names, all_bcs = [], []
-        for i, row in enumerate(rows):
-            nm = _cell(row, name_idx)
-            bc = _cell(row, bc_idx)
-            if nm:
-                all_names.append(nm)
-                if nm in seen_names:
-                    dup_names_in_file.setdefault(nm, [seen_names[nm]]).append(i + 1)
-                else:
-                    seen_names[nm] = i + 1
-            if bc:
-                all_bcs.append(bc)
-                if bc in seen_bcs:
-                    dup_bcs_in_file.setdefault(bc, [seen_bcs[bc]]).append(i + 1)
-                else:
-                    seen_bcs[bc] = i + 1
-
-        # Trùng trong DB
-        Tmpl = self.env['product.template'].with_context(active_test=False)
-        existing_names = set()
-        if all_names:
-            existing_names = set(Tmpl.search(
-                [('name', 'in', list(set(all_names)))]
-            ).mapped('name'))
-        existing_bcs = set()
-        if all_bcs:
-            existing_bcs = set(Tmpl.search(
-                [('barcode', 'in', list(set(all_bcs)))]
-            ).mapped('barcode'))
+        if key_index is None:
+            key_index = self._import_key_index(rows, col_map)
+        dup_names_in_file = key_index.dup_names
+        dup_bcs_in_file = key_index.dup_barcodes
+        existing_names = key_index.existing_names() if col_map.get('name') is not None else set()
+        existing_bcs = key_index.existing_barcodes()
 
         errors = []
         if dup_names_in_file:
@@ -1715,21 +2117,8 @@ class ProductImportWizard(models.TransientModel):
                     'details': [detail],
                 })
 
-    def _test_duplicate_names(self, issues, rows, col_map):
-        if 'name' not in col_map:
-            return
-        idx = col_map['name']
-        seen = {}
-        duplicates = {}
-        for i, row in enumerate(rows):
-            name = row[idx].strip()
-            if not name:
-                continue
-            if name in seen:
-                duplicates.setdefault(name, [seen[name]]).append(i + 1)
-            else:
-                seen[name] = i + 1
-
+    def _test_duplicate_names(self, issues, key_index):
+        duplicates = key_index.dup_names
         if not duplicates:
             return
 
@@ -1746,20 +2135,8 @@ class ProductImportWizard(models.TransientModel):
             'details': details,
         })
 
-    def _test_duplicate_barcodes(self, issues, rows, col_map):
-        if 'barcode' not in col_map:
-            return
-        idx = col_map['barcode']
-        seen = {}
-        duplicates = {}
-        for i, row in enumerate(rows):
-            bc = (row[idx] or '').strip() if idx < len(row) else ''
-            if not bc:
-                continue
-            if bc in seen:
-                duplicates.setdefault(bc, [seen[bc]]).append(i + 1)
-            else:
-                seen[bc] = i + 1
+    def _test_duplicate_barcodes(self, issues, key_index):
+        duplicates = key_index.dup_barcodes
         if not duplicates:
             return
         details = []
@@ -1775,18 +2152,10 @@ class ProductImportWizard(models.TransientModel):
             'details': details,
         })
 
-    def _test_existing_barcodes(self, issues, rows, col_map):
-        if 'barcode' not in col_map:
-            return
-        idx = col_map['barcode']
-        unique_bcs = list({(row[idx] or '').strip() for row in rows
-                           if idx < len(row) and (row[idx] or '').strip()})
-        if not unique_bcs:
+    def _test_existing_barcodes(self, issues, key_index):
+        if not key_index.barcodes:
             return
-        existing = self.env['product.template'].with_context(active_test=False).search_read(
-            [('barcode', 'in', unique_bcs)], ['barcode'],
-        )
-        existing_bcs = [r['barcode'] for r in existing if r['barcode']]
+        existing_bcs = sorted(key_index.existing_barcodes())
         if not existing_bcs:
             return
         details = [', '.join(existing_bcs[:10])]
@@ -1798,19 +2167,10 @@ class ProductImportWizard(models.TransientModel):
             'details': details,
         })
 
-    def _test_existing_names(self, issues, rows, col_map):
-        if 'name' not in col_map:
+    def _test_existing_names(self, issues, key_index):
+        if not key_index.names:
             return
-        idx = col_map['name']
-        unique_names = list({row[idx].strip() for row in rows if row[idx].strip()})
-        if not unique_names:
-            return
-
-        existing = self.env['product.template'].with_context(active_test=False).search_read(
-            [('name', 'in', unique_names)],
-            ['name'],
-        )
-        existing_names = [r['name'] for r in existing if r['name']]
+        existing_names = sorted(key_index.existing_names())
         if not existing_names:
             return
 
@@ -1875,9 +2235,11 @@ class ProductImportWizard(models.TransientModel):
             })
 
     def _parse_excel(self, file_bytes):
+        """Parse format kỹ thuật; `file_bytes` là bytes hoặc file object 'rb'."""
         errors = []
+        source = io.BytesIO(file_bytes) if isinstance(file_bytes, (bytes, bytearray)) else file_bytes
         try:
-            wb = load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
+            wb = load_workbook(source, read_only=True, data_only=True)
         except Exception as e:
             return [], [], [_('Không đọc được file Excel: %s') % str(e)]
 
@@ -1918,6 +2280,61 @@ class ProductImportWizard(models.TransientModel):
 
         return header, data_rows, errors
 
+    def _iter_technical_excel(self, file_bytes):
+        """Như `_parse_excel` nhưng data row là generator → (header, rows_iter, errors).
+
+        Header dò trong `_TECH_HEADER_SCAN_ROWS` dòng đầu; không thấy thì trả
+        header rỗng, không lỗi — caller quay về `_parse_excel` (dò cả sheet).
+        Workbook đóng khi generator chạy hết / bị close.
+        """
+        empty = iter(())
+        source = io.BytesIO(file_bytes) if isinstance(file_bytes, (bytes, bytearray)) else file_bytes
+        try:
+            wb = load_workbook(source, read_only=True, data_only=True)
+        except Exception as e:
+            return [], self._close_rows(empty), [_('Không đọc được file Excel: %s') % str(e)]
+
+        ws = wb.active
+        if ws is None:
+            wb.close()
+            return [], self._close_rows(empty), [_('File Excel không có sheet nào.')]
+
+        sheet_rows = ws.iter_rows(values_only=True)
+        head = [
+            [self._normalize_cell(c) for c in row]
+            for row in itertools.islice(sheet_rows, self._TECH_HEADER_SCAN_ROWS)
+        ]
+        if not head:
+            wb.close()
+            return [], self._close_rows(empty), [_('File Excel trống.')]
+        header_index = self._find_header_index(head, set(self.env['product.template']._fields))
+        if header_index is None:
+            wb.close()
+            return [], self._close_rows(empty), []
+
+        header = [self._translate_token(c) for c in head[header_index]]
+        return header, self._technical_data_rows(wb, head[header_index + 1:], sheet_rows, header), []
+
+    def _technical_data_rows(self, wb, buffered, sheet_rows, header):
+        """Yield data row (chuẩn hoá, cắt / đệm theo header) từ dòng data đầu tiên, bỏ dòng trống."""
+        header_len = len(header)
+        key_indices = self._data_key_indices(header)
+        started = False
+        try:
+            for source in (buffered, sheet_rows):
+                for row in source:
+                    cells = [self._normalize_cell(c) for c in row]
+                    if not started:
+                        started = self._is_data_start_row(cells, header_len, key_indices)
+                        if not started:
+                            continue
+                    if not any(cells):
+                        continue
+                    cells.extend([''] * (header_len - len(cells)))
+                    yield cells[:header_len]
+        finally:
+            wb.close()
+
     def _translate_token(self, token):
         return self._CODE_TO_FIELD.get(token, token)
 
@@ -1961,6 +2378,15 @@ class ProductImportWizard(models.TransientModel):
         return best_index
 
     def _find_data_start(self, rows, header_index, header_tokens, product_fields):
+        key_indices = self._data_key_indices(header_tokens)
+        for row_index in range(header_index + 1, len(rows)):
+            if self._is_data_start_row(rows[row_index], len(header_tokens), key_indices):
+                return row_index
+        return len(rows)
+
+    @staticmethod
+    def _data_key_indices(header_tokens):
+        """Vị trí các cột khoá: dòng có giá trị ở 1 cột này là dòng data đầu tiên."""
         key_fields = {
             'name', 'default_code', 'standard_price', 'list_price',
             'len_type', 'opt_model', 'opt_sku',
@@ -1971,23 +2397,18 @@ class ProductImportWizard(models.TransientModel):
             'design_cid', 'shape_cid', 'design_id', 'shape_id',
         }
         key_fields = key_fields | key_display
-        key_indices = [i for i, t in enumerate(header_tokens) if t in key_fields]
-        header_len = len(header_tokens)
+        return [i for i, t in enumerate(header_tokens) if t in key_fields]
 
-        for row_index in range(header_index + 1, len(rows)):
-            row = rows[row_index]
-            non_empty = [
-                i for i in range(min(len(row), header_len))
-                if self._normalize_cell(row[i])
-            ]
-            if not non_empty:
-                continue
-            if key_indices and any(i in non_empty for i in key_indices):
-                return row_index
-            if len(non_empty) >= 2:
-                return row_index
-
-        return len(rows)
+    def _is_data_start_row(self, row, header_len, key_indices):
+        non_empty = [
+            i for i in range(min(len(row), header_len))
+            if self._normalize_cell(row[i])
+        ]
+        if not non_empty:
+            return False
+        if key_indices and any(i in non_empty for i in key_indices):
+            return True
+        return len(non_empty) >= 2
 
     @staticmethod
     def _normalize_cell(value):